@@ -0,0 +1,74 @@
+"""
+Measures what debug tracing costs on the hot path.
+
+With mohawk installed in your environment (see the developer docs), run::
+
+    python benchmarks/tracing.py
+
+With the DEBUG level disabled, rejecting a tampered request should cost
+about the same as rejecting it with all logging switched off. The time
+it would take to format the request body is printed for comparison.
+"""
+import logging
+import timeit
+
+from mohawk import Receiver, Sender
+from mohawk.exc import MisComputedContentHash
+
+credentials = {'id': 'some-sender',
+               'key': 'a long, complicated secret',
+               'algorithm': 'sha256'}
+url = 'https://some-service.net/system?with=query'
+body = 'x' * (1024 * 1024)
+content_type = 'text/plain'
+sender = Sender(credentials, url, 'POST',
+                content=body, content_type=content_type)
+tampered = 'y' + body[1:]
+
+
+def receive_tampered():
+    try:
+        Receiver(lambda id: credentials, sender.request_header, url, 'POST',
+                 content=tampered, content_type=content_type,
+                 seen_nonce=lambda *args: False)
+    except MisComputedContentHash:
+        pass
+    else:
+        raise AssertionError('expected a hash mismatch')
+
+
+def run(label, number=10):
+    best = min(timeit.repeat(receive_tampered, number=number, repeat=5))
+    print('{label:<32} {usec:10.1f} usec/request'
+          .format(label=label, usec=best / number * 1e6))
+
+
+class FormattingHandler(logging.Handler):
+    """Formats every record like a real handler would but drops it."""
+
+    def emit(self, record):
+        self.format(record)
+
+
+def main():
+    log = logging.getLogger('mohawk')
+    log.addHandler(FormattingHandler())
+    log.propagate = False
+
+    logging.disable(logging.CRITICAL)
+    run('logging disabled')
+    logging.disable(logging.NOTSET)
+
+    log.setLevel(logging.INFO)
+    run('mohawk DEBUG disabled')
+
+    log.setLevel(logging.DEBUG)
+    run('mohawk DEBUG enabled')
+
+    best = min(timeit.repeat(lambda: repr(tampered), number=50, repeat=5))
+    print('{label:<32} {usec:10.1f} usec/request'
+          .format(label='formatting the body alone', usec=best / 50 * 1e6))
+
+
+if __name__ == '__main__':
+    main()
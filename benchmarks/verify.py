@@ -0,0 +1,77 @@
+"""
+Measures how long it takes to verify requests, responses and bewits.
+
+With mohawk installed in your environment (see the developer docs), run::
+
+    python benchmarks/verify.py
+
+Each line is the best time of a few runs for one algorithm.
+Compare the numbers before and after a change to the verification path.
+"""
+import logging
+import timeit
+
+from mohawk import Receiver, Sender
+from mohawk.bewit import BewitCache, check_bewit, get_bewit
+from mohawk.base import Resource
+from mohawk.util import compile_credentials
+
+url = 'https://some-service.net/system?with=query'
+content = b'{"some": "json", "with": ["a", "short", "list"]}'
+content_type = 'application/json'
+
+
+def never_seen(*args):
+    return False
+
+
+def benchmarks(algorithm):
+    credentials = compile_credentials({'id': 'some-sender',
+                                       'key': 'a long, complicated secret',
+                                       'algorithm': algorithm})
+    sender = Sender(credentials, url, 'POST',
+                    content=content, content_type=content_type)
+    receiver = Receiver(lambda id: credentials, sender.request_header,
+                        url, 'POST', content=content,
+                        content_type=content_type, seen_nonce=never_seen)
+    response_header = receiver.respond(content=content,
+                                       content_type=content_type)
+    bewit_url = '{url}&bewit={bewit}'.format(url=url, bewit=get_bewit(
+        Resource(credentials, url, 'GET', nonce='', timestamp=2 ** 31)))
+
+    def receive():
+        Receiver(lambda id: credentials, sender.request_header, url, 'POST',
+                 content=content, content_type=content_type,
+                 seen_nonce=never_seen)
+
+    def accept_response():
+        sender.accept_response(response_header, content=content,
+                               content_type=content_type)
+
+    def bewit():
+        check_bewit(bewit_url, lambda id: credentials)
+
+    bewit_cache = BewitCache()
+
+    def cached_bewit():
+        check_bewit(bewit_url, lambda id: credentials, cache=bewit_cache)
+
+    return [('Receiver', receive),
+            ('Sender.accept_response', accept_response),
+            ('check_bewit', bewit),
+            ('check_bewit (cached)', cached_bewit)]
+
+
+def main(number=5000):
+    # Responses have no nonce to check; don't time the warning about it.
+    logging.getLogger('mohawk').setLevel(logging.ERROR)
+    for algorithm in ('sha1', 'sha256'):
+        for label, func in benchmarks(algorithm):
+            best = min(timeit.repeat(func, number=number, repeat=5))
+            print('{algo:<7} {label:<24} {usec:8.2f} usec/call'
+                  .format(algo=algorithm, label=label,
+                          usec=best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,3 @@
 from .sender import *
 from .receiver import *
+from .util import Credentials, PayloadHasher
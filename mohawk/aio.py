@@ -0,0 +1,317 @@
+"""
+Helpers for using Mohawk with :mod:`asyncio`.
+
+This module requires Python 3.5 or greater.
+"""
+import asyncio
+import inspect
+import logging
+import sys
+
+from .base import default_ts_skew_in_seconds, EmptyValue
+from .exc import CredentialsLookupError, MissingAuthorization
+from .receiver import Receiver
+from .sender import Sender
+from .util import (parse_authorization_header,
+                   PayloadHasher,
+                   utc_now,
+                   validate_credentials)
+
+__all__ = ['AsyncReceiver', 'AsyncSender', 'aupdate_from']
+log = logging.getLogger(__name__)
+
+#: Payloads of at least this many bytes are hashed in an executor.
+default_offload_threshold = 64 * 1024
+
+
+async def aupdate_from(hasher, chunks):
+    """
+    Adds each chunk of an async iterable to a payload hash.
+
+    :param hasher: The hasher to update.
+    :type hasher: :class:`mohawk.util.PayloadHasher`
+
+    :param chunks: An async iterable of byte strings or buffers.
+    """
+    async for chunk in chunks:
+        hasher.update(chunk)
+
+
+async def _resolve(value):
+    # Awaits the result of a callable that may or may not be a coroutine.
+    if inspect.isawaitable(value):
+        value = await value
+    return value
+
+
+async def _lookup_credentials(credentials_map, sender_id):
+    try:
+        credentials = await _resolve(credentials_map(sender_id))
+    except LookupError:
+        etype, val, tb = sys.exc_info()
+        log.debug('Catching %s: %s', etype, val)
+        raise CredentialsLookupError(
+            'Could not find credentials for ID {0}'.format(sender_id))
+    validate_credentials(credentials)
+    return credentials
+
+
+class _AsyncAuthority(object):
+    # The asynchronous version of HawkAuthority._authorize().
+    # Subclasses need executor and offload_threshold slots.
+    __slots__ = ()
+
+    def _setup_async(self, executor, offload_threshold):
+        self.executor = executor
+        self.offload_threshold = offload_threshold
+
+    async def _gen_content_hash(self, resource, raw=False):
+        content = resource.content
+        if isinstance(content, PayloadHasher):
+            # The payload was already hashed.
+            offload = False
+        elif hasattr(content, 'read'):
+            offload = True
+        else:
+            offload = (content != EmptyValue and content is not None and
+                       len(content) >= self.offload_threshold)
+
+        gen_content_hash = (resource.gen_content_digest if raw
+                            else resource.gen_content_hash)
+        if not offload:
+            return gen_content_hash()
+        log.debug('hashing content in an executor')
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, gen_content_hash)
+
+    async def _authorize_async(
+            self, mac_type, parsed_header, resource,
+            their_timestamp=None,
+            timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+            localtime_offset_in_seconds=0,
+            accept_untrusted_content=False):
+
+        now = utc_now(offset_in_seconds=localtime_offset_in_seconds)
+
+        self._check_mac(mac_type, parsed_header, resource)
+
+        if self._should_check_hash(parsed_header, resource,
+                                   accept_untrusted_content):
+            self._check_content_hash(parsed_header, resource,
+                                     await self._gen_content_hash(resource,
+                                                                  raw=True))
+
+        if resource.seen_nonce:
+            seen = await _resolve(
+                resource.seen_nonce(resource.credentials['id'],
+                                    parsed_header['nonce'],
+                                    parsed_header['ts']))
+            self._check_nonce(parsed_header, resource, seen)
+        else:
+            log.warning('seen_nonce was None; not checking nonce. '
+                        'You may be vulnerable to replay attacks')
+
+        self._check_timestamp(parsed_header, resource, now,
+                              their_timestamp=their_timestamp,
+                              timestamp_skew_in_seconds=(
+                                  timestamp_skew_in_seconds))
+
+        log.debug('authorized OK')
+
+
+class AsyncReceiver(_AsyncAuthority, Receiver):
+    """
+    A :class:`mohawk.Receiver` that doesn't block the event loop.
+
+    Create one with :meth:`create`::
+
+        receiver = await AsyncReceiver.create(credentials_map, ...)
+
+    ``credentials_map`` and ``seen_nonce`` can be coroutine functions
+    or regular callables. Payloads of at least ``offload_threshold`` bytes,
+    and file-like payloads, are hashed in ``executor``.
+    """
+    __slots__ = ('executor', 'offload_threshold')
+
+    def __init__(self, *args, **kw):
+        raise TypeError('use AsyncReceiver.create() to receive a request')
+
+    @classmethod
+    async def create(cls,
+                     credentials_map,
+                     request_header,
+                     url,
+                     method,
+                     content=EmptyValue,
+                     content_type=EmptyValue,
+                     seen_nonce=None,
+                     localtime_offset_in_seconds=0,
+                     accept_untrusted_content=False,
+                     timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                     executor=None,
+                     offload_threshold=default_offload_threshold,
+                     **auth_kw):
+        """
+        Accepts a request.
+
+        This takes the same arguments as :class:`mohawk.Receiver`
+        and the following ones.
+
+        :param executor=None:
+            :class:`concurrent.futures.Executor` to hash payloads in.
+            When None, the event loop's default executor is used.
+
+        :param offload_threshold=65536:
+            Size in bytes from which payloads are hashed in ``executor``.
+        :type offload_threshold=65536: int
+        """
+        receiver = cls.__new__(cls)
+        receiver._setup(credentials_map, seen_nonce)
+        receiver._setup_async(executor, offload_threshold)
+
+        log.debug('accepting request %s', request_header)
+
+        if not request_header:
+            raise MissingAuthorization()
+
+        parsed_header = parse_authorization_header(request_header)
+        credentials = await _lookup_credentials(credentials_map,
+                                                parsed_header['id'])
+
+        await receiver._accept_async(
+            parsed_header, credentials, url, method,
+            content=content,
+            content_type=content_type,
+            localtime_offset_in_seconds=localtime_offset_in_seconds,
+            accept_untrusted_content=accept_untrusted_content,
+            timestamp_skew_in_seconds=timestamp_skew_in_seconds,
+            **auth_kw)
+        return receiver
+
+    async def _accept_async(self, parsed_header, credentials, url, method,
+                            content=EmptyValue,
+                            content_type=EmptyValue,
+                            localtime_offset_in_seconds=0,
+                            accept_untrusted_content=False,
+                            timestamp_skew_in_seconds=(
+                                default_ts_skew_in_seconds),
+                            **auth_kw):
+        resource = self._request_resource(parsed_header, credentials,
+                                          url, method, content, content_type)
+
+        await self._authorize_async(
+            'header', parsed_header, resource,
+            timestamp_skew_in_seconds=timestamp_skew_in_seconds,
+            localtime_offset_in_seconds=localtime_offset_in_seconds,
+            accept_untrusted_content=accept_untrusted_content,
+            **auth_kw)
+
+        self.parsed_header = parsed_header
+        self.resource = resource
+
+    async def respond(self,
+                      content=EmptyValue,
+                      content_type=EmptyValue,
+                      always_hash_content=True,
+                      ext=None,
+                      as_bytes=False):
+        """
+        Respond to the request.
+
+        This is a coroutine version of :meth:`mohawk.Receiver.respond`.
+        """
+        log.debug('generating response header')
+
+        resource = self._response_resource(content, content_type,
+                                           always_hash_content, ext)
+        return self._sign_response(resource,
+                                   await self._gen_content_hash(resource),
+                                   as_bytes)
+
+
+class AsyncSender(_AsyncAuthority, Sender):
+    """
+    A :class:`mohawk.Sender` that doesn't block the event loop.
+
+    Create one with :meth:`create`::
+
+        sender = await AsyncSender.create(credentials, ...)
+
+    ``seen_nonce`` can be a coroutine function or a regular callable.
+    Payloads of at least ``offload_threshold`` bytes, and file-like
+    payloads, are hashed in ``executor``.
+    """
+    __slots__ = ('executor', 'offload_threshold')
+
+    def __init__(self, *args, **kw):
+        raise TypeError('use AsyncSender.create() to sign a request')
+
+    @classmethod
+    async def create(cls, credentials,
+                     url,
+                     method,
+                     content=EmptyValue,
+                     content_type=EmptyValue,
+                     always_hash_content=True,
+                     nonce=None,
+                     ext=None,
+                     app=None,
+                     dlg=None,
+                     seen_nonce=None,
+                     clock_offsets=None,
+                     executor=None,
+                     offload_threshold=default_offload_threshold,
+                     # For easier testing:
+                     _timestamp=None):
+        """
+        Signs a request.
+
+        This takes the same arguments as :class:`mohawk.Sender`
+        and the following ones.
+
+        :param executor=None:
+            :class:`concurrent.futures.Executor` to hash payloads in.
+            When None, the event loop's default executor is used.
+
+        :param offload_threshold=65536:
+            Size in bytes from which payloads are hashed in ``executor``.
+        :type offload_threshold=65536: int
+        """
+        sender = cls.__new__(cls)
+        sender._setup_async(executor, offload_threshold)
+        sender._setup(credentials, url, method, content, content_type,
+                      always_hash_content, nonce, ext, app, dlg, seen_nonce,
+                      _timestamp, clock_offsets)
+        sender._sign_request(
+            await sender._gen_content_hash(sender.req_resource))
+        return sender
+
+    async def accept_response(
+            self,
+            response_header,
+            content=EmptyValue,
+            content_type=EmptyValue,
+            accept_untrusted_content=False,
+            localtime_offset_in_seconds=0,
+            timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+            **auth_kw):
+        """
+        Accept a response to this request.
+
+        This is a coroutine version of :meth:`mohawk.Sender.accept_response`.
+        """
+        log.debug('accepting response %s', response_header)
+        if not localtime_offset_in_seconds:
+            localtime_offset_in_seconds = self._clock_offset
+
+        parsed_header = parse_authorization_header(response_header)
+        resource = self._response_resource(parsed_header, content,
+                                           content_type)
+
+        await self._authorize_async(
+            'response', parsed_header, resource,
+            their_timestamp=resource.timestamp,
+            timestamp_skew_in_seconds=timestamp_skew_in_seconds,
+            localtime_offset_in_seconds=localtime_offset_in_seconds,
+            accept_untrusted_content=accept_untrusted_content,
+            **auth_kw)
@@ -0,0 +1,445 @@
+"""
+Tests that need Python 3.5 or greater.
+
+These are imported by :mod:`mohawk.tests` when they can run.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipIf, TestCase
+
+from nose.tools import eq_, raises
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from .aio import AsyncReceiver, AsyncSender, aupdate_from
+from .asgi import HawkMiddleware, scope_url
+from .auth import HttpxHawkAuth
+from .base import ParsedURL
+from .clock import ClockOffsetTracker
+from .exc import (AlreadyProcessed,
+                  CredentialsLookupError,
+                  MacMismatch,
+                  MisComputedContentHash,
+                  TokenExpired)
+from .receiver import Receiver
+from .sender import Sender
+from .util import calculate_payload_hash, PayloadHasher, utc_now
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class AsyncChunks(object):
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class TestAsyncPayloadHasher(TestCase):
+
+    def test_async_chunks(self):
+        content = b'some content to hash'
+        hasher = PayloadHasher('sha256', 'text/plain')
+        run(aupdate_from(hasher, AsyncChunks([content[:4], content[4:]])))
+        eq_(hasher.finalize(),
+            calculate_payload_hash(content, 'sha256', 'text/plain'))
+
+
+class CountingExecutor(ThreadPoolExecutor):
+
+    def __init__(self):
+        super(CountingExecutor, self).__init__(max_workers=1)
+        self.submitted = 0
+
+    def submit(self, *args, **kw):
+        self.submitted += 1
+        return super(CountingExecutor, self).submit(*args, **kw)
+
+
+class AsyncBase(TestCase):
+
+    def setUp(self):
+        self.credentials = {
+            'id': 'my-hawk-id',
+            'key': 'my hAwK sekret',
+            'algorithm': 'sha256',
+        }
+        self.url = 'https://my-site.com/foo?bar=1'
+        self.nonces = set()
+        self.executor = CountingExecutor()
+        self.addCleanup(self.executor.shutdown)
+
+    async def credentials_map(self, id):
+        await asyncio.sleep(0)
+        if id != self.credentials['id']:
+            raise LookupError(id)
+        return self.credentials
+
+    async def seen_nonce(self, id, nonce, ts):
+        await asyncio.sleep(0)
+        key = (id, nonce, ts)
+        if key in self.nonces:
+            return True
+        self.nonces.add(key)
+        return False
+
+    def sender(self, **kw):
+        kw.setdefault('content', b'foo=bar')
+        kw.setdefault('content_type', 'application/x-www-form-urlencoded')
+        kw.setdefault('executor', self.executor)
+        return run(AsyncSender.create(self.credentials, self.url, 'POST',
+                                      **kw))
+
+    def receive(self, header, **kw):
+        kw.setdefault('content', b'foo=bar')
+        kw.setdefault('content_type', 'application/x-www-form-urlencoded')
+        kw.setdefault('seen_nonce', self.seen_nonce)
+        kw.setdefault('executor', self.executor)
+        return run(AsyncReceiver.create(self.credentials_map, header,
+                                        self.url, 'POST', **kw))
+
+
+class TestAsyncReceiver(AsyncBase):
+
+    def test_receive(self):
+        receiver = self.receive(self.sender().request_header)
+        eq_(receiver.resource.credentials['id'], 'my-hawk-id')
+        eq_(self.executor.submitted, 0)
+
+    def test_sync_callables(self):
+        sn = self.sender()
+        run(AsyncReceiver.create(lambda id: self.credentials,
+                                 sn.request_header, self.url, 'POST',
+                                 content=b'foo=bar',
+                                 content_type=('application/'
+                                               'x-www-form-urlencoded'),
+                                 seen_nonce=lambda *args: False))
+
+    @raises(TypeError)
+    def test_sync_constructor(self):
+        AsyncReceiver(self.credentials_map, 'Hawk ...', self.url, 'POST')
+
+    @raises(CredentialsLookupError)
+    def test_unknown_id(self):
+        header = self.sender().request_header
+        self.credentials = dict(self.credentials, id='other-id')
+        self.receive(header)
+
+    @raises(MacMismatch)
+    def test_mac_mismatch(self):
+        header = self.sender().request_header
+        self.url = 'https://my-site.com/TAMPERED'
+        self.receive(header)
+
+    @raises(MisComputedContentHash)
+    def test_tampered_content(self):
+        self.receive(self.sender().request_header, content=b'foo=TAMPERED')
+
+    @raises(AlreadyProcessed)
+    def test_replay(self):
+        header = self.sender().request_header
+        self.receive(header)
+        self.receive(header)
+
+    @raises(TokenExpired)
+    def test_expired(self):
+        self.receive(self.sender(_timestamp=utc_now() - 120).request_header)
+
+    def test_large_content_is_offloaded(self):
+        content = b'x' * 100
+        header = self.sender(content=content, offload_threshold=100,
+                             content_type='text/plain').request_header
+        eq_(self.executor.submitted, 1)
+        self.receive(header, content=content, content_type='text/plain',
+                     offload_threshold=100)
+        eq_(self.executor.submitted, 2)
+
+    def test_respond(self):
+        sn = self.sender()
+        receiver = self.receive(sn.request_header)
+        header = run(receiver.respond(content=b'hello',
+                                      content_type='text/plain'))
+        eq_(header, receiver.response_header)
+        run(sn.accept_response(header, content=b'hello',
+                               content_type='text/plain'))
+
+    @raises(MisComputedContentHash)
+    def test_respond_tampered(self):
+        sn = self.sender()
+        receiver = self.receive(sn.request_header)
+        header = run(receiver.respond(content=b'hello',
+                                      content_type='text/plain'))
+        run(sn.accept_response(header, content=b'TAMPERED',
+                               content_type='text/plain'))
+
+    def test_payload_hasher(self):
+        content = b'some content'
+        hasher = PayloadHasher('sha256', 'text/plain')
+        run(aupdate_from(hasher, AsyncChunks([content])))
+        header = self.sender(content=content,
+                             content_type='text/plain').request_header
+        self.receive(header, content=hasher, content_type='text/plain')
+        eq_(self.executor.submitted, 0)
+
+
+class TestAsyncSender(AsyncBase):
+
+    @raises(TypeError)
+    def test_sync_constructor(self):
+        AsyncSender(self.credentials, self.url, 'POST')
+
+    def test_matches_sync_sender(self):
+        sn = self.sender(nonce='abc', _timestamp=1234)
+        sync = Sender(self.credentials, self.url, 'POST', content=b'foo=bar',
+                      content_type='application/x-www-form-urlencoded',
+                      nonce='abc', _timestamp=1234)
+        eq_(sn.request_header, sync.request_header)
+
+    def test_clock_offsets(self):
+        clock_offsets = ClockOffsetTracker()
+        try:
+            self.receive(self.sender().request_header,
+                         localtime_offset_in_seconds=600)
+        except TokenExpired as exc:
+            clock_offsets.update(exc.www_authenticate, self.credentials)
+        sn = self.sender(clock_offsets=clock_offsets)
+        receiver = self.receive(sn.request_header,
+                                localtime_offset_in_seconds=600)
+        header = run(receiver.respond(content=b'hello',
+                                      content_type='text/plain'))
+        run(sn.accept_response(header, content=b'hello',
+                               content_type='text/plain'))
+
+
+async def echo_app(scope, receive, send):
+    # Responds with the request body.
+    body = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        body.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/plain')]})
+    for chunk in body:
+        await send({'type': 'http.response.body', 'body': chunk,
+                    'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def lazy_app(scope, receive, send):
+    # Responds without reading the request body.
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b'ok'})
+
+
+class TestScopeURL(TestCase):
+
+    def scope(self, **kw):
+        scope = {'type': 'http', 'scheme': 'http', 'path': '/foo',
+                 'query_string': b'', 'server': ('127.0.0.1', 8000)}
+        scope.update(kw)
+        return scope
+
+    def test_server(self):
+        eq_(scope_url(self.scope()), ParsedURL('/foo', '127.0.0.1', '8000'))
+
+    def test_host(self):
+        eq_(scope_url(self.scope(), 'Site.com:8080'),
+            ParsedURL('/foo', 'site.com', '8080'))
+
+    def test_default_port(self):
+        eq_(scope_url(self.scope(scheme='https'), 'site.com'),
+            ParsedURL('/foo', 'site.com', '443'))
+
+    def test_ipv6_host(self):
+        eq_(scope_url(self.scope(), '[::1]:8080'),
+            ParsedURL('/foo', '::1', '8080'))
+
+    def test_query_string(self):
+        eq_(scope_url(self.scope(query_string=b'a=1&b=%20'))[0],
+            '/foo?a=1&b=%20')
+
+    def test_raw_path(self):
+        eq_(scope_url(self.scope(path='/a b', raw_path=b'/a%20b'))[0],
+            '/a%20b')
+
+    def test_quoted_path(self):
+        eq_(scope_url(self.scope(path='/a b'))[0], '/a%20b')
+
+
+class TestHawkMiddleware(AsyncBase):
+
+    def setUp(self):
+        super(TestHawkMiddleware, self).setUp()
+        self.url = 'https://my-site.com/foo?bar=1'
+
+    def call(self, app, header, chunks, content_type=b'text/plain',
+             scope_type='http'):
+        headers = [(b'host', b'my-site.com')]
+        if header:
+            headers.append((b'authorization', header.encode('ascii')))
+        if content_type:
+            headers.append((b'content-type', content_type))
+        scope = {'type': scope_type, 'scheme': 'https', 'method': 'POST',
+                 'path': '/foo', 'query_string': b'bar=1',
+                 'headers': headers}
+        messages = [{'type': 'http.request', 'body': chunk,
+                     'more_body': i < len(chunks) - 1}
+                    for i, chunk in enumerate(chunks)]
+        messages.append({'type': 'http.disconnect'})
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        middleware = HawkMiddleware(app, self.credentials_map,
+                                    seen_nonce=self.seen_nonce,
+                                    executor=self.executor)
+        run(middleware(scope, receive, send))
+        return sent
+
+    def headers(self, message):
+        return dict(message['headers'])
+
+    def test_echo(self):
+        sn = self.sender(content=b'hello world', content_type='text/plain')
+        sent = self.call(echo_app, sn.request_header, [b'hello ', b'world'])
+        eq_(sent[0]['status'], 200)
+        eq_(sent[1]['body'], b'hello world')
+        header = self.headers(sent[0])[b'server-authorization']
+        run(sn.accept_response(header.decode('ascii'), content=b'hello world',
+                               content_type='text/plain'))
+
+    def test_receiver_in_scope(self):
+        seen = []
+
+        async def app(scope, receive, send):
+            seen.append(scope['hawk'])
+            await echo_app(scope, receive, send)
+
+        sn = self.sender(content=b'hello', content_type='text/plain')
+        self.call(app, sn.request_header, [b'hello'])
+        eq_(seen[0].resource.credentials['id'], 'my-hawk-id')
+
+    def test_missing_authorization(self):
+        sent = self.call(echo_app, None, [b'hello'])
+        eq_(sent[0]['status'], 401)
+        eq_(self.headers(sent[0])[b'www-authenticate'], b'Hawk')
+
+    def test_mac_mismatch(self):
+        self.url = 'https://my-site.com/other'
+        sn = self.sender(content=b'hello', content_type='text/plain')
+        sent = self.call(echo_app, sn.request_header, [b'hello'])
+        eq_(sent[0]['status'], 401)
+
+    def test_malformed_authorization(self):
+        for header in ('Hawk', 'Hawk mac="x"', 'Hawk id="a", mac="x"',
+                       'Hawk id="my-hawk-id", ts="1", mac="x"'):
+            sent = self.call(echo_app, header, [b'hello'])
+            eq_(sent[0]['status'], 401, header)
+            eq_(self.headers(sent[0])[b'www-authenticate'], b'Hawk')
+
+    def test_expired(self):
+        sn = self.sender(content=b'hello', content_type='text/plain',
+                         _timestamp=utc_now() - 120)
+        sent = self.call(echo_app, sn.request_header, [b'hello'])
+        eq_(sent[0]['status'], 401)
+        assert self.headers(sent[0])[b'www-authenticate'].startswith(
+            b'Hawk ts=')
+
+    def test_replay(self):
+        sn = self.sender(content=b'hello', content_type='text/plain')
+        self.call(echo_app, sn.request_header, [b'hello'])
+        sent = self.call(echo_app, sn.request_header, [b'hello'])
+        eq_(sent[0]['status'], 401)
+
+    def test_tampered_body(self):
+        sn = self.sender(content=b'hello', content_type='text/plain')
+        sent = self.call(echo_app, sn.request_header, [b'hel', b'TAMPERED'])
+        eq_([m.get('status') for m in sent], [401, None])
+
+    def test_tampered_body_error_handled_by_app(self):
+        async def app(scope, receive, send):
+            try:
+                await echo_app(scope, receive, send)
+            except MisComputedContentHash:
+                await lazy_app(scope, receive, send)
+
+        sn = self.sender(content=b'hello', content_type='text/plain')
+        sent = self.call(app, sn.request_header, [b'TAMPERED'])
+        eq_(sent[0]['status'], 401)
+
+    def test_tampered_body_not_read_by_app(self):
+        sn = self.sender(content=b'hello', content_type='text/plain')
+        sent = self.call(lazy_app, sn.request_header, [b'TAMPERED'])
+        eq_(sent[0]['status'], 401)
+
+    def test_body_not_read_by_app(self):
+        sn = self.sender(content=b'hello', content_type='text/plain')
+        sent = self.call(lazy_app, sn.request_header, [b'hel', b'lo'])
+        eq_(sent[0]['status'], 200)
+        eq_(sent[1]['body'], b'ok')
+
+    def test_empty_body(self):
+        sn = self.sender(content=b'', content_type='')
+        sent = self.call(echo_app, sn.request_header, [b''],
+                         content_type=None)
+        eq_(sent[0]['status'], 200)
+
+    def test_other_scope_types(self):
+        calls = []
+
+        async def app(scope, receive, send):
+            calls.append(scope['type'])
+
+        self.call(app, None, [], scope_type='lifespan')
+        eq_(calls, ['lifespan'])
+
+
+@skipIf(httpx is None, 'httpx is not installed')
+class TestHttpxHawkAuthAsync(AsyncBase):
+
+    def test_async_client(self):
+        def handler(request):
+            receiver = Receiver(lambda id: self.credentials,
+                                request.headers['Authorization'],
+                                str(request.url), request.method,
+                                content=request.read(),
+                                content_type=request.headers['Content-Type'])
+            header = receiver.respond(content=b'ok',
+                                      content_type='text/plain')
+            return httpx.Response(200, content=b'ok', headers={
+                'Content-Type': 'text/plain',
+                'Server-Authorization': header})
+
+        async def post():
+            async with httpx.AsyncClient(
+                    auth=HttpxHawkAuth(self.credentials),
+                    transport=httpx.MockTransport(handler)) as client:
+                return await client.post(
+                    'https://site.com/', content=b'hello',
+                    headers={'Content-Type': 'text/plain'})
+
+        eq_(run(post()).content, b'ok')
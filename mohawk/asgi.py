@@ -0,0 +1,259 @@
+"""
+ASGI middleware that verifies `Hawk`_ requests and signs their responses.
+
+This module requires Python 3.5 or greater.
+
+.. _`Hawk`: https://github.com/hueniverse/hawk
+"""
+import logging
+import sys
+
+from six.moves.urllib.parse import quote
+
+from .aio import _lookup_credentials, AsyncReceiver, default_offload_threshold
+from .base import (_default_ports,
+                   _split_host,
+                   default_ts_skew_in_seconds,
+                   ParsedURL)
+from .exc import HawkFail, MissingAuthorization
+from .receiver import _parse_request_header, _StreamedContent
+from .util import PayloadHasher
+
+__all__ = ['HawkMiddleware', 'scope_url']
+log = logging.getLogger(__name__)
+
+
+def scope_url(scope, host=None):
+    """
+    Returns the :data:`mohawk.base.ParsedURL` of an ASGI HTTP scope.
+
+    :param scope: The ASGI connection scope.
+    :type scope: dict
+
+    :param host=None:
+        Value of the ``Host`` header. When None, the host and port
+        of the server in the scope are used.
+    :type host=None: str
+    """
+    scheme = scope.get('scheme', 'http')
+    if host:
+        hostname, port = _split_host(host, scheme)
+    else:
+        hostname, port = scope.get('server') or ('', None)
+        hostname = hostname.lower()
+        port = (_default_ports.get(scheme, 'None') if port is None
+                else str(port))
+
+    raw_path = scope.get('raw_path')
+    if raw_path:
+        name = raw_path.decode('latin-1')
+    else:
+        name = quote(scope['path'], safe="/:@!$&'()*+,;=~")
+    query_string = scope.get('query_string')
+    if query_string:
+        name = '{name}?{query}'.format(name=name,
+                                       query=query_string.decode('latin-1'))
+
+    return ParsedURL(name, hostname, port)
+
+
+class _StreamingReceiver(_StreamedContent, AsyncReceiver):
+    __slots__ = ('_accept_untrusted_content',)
+
+
+class HawkMiddleware(object):
+    """
+    ASGI middleware that only lets through requests signed with `Hawk`_.
+
+    The MAC, timestamp and nonce of each HTTP request are checked before
+    the wrapped application is called. The request body is hashed as the
+    application receives it; if the body does not match the hash signed by
+    the sender, receiving the last chunk raises
+    :class:`mohawk.exc.MisComputedContentHash`.
+
+    The response is hashed as the application sends it and held back until
+    it is complete so that a ``Server-Authorization`` header can be added.
+    A response is never sent for a request whose body turns out to be
+    tampered with: the rest of the body is read if the application didn't,
+    and a 401 is sent instead when the hash doesn't match.
+
+    The :class:`mohawk.aio.AsyncReceiver` of the request is available to the
+    application as ``scope['hawk']``.
+
+    Other types of connections, such as websockets, are passed through
+    unchecked.
+
+    :param app: The ASGI application to wrap.
+
+    :param credentials_map:
+        Callable to look up the credentials dict by sender ID,
+        just like for :class:`mohawk.aio.AsyncReceiver`.
+    :type credentials_map: callable
+
+    :param seen_nonce=None:
+        A callable that returns True if a nonce has been seen.
+        See :ref:`nonce` for details.
+    :type seen_nonce=None: callable
+
+    Other keyword arguments, such as ``timestamp_skew_in_seconds``,
+    are used like the ones of :class:`mohawk.aio.AsyncReceiver`.
+
+    .. _`Hawk`: https://github.com/hueniverse/hawk
+    """
+
+    def __init__(self, app, credentials_map, seen_nonce=None,
+                 accept_untrusted_content=False,
+                 localtime_offset_in_seconds=0,
+                 timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 executor=None,
+                 offload_threshold=default_offload_threshold):
+        self.app = app
+        self.credentials_map = credentials_map
+        self.seen_nonce = seen_nonce
+        self.accept_untrusted_content = accept_untrusted_content
+        self.localtime_offset_in_seconds = localtime_offset_in_seconds
+        self.timestamp_skew_in_seconds = timestamp_skew_in_seconds
+        self.executor = executor
+        self.offload_threshold = offload_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            receiver = await self._accept(scope)
+        except HawkFail:
+            etype, exc, tb = sys.exc_info()
+            await _unauthorized(send, exc)
+            return
+
+        exchange = _Exchange(receiver, receive, send)
+        await exchange.run(self.app, dict(scope, hawk=receiver))
+
+    async def _accept(self, scope):
+        authorization = content_type = host = None
+        for name, value in scope['headers']:
+            if name == b'authorization':
+                authorization = value.decode('latin-1')
+            elif name == b'content-type':
+                content_type = value.decode('latin-1')
+            elif name == b'host':
+                host = value.decode('latin-1')
+
+        log.debug('accepting request %s', authorization)
+        if not authorization:
+            raise MissingAuthorization()
+
+        parsed_header = _parse_request_header(authorization)
+        credentials = await _lookup_credentials(self.credentials_map,
+                                                parsed_header['id'])
+
+        receiver = _StreamingReceiver.__new__(_StreamingReceiver)
+        receiver._setup(self.credentials_map, self.seen_nonce)
+        receiver._setup_async(self.executor, self.offload_threshold)
+        await receiver._accept_async(
+            parsed_header, credentials, scope_url(scope, host),
+            scope['method'],
+            content=PayloadHasher(credentials['algorithm'],
+                                  content_type or ''),
+            content_type=content_type or '',
+            localtime_offset_in_seconds=self.localtime_offset_in_seconds,
+            accept_untrusted_content=self.accept_untrusted_content,
+            timestamp_skew_in_seconds=self.timestamp_skew_in_seconds)
+        return receiver
+
+
+class _Exchange(object):
+    # One accepted request and its response.
+
+    def __init__(self, receiver, receive, send):
+        self.receiver = receiver
+        self._receive = receive
+        self._send = send
+        self.body_done = False
+        self.error = None
+        self.sent = False
+        self.response_start = None
+        self.response_hasher = None
+        self.response_body = []
+
+    async def run(self, app, scope):
+        try:
+            await app(scope, self.receive, self.send)
+        except HawkFail:
+            if self.error is None:
+                raise
+        if self.error is not None and not self.sent:
+            await _unauthorized(self._send, self.error)
+
+    async def receive(self):
+        message = await self._receive()
+        if message['type'] == 'http.request' and not self.body_done:
+            self.receiver.resource.content.update(message.get('body', b''))
+            if not message.get('more_body', False):
+                self.body_done = True
+                try:
+                    self.receiver.check_content()
+                except HawkFail:
+                    self.error = sys.exc_info()[1]
+                    raise
+        return message
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.response_start = message
+            content_type = ''
+            for name, value in message.get('headers', ()):
+                if name.lower() == b'content-type':
+                    content_type = value.decode('latin-1')
+            self.response_hasher = PayloadHasher(
+                self.receiver.resource.credentials['algorithm'],
+                content_type)
+        elif message['type'] == 'http.response.body':
+            body = message.get('body', b'')
+            self.response_hasher.update(body)
+            self.response_body.append(body)
+            if not message.get('more_body', False):
+                await self._finish()
+        else:
+            await self._send(message)
+
+    async def _finish(self):
+        # Makes sure the request was not tampered with before
+        # sending the signed response.
+        try:
+            while not self.body_done:
+                message = await self.receive()
+                if message['type'] == 'http.disconnect':
+                    return
+        except HawkFail:
+            pass
+        self.sent = True
+        if self.error is not None:
+            await _unauthorized(self._send, self.error)
+            return
+
+        header = await self.receiver.respond(
+            content=self.response_hasher,
+            content_type=self.response_hasher.content_type,
+            as_bytes=True)
+        start = dict(self.response_start)
+        start['headers'] = list(start.get('headers', ())) + [
+            (b'server-authorization', header)]
+        await self._send(start)
+        await self._send({'type': 'http.response.body',
+                          'body': b''.join(self.response_body)})
+
+
+async def _unauthorized(send, exc):
+    log.info('rejecting request: %s: %s', exc.__class__.__name__, exc)
+    await send({'type': 'http.response.start',
+                'status': 401,
+                'headers': [
+                    (b'content-type', b'text/plain; charset=utf-8'),
+                    (b'www-authenticate',
+                     (getattr(exc, 'www_authenticate', None) or
+                      'Hawk').encode('latin-1')),
+                ]})
+    await send({'type': 'http.response.body', 'body': b'Unauthorized'})
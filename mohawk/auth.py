@@ -0,0 +1,312 @@
+"""
+`Hawk`_ authentication for HTTP client libraries.
+
+:class:`RequestsHawkAuth` works with `requests`_ and :class:`HttpxHawkAuth`
+works with `httpx`_. Each library is optional; only the one you use has to
+be installed.
+
+.. _`Hawk`: https://github.com/hueniverse/hawk
+.. _`requests`: https://requests.readthedocs.io/
+.. _`httpx`: https://www.python-httpx.org/
+"""
+import functools
+import logging
+import sys
+
+import six
+
+from .base import default_ts_skew_in_seconds, split_url
+from .cache import LRUCache
+from .exc import HawkFail, MissingAuthorization
+from .sender import Sender
+from .util import compile_credentials, PayloadHasher
+
+try:
+    from requests.auth import AuthBase
+except ImportError:  # requests is optional.
+    AuthBase = None
+
+try:
+    import httpx
+except ImportError:  # httpx is optional.
+    httpx = None
+
+__all__ = ['HttpxHawkAuth', 'RequestsHawkAuth']
+log = logging.getLogger(__name__)
+
+
+class _HawkAuth(object):
+    # The signer state shared by all requests of a session.
+
+    def __init__(self, credentials,
+                 always_hash_content=True,
+                 ext=None,
+                 app=None,
+                 dlg=None,
+                 verify_response=True,
+                 require_response_signature=True,
+                 accept_untrusted_content=False,
+                 timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 url_cache_size=256,
+                 block_size=64 * 1024,
+                 clock_offsets=None):
+        self.credentials = compile_credentials(credentials)
+        self.always_hash_content = always_hash_content
+        self.ext = ext
+        self.app = app
+        self.dlg = dlg
+        self.verify_response = verify_response
+        self.require_response_signature = require_response_signature
+        self.accept_untrusted_content = accept_untrusted_content
+        self.timestamp_skew_in_seconds = timestamp_skew_in_seconds
+        self.block_size = block_size
+        self.clock_offsets = clock_offsets
+        self._urls = LRUCache(url_cache_size)
+
+    def _split_url(self, url):
+        parsed_url = self._urls.get(url)
+        if parsed_url is None:
+            parsed_url = split_url(url)
+            self._urls.set(url, parsed_url)
+        return parsed_url
+
+    def _sign(self, url, method, content, content_type):
+        return Sender(self.credentials, self._split_url(url), method,
+                      content=content,
+                      content_type=content_type,
+                      always_hash_content=self.always_hash_content,
+                      ext=self.ext,
+                      app=self.app,
+                      dlg=self.dlg,
+                      clock_offsets=self.clock_offsets)
+
+    def _learn_clock_offset(self, status_code, www_authenticate):
+        # Returns True when a request was rejected because of our clock.
+        if (status_code != 401 or self.clock_offsets is None or
+                not www_authenticate):
+            return False
+        try:
+            return self.clock_offsets.update(www_authenticate,
+                                             self.credentials)
+        except HawkFail:
+            etype, exc, tb = sys.exc_info()
+            log.warning('ignoring a clock challenge: %s: %s',
+                        etype.__name__, exc)
+            return False
+
+    def _accept_response(self, sender, status_code, response_header, content,
+                         content_type):
+        if not self.verify_response:
+            return
+        if not response_header:
+            if status_code == 401:
+                # A server can't sign the response to a request
+                # it rejected.
+                log.debug('request was rejected; not verifying response')
+                return
+            if self.require_response_signature:
+                raise MissingAuthorization(
+                    'response has no Server-Authorization header')
+            log.debug('response was not signed; not verifying it')
+            return
+        sender.accept_response(
+            response_header,
+            content=content,
+            content_type=content_type,
+            accept_untrusted_content=self.accept_untrusted_content,
+            timestamp_skew_in_seconds=self.timestamp_skew_in_seconds)
+
+
+class RequestsHawkAuth(_HawkAuth, AuthBase or object):
+    """
+    Signs `requests`_ with `Hawk`_ and verifies their responses.
+
+    Create one per session and reuse it::
+
+        session = requests.Session()
+        session.auth = RequestsHawkAuth(credentials)
+
+    File-like request bodies are hashed in blocks of ``block_size`` bytes
+    and rewound before they are sent. Other streamed bodies, such as
+    generators, have to be held in memory to be hashed.
+
+    :param credentials:
+        Dict of credentials with keys ``id``, ``key``, and ``algorithm``
+        or a :class:`mohawk.util.Credentials` object.
+    :type credentials: dict
+
+    :param verify_response=True:
+        When True, the ``Server-Authorization`` header of each response
+        is checked with :meth:`mohawk.Sender.accept_response`. This reads
+        the whole response body.
+    :type verify_response=True: bool
+
+    :param require_response_signature=True:
+        When True, a response without a ``Server-Authorization`` header
+        raises :class:`mohawk.exc.MissingAuthorization` unless its status
+        is 401. Set this to False to accept unsigned responses, which lets
+        anyone who can alter responses skip their verification.
+    :type require_response_signature=True: bool
+
+    :param url_cache_size=256:
+        Number of URLs to remember the `Hawk`_ parts of.
+    :type url_cache_size=256: int
+
+    :param clock_offsets=None:
+        A :class:`mohawk.clock.ClockOffsetTracker`. When given, requests are
+        timestamped with the time it learned from the server, and a request
+        rejected with a valid ``ts`` / ``tsm`` challenge is signed again
+        and retried once.
+    :type clock_offsets=None: :class:`mohawk.clock.ClockOffsetTracker`
+
+    :param block_size=65536: Bytes to read at a time from a file body.
+    :type block_size=65536: int
+
+    The ``always_hash_content``, ``ext``, ``app`` and ``dlg`` arguments are
+    used like the ones of :class:`mohawk.Sender`, and the
+    ``accept_untrusted_content`` and ``timestamp_skew_in_seconds`` arguments
+    like the ones of :meth:`mohawk.Sender.accept_response`.
+
+    .. _`Hawk`: https://github.com/hueniverse/hawk
+    .. _`requests`: https://requests.readthedocs.io/
+    """
+
+    def __init__(self, credentials, **kw):
+        if AuthBase is None:
+            raise ImportError('RequestsHawkAuth requires requests')
+        super(RequestsHawkAuth, self).__init__(credentials, **kw)
+
+    def __call__(self, r):
+        sender, position = self._prepare(r)
+        r.register_hook('response',
+                        functools.partial(self._handle_response,
+                                          sender, position))
+        return r
+
+    def _prepare(self, r):
+        # Signs a prepared request. Returns its sender and, for a file
+        # body, the position to rewind the file to for a retry.
+        content_type = r.headers.get('Content-Type', '')
+        content = r.body
+        position = None
+        if content is None:
+            content = b''
+        elif hasattr(content, 'read'):
+            position = content.tell()
+            content = self._hash_file(content, content_type)
+        elif not isinstance(content, (six.binary_type, six.text_type)):
+            chunks = list(content)
+            content = PayloadHasher(self.credentials.algorithm, content_type)
+            content.update_from(chunks)
+            r.body = chunks
+
+        sender = self._sign(r.url, r.method, content, content_type)
+        r.headers['Authorization'] = sender.request_header
+        return sender, position
+
+    def _hash_file(self, fileobj, content_type):
+        hasher = PayloadHasher(self.credentials.algorithm, content_type)
+        position = fileobj.tell()
+        hasher.update_from_file(fileobj, block_size=self.block_size)
+        fileobj.seek(position)
+        return hasher
+
+    def _handle_response(self, sender, position, response, **kw):
+        if self._learn_clock_offset(response.status_code,
+                                    response.headers.get('WWW-Authenticate')):
+            # Release the connection so that the retry can reuse it.
+            response.content
+            response.close()
+            request = response.request.copy()
+            if position is not None:
+                request.body.seek(position)
+            sender, position = self._prepare(request)
+            retried = response.connection.send(request, **kw)
+            retried.history.append(response)
+            retried.request = request
+            response = retried
+
+        self._accept_response(sender, response.status_code,
+                              response.headers.get('Server-Authorization'),
+                              response.content,
+                              response.headers.get('Content-Type', ''))
+        return response
+
+
+class HttpxHawkAuth(_HawkAuth, httpx.Auth if httpx else object):
+    """
+    Signs `httpx`_ requests with `Hawk`_ and verifies their responses.
+
+    This works with both ``httpx.Client`` and ``httpx.AsyncClient``.
+    Create one per client and reuse it::
+
+        client = httpx.Client(auth=HttpxHawkAuth(credentials))
+
+    httpx reads the whole request body before it is signed.
+
+    :param credentials:
+        Dict of credentials with keys ``id``, ``key``, and ``algorithm``
+        or a :class:`mohawk.util.Credentials` object.
+    :type credentials: dict
+
+    :param verify_response=True:
+        When True, the ``Server-Authorization`` header of each response
+        is checked with :meth:`mohawk.Sender.accept_response`. This reads
+        the whole response body.
+    :type verify_response=True: bool
+
+    :param require_response_signature=True:
+        When True, a response without a ``Server-Authorization`` header
+        raises :class:`mohawk.exc.MissingAuthorization` unless its status
+        is 401. Set this to False to accept unsigned responses, which lets
+        anyone who can alter responses skip their verification.
+    :type require_response_signature=True: bool
+
+    :param url_cache_size=256:
+        Number of URLs to remember the `Hawk`_ parts of.
+    :type url_cache_size=256: int
+
+    :param clock_offsets=None:
+        A :class:`mohawk.clock.ClockOffsetTracker`. When given, requests are
+        timestamped with the time it learned from the server, and a request
+        rejected with a valid ``ts`` / ``tsm`` challenge is signed again
+        and retried once.
+    :type clock_offsets=None: :class:`mohawk.clock.ClockOffsetTracker`
+
+    The ``always_hash_content``, ``ext``, ``app`` and ``dlg`` arguments are
+    used like the ones of :class:`mohawk.Sender`, and the
+    ``accept_untrusted_content`` and ``timestamp_skew_in_seconds`` arguments
+    like the ones of :meth:`mohawk.Sender.accept_response`.
+
+    .. _`Hawk`: https://github.com/hueniverse/hawk
+    .. _`httpx`: https://www.python-httpx.org/
+    """
+
+    requires_request_body = True
+    requires_response_body = True
+
+    def __init__(self, credentials, **kw):
+        if httpx is None:
+            raise ImportError('HttpxHawkAuth requires httpx')
+        super(HttpxHawkAuth, self).__init__(credentials, **kw)
+
+    def auth_flow(self, request):
+        sender = self._prepare(request)
+        response = yield request
+
+        if self._learn_clock_offset(response.status_code,
+                                    response.headers.get('WWW-Authenticate')):
+            sender = self._prepare(request)
+            response = yield request
+
+        self._accept_response(sender, response.status_code,
+                              response.headers.get('Server-Authorization'),
+                              response.content,
+                              response.headers.get('Content-Type', ''))
+
+    def _prepare(self, request):
+        sender = self._sign(str(request.url), request.method,
+                            request.content,
+                            request.headers.get('Content-Type', ''))
+        request.headers['Authorization'] = sender.request_header
+        return sender
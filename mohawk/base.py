@@ -1,26 +1,37 @@
+from base64 import b64encode
+from collections import namedtuple
 import logging
 import math
-import pprint
 
 import six
 from six.moves.urllib.parse import urlparse
 
+from .cache import LRUCache
 from .exc import (AlreadyProcessed,
                   MacMismatch,
                   MisComputedContentHash,
                   TokenExpired,
                   MissingContent)
-from .util import (calculate_mac,
+from .util import (calculate_mac_digest,
+                   calculate_payload_digest,
                    calculate_payload_hash,
                    calculate_ts_mac,
+                   Credentials,
+                   digest_matches,
+                   normalize_header_attr,
+                   parse_content_type,
+                   PayloadHasher,
                    prepare_header_val,
                    random_string,
-                   strings_match,
-                   utc_now)
+                   utc_now,
+                   validate_header_attr)
 
 default_ts_skew_in_seconds = 60
 log = logging.getLogger(__name__)
 
+_request_header_keys = ('id', 'ts', 'nonce', 'ext', 'app', 'dlg')
+_optional_header_keys = ('ext', 'app', 'dlg')
+
 
 class HawkEmptyValue(object):
 
@@ -41,8 +52,30 @@ class HawkEmptyValue(object):
 
 EmptyValue = HawkEmptyValue()
 
+#: The parts of a URL that `Hawk`_ signs: the resource ``name``
+#: (path and query string), ``host`` and ``port`` (a string).
+#: This can be passed as the ``url`` of a request that was never
+#: an absolute URL string, such as one received by a server.
+#:
+#: .. _`Hawk`: https://github.com/hueniverse/hawk
+ParsedURL = namedtuple('ParsedURL', 'name host port')
+
+_default_ports = {'http': '80', 'https': '443'}
+
+
+def _split_host(host, scheme):
+    # Splits a Host header value into a host name and port.
+    if host.startswith('['):
+        # An IPv6 address.
+        end = host.find(']')
+        hostname, port = host[1:end], host[end + 2:]
+    else:
+        hostname, sep, port = host.partition(':')
+    return hostname.lower(), port or _default_ports.get(scheme, 'None')
 
-class HawkAuthority:
+
+class HawkAuthority(object):
+    __slots__ = ()
 
     def _authorize(self, mac_type, parsed_header, resource,
                    their_timestamp=None,
@@ -52,16 +85,44 @@ class HawkAuthority:
 
         now = utc_now(offset_in_seconds=localtime_offset_in_seconds)
 
+        self._check_mac(mac_type, parsed_header, resource)
+
+        if self._should_check_hash(parsed_header, resource,
+                                   accept_untrusted_content):
+            self._check_content_hash(parsed_header, resource,
+                                     resource.gen_content_digest())
+
+        if resource.seen_nonce:
+            self._check_nonce(parsed_header, resource,
+                              resource.seen_nonce(resource.credentials['id'],
+                                                  parsed_header['nonce'],
+                                                  parsed_header['ts']))
+        else:
+            log.warning('seen_nonce was None; not checking nonce. '
+                        'You may be vulnerable to replay attacks')
+
+        self._check_timestamp(parsed_header, resource, now,
+                              their_timestamp=their_timestamp,
+                              timestamp_skew_in_seconds=(
+                                  timestamp_skew_in_seconds))
+
+        log.debug('authorized OK')
+
+    # The steps of _authorize(), in the order they run. They are separate so
+    # that variants which need to wait on the hash or the nonce check
+    # (see mohawk.aio) behave the same.
+
+    def _check_mac(self, mac_type, parsed_header, resource):
         their_hash = parsed_header.get('hash', '')
         their_mac = parsed_header.get('mac', '')
-        mac = calculate_mac(mac_type, resource, their_hash)
-        if not strings_match(mac, their_mac):
+        mac = calculate_mac_digest(mac_type, resource, their_hash)
+        if not digest_matches(mac, their_mac):
             raise MacMismatch('MACs do not match; ours: {ours}; '
                               'theirs: {theirs}'
-                              .format(ours=mac, theirs=their_mac))
-
-        check_hash = True
+                              .format(ours=b64encode(mac), theirs=their_mac))
 
+    def _should_check_hash(self, parsed_header, resource,
+                           accept_untrusted_content):
         if 'hash' not in parsed_header:
             # The request did not hash its content.
             if not resource.content and not resource.content_type:
@@ -69,48 +130,46 @@ class HawkAuthority:
                 # to hash.
                 log.debug('NOT calculating/verifying payload hash '
                           '(no hash in header, request body is empty)')
-                check_hash = False
+                return False
             elif accept_untrusted_content:
                 # Allow the request, even if it has content. Missing content or
                 # content_type values will be coerced to the empty string for
                 # hashing purposes.
                 log.debug('NOT calculating/verifying payload hash '
                           '(no hash in header, accept_untrusted_content=True)')
-                check_hash = False
-
-        if check_hash:
-            if not their_hash:
-                log.info('request unexpectedly did not hash its content')
-
-            content_hash = resource.gen_content_hash()
-
-            if not strings_match(content_hash, their_hash):
-                # The hash declared in the header is incorrect.
-                # Content could have been tampered with.
-                log.debug('mismatched content: {content}'
-                          .format(content=repr(resource.content)))
-                log.debug('mismatched content-type: {typ}'
-                          .format(typ=repr(resource.content_type)))
-                raise MisComputedContentHash(
-                    'Our hash {ours} ({algo}) did not '
-                    'match theirs {theirs}'
-                    .format(ours=content_hash,
-                            theirs=their_hash,
-                            algo=resource.credentials['algorithm']))
-
-        if resource.seen_nonce:
-            if resource.seen_nonce(resource.credentials['id'],
-                                   parsed_header['nonce'],
-                                   parsed_header['ts']):
-                raise AlreadyProcessed('Nonce {nonce} with timestamp {ts} '
-                                       'has already been processed for {id}'
-                                       .format(nonce=parsed_header['nonce'],
-                                               ts=parsed_header['ts'],
-                                               id=resource.credentials['id']))
-        else:
-            log.warning('seen_nonce was None; not checking nonce. '
-                        'You may be vulnerable to replay attacks')
+                return False
+        return True
 
+    def _check_content_hash(self, parsed_header, resource, content_digest):
+        # content_digest is the raw payload hash.
+        their_hash = parsed_header.get('hash', '')
+        if not their_hash:
+            log.info('request unexpectedly did not hash its content')
+
+        if not digest_matches(content_digest, their_hash):
+            # The hash declared in the header is incorrect.
+            # Content could have been tampered with.
+            log.debug('mismatched content: %r', resource.content)
+            log.debug('mismatched content-type: %r',
+                      resource.content_type)
+            raise MisComputedContentHash(
+                'Our hash {ours} ({algo}) did not '
+                'match theirs {theirs}'
+                .format(ours=(content_digest and b64encode(content_digest)),
+                        theirs=their_hash,
+                        algo=resource.credentials['algorithm']))
+
+    def _check_nonce(self, parsed_header, resource, seen):
+        if seen:
+            raise AlreadyProcessed('Nonce {nonce} with timestamp {ts} '
+                                   'has already been processed for {id}'
+                                   .format(nonce=parsed_header['nonce'],
+                                           ts=parsed_header['ts'],
+                                           id=resource.credentials['id']))
+
+    def _check_timestamp(self, parsed_header, resource, now,
+                         their_timestamp=None,
+                         timestamp_skew_in_seconds=default_ts_skew_in_seconds):
         their_ts = int(their_timestamp or parsed_header['ts'])
 
         if math.fabs(their_ts - now) > timestamp_skew_in_seconds:
@@ -126,57 +185,57 @@ class HawkAuthority:
                                localtime_in_seconds=now,
                                www_authenticate=www_authenticate)
 
-        log.debug('authorized OK')
-
-    def _make_header(self, resource, mac, additional_keys=None):
+    def _make_header(self, resource, mac, additional_keys=None,
+                     validated=(), as_bytes=False):
         keys = additional_keys
         if not keys:
             # These are the default header keys that you'd send with a
             # request header. Response headers are odd because they
             # exclude a bunch of keys.
-            keys = ('id', 'ts', 'nonce', 'ext', 'app', 'dlg')
+            keys = _request_header_keys
 
-        header = u'Hawk mac="{mac}"'.format(mac=prepare_header_val(mac))
+        # The MAC and content hash are base64, the ID was validated when
+        # the credentials were prepared and the timestamp is a number,
+        # so only the values a caller can provide need to be checked.
+        header = [u'Hawk mac="', normalize_header_attr(mac)]
 
         if resource.content_hash:
-            header = u'{header}, hash="{hash}"'.format(
-                header=header,
-                hash=prepare_header_val(resource.content_hash))
+            header.append(u'", hash="')
+            header.append(normalize_header_attr(resource.content_hash))
 
         if 'id' in keys:
-            header = u'{header}, id="{id}"'.format(
-                header=header,
-                id=prepare_header_val(resource.credentials['id']))
+            header.append(u'", id="')
+            header.append(resource.credentials['id'])
 
         if 'ts' in keys:
-            header = u'{header}, ts="{ts}"'.format(
-                header=header, ts=prepare_header_val(resource.timestamp))
+            header.append(u'", ts="')
+            header.append(resource.timestamp)
 
         if 'nonce' in keys:
-            header = u'{header}, nonce="{nonce}"'.format(
-                header=header, nonce=prepare_header_val(resource.nonce))
+            header.append(u'", nonce="')
+            header.append(normalize_header_attr(resource.nonce))
 
         # These are optional so we need to check if they have values first.
-
-        if 'ext' in keys and resource.ext:
-            header = u'{header}, ext="{ext}"'.format(
-                header=header, ext=prepare_header_val(resource.ext))
-
-        if 'app' in keys and resource.app:
-            header = u'{header}, app="{app}"'.format(
-                header=header, app=prepare_header_val(resource.app))
-
-        if 'dlg' in keys and resource.dlg:
-            header = u'{header}, dlg="{dlg}"'.format(
-                header=header, dlg=prepare_header_val(resource.dlg))
-
-        log.debug('Hawk header for URL={url} method={method}: {header}'
-                  .format(url=resource.url, method=resource.method,
-                          header=header))
+        for key in _optional_header_keys:
+            value = getattr(resource, key)
+            if value and key in keys:
+                value = normalize_header_attr(value)
+                if key not in validated:
+                    validate_header_attr(value, name=key)
+                header.append(u'", ' + key + u'="')
+                header.append(value)
+
+        header.append(u'"')
+        header = u''.join(header)
+
+        log.debug('Hawk header for URL=%s method=%s: %s',
+                  resource.url, resource.method, header)
+        if as_bytes:
+            return header.encode('ascii')
         return header
 
 
-class Resource:
+class Resource(object):
     """
     Normalized request / response resource.
 
@@ -184,18 +243,26 @@ class Resource:
         A dict of credentials; it must have the keys:
         ``id``, ``key``, and ``algorithm``.
         See :ref:`sending-request` for an example.
+        This can also be a :class:`mohawk.util.Credentials` object.
     :type credentials_map: dict
 
-    :param url: Absolute URL of the request / response.
+    :param url:
+        Absolute URL of the request / response or its
+        :data:`mohawk.base.ParsedURL`.
     :type url: str
 
     :param method: Method of the request / response. E.G. POST, GET
     :type method: str
 
-    :param content=EmptyValue: Byte string of request / response body.
+    :param content=EmptyValue:
+        Byte string of request / response body or a
+        :class:`mohawk.util.PayloadHasher` that hashed it.
     :type content=EmptyValue: str
 
-    :param content_type=EmptyValue: content-type header value for request / response.
+    :param content_type=EmptyValue:
+        content-type header value for request / response.
+        This defaults to the content type of a
+        :class:`mohawk.util.PayloadHasher` passed as ``content``.
     :type content_type=EmptyValue: str
 
     :param always_hash_content=True:
@@ -233,40 +300,62 @@ class Resource:
     .. _`Hawk`: https://github.com/hueniverse/hawk
     """
 
-    def __init__(self, **kw):
-        self.credentials = kw.pop('credentials')
-        self.credentials['id'] = prepare_header_val(self.credentials['id'])
-        self.method = kw.pop('method').upper()
-        self.content = kw.pop('content', EmptyValue)
-        self.content_type = kw.pop('content_type', EmptyValue)
-        self.always_hash_content = kw.pop('always_hash_content', True)
-        self.ext = kw.pop('ext', None)
-        self.app = kw.pop('app', None)
-        self.dlg = kw.pop('dlg', None)
-
-        self.timestamp = str(kw.pop('timestamp', None) or utc_now())
-
-        self.nonce = kw.pop('nonce', None)
-        if self.nonce is None:
-            self.nonce = random_string(6)
+    __slots__ = ('credentials', 'method', 'content', 'content_type',
+                 'always_hash_content', 'ext', 'app', 'dlg', 'timestamp',
+                 'nonce', 'seen_nonce', 'url', 'name', 'host', 'port',
+                 '_content_hash', '_mac_credentials')
+
+    def __init__(self, credentials, url, method,
+                 content=EmptyValue,
+                 content_type=EmptyValue,
+                 always_hash_content=True,
+                 ext=None,
+                 app=None,
+                 dlg=None,
+                 timestamp=None,
+                 nonce=None,
+                 seen_nonce=None):
+        if not isinstance(credentials, Credentials):
+            credentials['id'] = prepare_header_val(credentials['id'])
+        self.credentials = credentials
+        # Compiled credentials to sign with instead of ``credentials``.
+        self._mac_credentials = None
+        self.method = method.upper()
+        if isinstance(content, PayloadHasher):
+            if content_type == EmptyValue:
+                content_type = content.content_type
+            elif (parse_content_type(content_type) !=
+                  parse_content_type(content.content_type)):
+                raise ValueError(
+                    'content_type {typ!r} does not match the content type '
+                    'of the payload hasher: {hashed!r}'
+                    .format(typ=content_type,
+                            hashed=content.content_type))
+        self.content = content
+        self.content_type = content_type
+        self.always_hash_content = always_hash_content
+        self.ext = ext
+        self.app = app
+        self.dlg = dlg
+
+        self.timestamp = str(timestamp or utc_now())
+
+        if nonce is None:
+            nonce = random_string(6)
+        self.nonce = nonce
 
         # This is a lookup function for checking nonces.
-        self.seen_nonce = kw.pop('seen_nonce', None)
+        self.seen_nonce = seen_nonce
 
-        self.url = kw.pop('url')
-        if not self.url:
+        if not url:
             raise ValueError('url was empty')
-        url_parts = self.parse_url(self.url)
-        log.debug('parsed URL parts: \n{parts}'
-                  .format(parts=pprint.pformat(url_parts)))
-
-        self.name = url_parts['resource'] or ''
-        self.host = url_parts['hostname'] or ''
-        self.port = str(url_parts['port'])
-
-        if kw.keys():
-            raise TypeError('Unknown keyword argument(s): {0}'
-                            .format(kw.keys()))
+        self.url = url
+        if isinstance(url, ParsedURL):
+            self.name, self.host, self.port = url
+        else:
+            self.name, self.host, self.port = split_url(url)
+            log.debug('parsed URL parts: name=%r host=%r port=%r',
+                      self.name, self.host, self.port)
 
     @property
     def content_hash(self):
@@ -286,29 +375,121 @@ class Resource:
                     'empty when always_hash_content is True')
             log.debug('NOT hashing content')
             self._content_hash = None
+        elif isinstance(self.content, PayloadHasher):
+            if self.content.algorithm != self.credentials['algorithm']:
+                raise ValueError(
+                    'content was hashed with {hashed} but the credentials '
+                    'use {algo}'.format(hashed=self.content.algorithm,
+                                        algo=self.credentials['algorithm']))
+            self._content_hash = self.content.finalize()
         else:
+            algorithm = self.credentials
+            if not isinstance(algorithm, Credentials):
+                algorithm = algorithm['algorithm']
             self._content_hash = calculate_payload_hash(
-                self.content, self.credentials['algorithm'],
-                self.content_type)
+                self.content, algorithm, self.content_type)
         return self.content_hash
 
+    def gen_content_digest(self):
+        """
+        Returns the raw payload hash to verify the content with.
+
+        This checks the content like :meth:`gen_content_hash` but
+        doesn't base64 encode the hash.
+        """
+        if self.content == EmptyValue or self.content_type == EmptyValue:
+            # The same checks and result as gen_content_hash().
+            return self.gen_content_hash()
+        elif isinstance(self.content, PayloadHasher):
+            if self.content.algorithm != self.credentials['algorithm']:
+                raise ValueError(
+                    'content was hashed with {hashed} but the credentials '
+                    'use {algo}'.format(hashed=self.content.algorithm,
+                                        algo=self.credentials['algorithm']))
+            return self.content.digest()
+        algorithm = self.credentials
+        if not isinstance(algorithm, Credentials):
+            algorithm = algorithm['algorithm']
+        return calculate_payload_digest(self.content, algorithm,
+                                        self.content_type)
+
     def parse_url(self, url):
-        url_parts = urlparse(url)
-        url_dict = {
-            'scheme': url_parts.scheme,
-            'hostname': url_parts.hostname,
-            'port': url_parts.port,
-            'path': url_parts.path,
-            'resource': url_parts.path,
-            'query': url_parts.query,
-        }
-        if len(url_dict['query']) > 0:
-            url_dict['resource'] = '%s?%s' % (url_dict['resource'],
-                                              url_dict['query'])
-
-        if url_parts.port is None:
-            if url_parts.scheme == 'http':
-                url_dict['port'] = 80
-            elif url_parts.scheme == 'https':
-                url_dict['port'] = 443
-        return url_dict
+        return _parse_url(url)
+
+
+def _parse_url(url):
+    url_parts = urlparse(url)
+    url_dict = {
+        'scheme': url_parts.scheme,
+        'hostname': url_parts.hostname,
+        'port': url_parts.port,
+        'path': url_parts.path,
+        'resource': url_parts.path,
+        'query': url_parts.query,
+    }
+    if len(url_dict['query']) > 0:
+        url_dict['resource'] = '%s?%s' % (url_dict['resource'],
+                                          url_dict['query'])
+
+    if url_parts.port is None:
+        if url_parts.scheme == 'http':
+            url_dict['port'] = 80
+        elif url_parts.scheme == 'https':
+            url_dict['port'] = 443
+    return url_dict
+
+
+#: A snapshot of the URL cache statistics returned by
+#: :func:`mohawk.base.url_cache_stats`.
+URLCacheStats = namedtuple('URLCacheStats',
+                           'size maxsize hits misses evictions')
+
+# Most services see the same few hundred URLs over and over again,
+# so their parsed parts are cached for the whole process.
+_url_cache = LRUCache(1024)
+
+
+def split_url(url):
+    """
+    Returns the :data:`mohawk.base.ParsedURL` of an absolute URL.
+
+    Results are cached; see :func:`mohawk.base.configure_url_cache`.
+
+    :param url: Absolute URL of a request / response.
+    :type url: str
+    """
+    parsed_url = _url_cache.get(url)
+    if parsed_url is None:
+        parsed_url = _split_url(url)
+        _url_cache.set(url, parsed_url)
+    return parsed_url
+
+
+def _split_url(url):
+    # split_url() without the cache.
+    url_parts = _parse_url(url)
+    return ParsedURL(url_parts['resource'] or '',
+                     url_parts['hostname'] or '',
+                     str(url_parts['port']))
+
+
+def configure_url_cache(maxsize):
+    """
+    Sets how many parsed URLs to cache, empties the cache
+    and resets its statistics.
+
+    :param maxsize: Maximum number of URLs to cache. 0 turns caching off.
+    :type maxsize: int
+    """
+    _url_cache.clear()
+    _url_cache.maxsize = maxsize
+    _url_cache.hits = _url_cache.misses = _url_cache.evictions = 0
+
+
+def url_cache_stats():
+    """Returns a :data:`mohawk.base.URLCacheStats` snapshot."""
+    return URLCacheStats(size=len(_url_cache),
+                         maxsize=_url_cache.maxsize,
+                         hits=_url_cache.hits,
+                         misses=_url_cache.misses,
+                         evictions=_url_cache.evictions)
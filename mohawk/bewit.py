@@ -1,17 +1,23 @@
-from base64 import urlsafe_b64encode, b64decode
+from base64 import b64decode, b64encode, urlsafe_b64encode
 from collections import namedtuple
+import hmac
 import logging
 import re
 
 import six
 
-from .base import Resource
-from .util import (calculate_mac,
-                   strings_match,
+from .base import _split_url, ParsedURL, split_url
+from .cache import LRUCache
+from .receiver import _lookup_credentials
+from .util import (_hmac_digest,
+                   calculate_mac,
+                   compile_credentials,
+                   credentials_fingerprint,
+                   digest_matches,
+                   HAWK_VER,
                    utc_now,
                    validate_header_attr)
-from .exc import (CredentialsLookupError,
-                  InvalidBewit,
+from .exc import (InvalidBewit,
                   MacMismatch,
                   TokenExpired)
 
@@ -61,6 +67,66 @@ def get_bewit(resource):
     return bewit_bytes.decode('ascii')
 
 
+def get_bewits(credentials, expiration, urls, ext=None):
+    """
+    Generates bewit URLs for many resources that expire at the same time.
+
+    This yields each URL of ``urls`` with a ``bewit`` query parameter
+    added, just like :func:`get_bewit` would, but much faster because no
+    :class:`mohawk.base.Resource` is created and the HMAC key is only
+    prepared once::
+
+        for url in get_bewits(credentials, utc_now() + 3600, download_urls):
+            ...
+
+    :param credentials:
+        A dict of credentials with the keys ``id``, ``key``, and
+        ``algorithm`` or a :class:`mohawk.util.Credentials` object.
+    :type credentials: dict
+
+    :param expiration: UTC timestamp after which the bewits expire.
+    :type expiration: int
+
+    :param urls: Iterable of absolute URLs.
+    :type urls: iterable
+
+    :param ext=None: An external `Hawk`_ string to add to each bewit.
+    :type ext=None: str
+
+    .. _`Hawk`: https://github.com/hueniverse/hawk
+    """
+    credentials = compile_credentials(credentials)
+    expiration = str(expiration)
+    if ext is None:
+        ext = ''
+    else:
+        validate_header_attr(ext, name='ext')
+
+    hmac_prefix = credentials._hmac.copy()
+    hmac_prefix.update(u'hawk.{ver}.bewit\n{exp}\n\nGET\n'.format(
+        ver=HAWK_VER, exp=expiration).encode('utf8'))
+    hmac_suffix = u'\n\n{ext}\n'.format(ext=ext)
+    bewit_prefix = u'{id}\\{exp}\\'.format(
+        id=credentials.id, exp=expiration).encode('ascii')
+    bewit_suffix = u'\\{ext}'.format(ext=ext).encode('ascii')
+
+    for url in urls:
+        name, host, port = _split_url(url)
+        h = hmac_prefix.copy()
+        h.update(u'\n'.join([name, host, port + hmac_suffix]).encode('utf8'))
+        bewit = urlsafe_b64encode(bewit_prefix + b64encode(h.digest()) +
+                                  bewit_suffix).decode('ascii')
+        yield _add_bewit(url, bewit)
+
+
+def _add_bewit(url, bewit):
+    # Adds the bewit parameter to the query string of a URL.
+    url, sep, fragment = url.partition('#')
+    return u'{url}{join}bewit={bewit}{sep}{fragment}'.format(
+        url=url, join='&' if '?' in url else '?', bewit=bewit,
+        sep=sep, fragment=fragment)
+
+
 bewittuple = namedtuple('bewittuple', 'id expiration mac ext')
 
 
@@ -81,6 +147,9 @@ def parse_bewit(bewit):
     return bewittuple(*bewit_parts)
 
 
+_bewit_param = re.compile('[?&]bewit=([^&]+)')
+
+
 def strip_bewit(url):
     """
     Strips the bewit parameter out of a url.
@@ -93,7 +162,7 @@ def strip_bewit(url):
         The url containing a bewit parameter
     :type url: str
     """
-    m = re.search('[?&]bewit=([^&]+)', url)
+    m = _bewit_param.search(url)
     if not m:
         raise InvalidBewit('no bewit data found')
     bewit = m.group(1)
@@ -101,53 +170,145 @@ def strip_bewit(url):
     return bewit, stripped_url
 
 
-def check_bewit(url, credential_lookup, now=None):
+class BewitCache(object):
+    """
+    Remembers bewit URLs that :func:`check_bewit` has verified.
+
+    Pass one to each call to check a popular link only once::
+
+        bewit_cache = BewitCache()
+        check_bewit(url, lookup_credentials, cache=bewit_cache)
+
+    Entries are keyed by the bewit and the URL without it. A cached
+    bewit still expires at its own expiration time and is checked again
+    when the key or algorithm of its credentials has changed, so
+    ``credential_lookup`` is called on every hit. Wrap it in a
+    :class:`mohawk.cache.CredentialsCache` to make that cheap too: for
+    :class:`mohawk.util.Credentials`, a hit is then a lookup and a
+    comparison, while a credentials dict costs a short HMAC on each hit.
+
+    :param maxsize=1024: Maximum number of bewit URLs to remember.
+    :type maxsize=1024: int
+    """
+
+    def __init__(self, maxsize=1024):
+        self._cache = LRUCache(maxsize)
+
+    def _get(self, raw_bewit, stripped_url):
+        return self._cache.get((raw_bewit, stripped_url))
+
+    def _set(self, raw_bewit, stripped_url, bewit, credentials, ttl):
+        if ttl > 0:
+            self._cache.set((raw_bewit, stripped_url),
+                            (bewit, credentials_fingerprint(credentials)),
+                            ttl=ttl)
+
+    def _discard(self, raw_bewit, stripped_url):
+        self._cache.pop((raw_bewit, stripped_url))
+
+    def clear(self):
+        """Forgets all verified bewits."""
+        self._cache.clear()
+
+
+def check_bewit(url, credential_lookup, now=None, cache=None,
+                localtime_offset_in_seconds=0,
+                timestamp_skew_in_seconds=0):
     """
     Validates the given bewit.
 
     Returns True if the resource has a valid bewit parameter attached,
     or raises a subclass of HawkFail otherwise.
 
+    :param url:
+        The URL containing a bewit parameter or a
+        :data:`mohawk.base.ParsedURL` whose ``name`` contains it, such as
+        the one returned by :func:`mohawk.wsgi.environ_url`.
+    :type url: str
+
     :param credential_lookup:
         Callable to look up the credentials dict by sender ID.
         The credentials dict must have the keys:
         ``id``, ``key``, and ``algorithm``.
         See :ref:`receiving-request` for an example.
+        The callable can also return a :class:`mohawk.util.Credentials`
+        object.
     :type credential_lookup: callable
 
     :param now=None:
         Unix epoch time for the current time to determine if bewit has expired.
         If None, then the current time as given by utc_now() is used.
     :type now=None: integer
+
+    :param cache=None:
+        A :class:`mohawk.bewit.BewitCache` to skip checking the MAC
+        of a bewit URL that was verified before.
+    :type cache=None: :class:`mohawk.bewit.BewitCache`
+
+    :param localtime_offset_in_seconds=0:
+        Seconds to add to the local time when ``now`` is None.
+    :type localtime_offset_in_seconds=0: float
+
+    :param timestamp_skew_in_seconds=0:
+        Seconds a bewit is still accepted for after it has expired,
+        to allow for clocks that are not in sync.
+    :type timestamp_skew_in_seconds=0: float
     """
-    raw_bewit, stripped_url = strip_bewit(url)
+    if isinstance(url, ParsedURL):
+        raw_bewit, name = strip_bewit(url.name)
+        stripped_url = ParsedURL(name, url.host, url.port)
+    else:
+        raw_bewit, stripped_url = strip_bewit(url)
+    if now is None:
+        now = utc_now(offset_in_seconds=localtime_offset_in_seconds)
+
+    if cache is not None:
+        entry = cache._get(raw_bewit, stripped_url)
+        if entry is not None:
+            bewit, fingerprint = entry
+            _check_expiration(bewit, now, timestamp_skew_in_seconds)
+            credentials = _lookup_credentials(credential_lookup, bewit.id)
+            if hmac.compare_digest(credentials_fingerprint(credentials),
+                                   fingerprint):
+                return True
+            log.debug('credentials of %s changed; checking bewit again',
+                      bewit.id)
+            cache._discard(raw_bewit, stripped_url)
+
     bewit = parse_bewit(raw_bewit)
-    try:
-        credentials = credential_lookup(bewit.id)
-    except LookupError:
-        raise CredentialsLookupError('Could not find credentials for ID {0}'
-                                     .format(bewit.id))
-
-    res = Resource(url=stripped_url,
-                   method='GET',
-                   credentials=credentials,
-                   timestamp=bewit.expiration,
-                   nonce='',
-                   ext=bewit.ext,
-                   )
-    mac = calculate_mac('bewit', res, None)
-    mac = mac.decode('ascii')
-
-    if not strings_match(mac, bewit.mac):
+    # Expired bewits are rejected before any work is done for the MAC.
+    expiration = _check_expiration(bewit, now, timestamp_skew_in_seconds)
+    credentials = _lookup_credentials(credential_lookup, bewit.id)
+
+    if isinstance(stripped_url, ParsedURL):
+        name, host, port = stripped_url
+    else:
+        name, host, port = split_url(stripped_url)
+    normalized = u'hawk.{ver}.bewit\n{exp}\n\nGET\n{name}\n{host}\n{port}' \
+                 u'\n\n{ext}\n'.format(ver=HAWK_VER, exp=bewit.expiration,
+                                       name=name, host=host, port=port,
+                                       ext=bewit.ext)
+    mac = _hmac_digest(credentials, normalized.encode('utf8'))
+
+    if not digest_matches(mac, bewit.mac):
         raise MacMismatch('bewit with mac {bewit_mac} did not match expected mac {expected_mac}'
                           .format(bewit_mac=bewit.mac,
-                                  expected_mac=mac))
+                                  expected_mac=b64encode(mac).decode('ascii')))
 
-    # Check that the timestamp isn't expired
-    if now is None:
-        # TODO: Add offset/skew
-        now = utc_now()
-    if int(bewit.expiration) < now:
+    if cache is not None:
+        cache._set(raw_bewit, stripped_url, bewit, credentials,
+                   expiration + timestamp_skew_in_seconds - now)
+    return True
+
+
+def _check_expiration(bewit, now, timestamp_skew_in_seconds):
+    # Returns the expiration of a bewit that has not expired.
+    try:
+        expiration = int(bewit.expiration)
+    except ValueError:
+        raise InvalidBewit('bewit has an invalid expiration: {exp!r}'
+                           .format(exp=bewit.expiration))
+    if expiration + timestamp_skew_in_seconds < now:
         # TODO: Refactor TokenExpired to handle this better
         raise TokenExpired('bewit with UTC timestamp {ts} has expired; '
                            'it was compared to {now}'
@@ -155,5 +316,4 @@ def check_bewit(url, credential_lookup, now=None):
                            localtime_in_seconds=now,
                            www_authenticate=''
                            )
-
-    return True
+    return expiration
@@ -0,0 +1,254 @@
+from collections import namedtuple, OrderedDict
+import logging
+import sys
+import threading
+import time
+
+from .util import compile_credentials
+
+__all__ = ['CredentialsCache', 'LRUCache']
+log = logging.getLogger(__name__)
+
+try:
+    monotonic = time.monotonic
+except AttributeError:  # Python 2
+    monotonic = time.time
+
+_missing = object()
+
+
+class LRUCache(object):
+    """
+    A thread-safe, bounded cache that discards the least recently used
+    entries first.
+
+    Entries can optionally expire at a given time of a monotonic ``clock``.
+
+    :param maxsize: Maximum number of entries. When 0, nothing is cached.
+    :type maxsize: int
+
+    :param clock=time.monotonic: Callable returning the current time.
+    :type clock=time.monotonic: callable
+    """
+
+    def __init__(self, maxsize, clock=monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        #: Number of lookups that found a live entry.
+        self.hits = 0
+        #: Number of lookups that found nothing or an expired entry.
+        self.misses = 0
+        #: Number of entries discarded to stay within ``maxsize``.
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Returns the live entry for ``key`` or ``default``."""
+        with self._lock:
+            entry = self._data.pop(key, _missing)
+            if entry is not _missing:
+                value, expires = entry
+                if expires is None or expires > self.clock():
+                    self._data[key] = entry
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """
+        Returns the live entry for ``key`` or ``default`` without counting
+        a hit or miss and without marking it as recently used.
+        """
+        with self._lock:
+            entry = self._data.get(key, _missing)
+        if entry is not _missing:
+            value, expires = entry
+            if expires is None or expires > self.clock():
+                return value
+        return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores ``value`` for ``key``.
+
+        The entry expires after ``ttl`` seconds unless ``ttl`` is None.
+        """
+        if self.maxsize <= 0:
+            return
+        expires = None if ttl is None else self.clock() + ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Removes the entry for ``key`` and returns its value."""
+        with self._lock:
+            entry = self._data.pop(key, _missing)
+        if entry is _missing:
+            return default
+        return entry[0]
+
+    def clear(self):
+        """Removes all entries."""
+        with self._lock:
+            self._data.clear()
+
+
+class _NotFound(object):
+    # A cached LookupError.
+
+    def __init__(self, message):
+        self.message = message
+
+
+class _Flight(object):
+    # A credentials lookup in progress that other threads can wait for.
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+#: A snapshot of :class:`mohawk.cache.CredentialsCache` statistics.
+CredentialsCacheStats = namedtuple(
+    'CredentialsCacheStats',
+    'size hits misses negative_hits lookups coalesced evictions')
+
+
+class CredentialsCache(object):
+    """
+    Caches the credentials returned by a ``credentials_map`` callable.
+
+    This can be passed anywhere a ``credentials_map`` or
+    ``credential_lookup`` callable is accepted, for example::
+
+        credentials_map = CredentialsCache(lookup_credentials)
+        receiver = Receiver(credentials_map, ...)
+
+    By default, credentials are stored as :class:`mohawk.util.Credentials`
+    objects so that their keys are only prepared once. These only keep
+    ``id``, ``key`` and ``algorithm``; pass ``compiled=False`` to store
+    what ``credentials_map`` returned as is, for example when its dicts
+    carry extra keys your application reads back from
+    ``receiver.resource.credentials``.
+    When the wrapped callable raises a ``LookupError``, that is cached too,
+    which means :class:`mohawk.exc.CredentialsLookupError` will be raised
+    for the same ID until ``negative_ttl`` runs out.
+    Concurrent misses for the same ID result in a single call
+    to the wrapped callable.
+
+    :param credentials_map:
+        Callable to look up the credentials dict by sender ID.
+    :type credentials_map: callable
+
+    :param maxsize=1024: Maximum number of IDs to cache.
+    :type maxsize=1024: int
+
+    :param ttl=300: Seconds to cache credentials for.
+    :type ttl=300: float
+
+    :param negative_ttl=30: Seconds to cache an unknown ID for.
+    :type negative_ttl=30: float
+
+    :param clock=time.monotonic: Callable returning the current time.
+    :type clock=time.monotonic: callable
+
+    :param compiled=True:
+        Store credentials as :class:`mohawk.util.Credentials` objects.
+    :type compiled=True: bool
+    """
+
+    def __init__(self, credentials_map, maxsize=1024, ttl=300,
+                 negative_ttl=30, clock=monotonic, compiled=True):
+        self.credentials_map = credentials_map
+        self.compiled = compiled
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.negative_hits = 0
+        self.lookups = 0
+        self.coalesced = 0
+        self._cache = LRUCache(maxsize, clock=clock)
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, sender_id):
+        entry = self._cache.get(sender_id, _missing)
+        if entry is _missing:
+            entry = self._lookup(sender_id)
+        elif isinstance(entry, _NotFound):
+            with self._lock:
+                self.negative_hits += 1
+        if isinstance(entry, _NotFound):
+            raise LookupError(entry.message)
+        return entry
+
+    def _lookup(self, sender_id):
+        with self._lock:
+            # Another thread may have finished looking up this ID
+            # since we missed the cache.
+            entry = self._cache.peek(sender_id, _missing)
+            if entry is not _missing:
+                return entry
+            flight = self._flights.get(sender_id)
+            leader = flight is None
+            if leader:
+                flight = self._flights[sender_id] = _Flight()
+                self.lookups += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            try:
+                entry = self.credentials_map(sender_id)
+                if self.compiled:
+                    entry = compile_credentials(entry)
+                ttl = self.ttl
+            except LookupError:
+                etype, val, tb = sys.exc_info()
+                log.debug('caching %s for ID %s: %s', etype, sender_id, val)
+                entry = _NotFound(str(val))
+                ttl = self.negative_ttl
+            self._cache.set(sender_id, entry, ttl=ttl)
+            flight.result = entry
+            return entry
+        except Exception:
+            flight.error = sys.exc_info()[1]
+            raise
+        finally:
+            with self._lock:
+                del self._flights[sender_id]
+            flight.done.set()
+
+    def invalidate(self, sender_id):
+        """Forgets the cached credentials of a sender ID."""
+        self._cache.pop(sender_id)
+
+    def clear(self):
+        """Forgets all cached credentials."""
+        self._cache.clear()
+
+    def stats(self):
+        """Returns a :data:`CredentialsCacheStats` snapshot."""
+        return CredentialsCacheStats(size=len(self._cache),
+                                     hits=(self._cache.hits -
+                                           self.negative_hits),
+                                     misses=self._cache.misses,
+                                     negative_hits=self.negative_hits,
+                                     lookups=self.lookups,
+                                     coalesced=self.coalesced,
+                                     evictions=self._cache.evictions)
@@ -0,0 +1,123 @@
+"""
+Clock synchronization for senders.
+
+When the clock of a sender is off by more than the receiver allows,
+the receiver raises :class:`mohawk.exc.TokenExpired` and can send its
+``www_authenticate`` header back. That header has the receiver's time
+and a MAC of it made with the sender's credentials, so the sender can
+safely adjust its own timestamps.
+"""
+import logging
+import threading
+
+import six
+
+from .exc import HawkFail, MacMismatch
+from .util import (calculate_ts_mac,
+                   parse_authorization_header,
+                   strings_match,
+                   utc_now)
+
+__all__ = ['ClockOffsetTracker']
+log = logging.getLogger(__name__)
+
+
+class ClockOffsetTracker(object):
+    """
+    Learns the clock offset of each sender from the receiver's
+    ``ts`` / ``tsm`` challenges.
+
+    Share one tracker between the senders of a process and hand the
+    ``WWW-Authenticate`` header of each 401 response to :meth:`update`::
+
+        clock_offsets = ClockOffsetTracker()
+        sender = Sender(credentials, url, method,
+                        clock_offsets=clock_offsets, ...)
+        ...
+        if response.status_code == 401:
+            clock_offsets.update(response.headers['WWW-Authenticate'],
+                                 credentials)
+
+    Requests signed after that use the receiver's time.
+    This is thread-safe.
+
+    :param clock=utc_now: Callable returning the current UTC timestamp.
+    :type clock=utc_now: callable
+    """
+
+    def __init__(self, clock=utc_now):
+        self.clock = clock
+        self._offsets = {}
+        self._lock = threading.Lock()
+
+    def update(self, www_authenticate, credentials):
+        """
+        Verifies a challenge and remembers the clock offset it implies.
+
+        Returns True if the challenge had a timestamp to learn from
+        or False if it was a plain ``Hawk`` challenge.
+
+        :param www_authenticate:
+            Value of the ``WWW-Authenticate`` header of a response, such as
+            :attr:`mohawk.exc.TokenExpired.www_authenticate`.
+        :type www_authenticate: str
+
+        :param credentials:
+            The credentials the rejected request was signed with.
+        :type credentials: dict
+
+        :raises: :class:`mohawk.exc.MacMismatch` if the ``tsm`` doesn't
+                 match the ``ts`` of the challenge.
+        """
+        if isinstance(www_authenticate, six.binary_type):
+            www_authenticate = www_authenticate.decode('utf8')
+        if not www_authenticate or ' ' not in www_authenticate.strip():
+            return False
+        parsed_header = parse_authorization_header(www_authenticate.strip())
+        if parsed_header.ts is None:
+            return False
+        if parsed_header.tsm is None:
+            raise HawkFail('challenge has a ts but no tsm')
+
+        tsm = calculate_ts_mac(parsed_header.ts, credentials)
+        if isinstance(tsm, six.binary_type):
+            tsm = tsm.decode('ascii')
+        if not strings_match(tsm, parsed_header.tsm):
+            raise MacMismatch('MACs do not match; ours: {ours}; '
+                              'theirs: {theirs}'
+                              .format(ours=tsm, theirs=parsed_header.tsm))
+
+        try:
+            their_ts = int(parsed_header.ts)
+        except ValueError:
+            raise HawkFail('challenge has an invalid ts: {ts!r}'
+                           .format(ts=parsed_header.ts))
+        offset = their_ts - self.clock()
+        with self._lock:
+            self._offsets[credentials['id']] = offset
+        log.info('clock of %s is off by %d second(s)',
+                 credentials['id'], -offset)
+        return True
+
+    def offset(self, credentials):
+        """
+        Returns the seconds to add to the local time
+        when signing with ``credentials``.
+        """
+        return self._offsets.get(credentials['id'], 0)
+
+    def now(self, credentials):
+        """
+        Returns the UTC timestamp to sign with ``credentials`` at.
+        """
+        return self.clock() + self._offsets.get(credentials['id'], 0)
+
+    def reset(self, credentials=None):
+        """
+        Forgets the offset of ``credentials`` or, when None, all offsets.
+        """
+        with self._lock:
+            if credentials is None:
+                self._offsets.clear()
+            else:
+                self._offsets.pop(credentials['id'], None)
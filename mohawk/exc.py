@@ -1,14 +1,11 @@
 """
 If you want to catch any exception that might be raised,
 catch :class:`mohawk.exc.HawkFail`.
-<<<<<<< master
 
 .. important::
 
     Never expose an exception message publicly, say, in an HTTP
     response, as it may provide hints to an attacker.
-=======
->>>>>>> 14f3100
 """
 
 
@@ -16,15 +13,12 @@ class HawkFail(Exception):
     """
     All Mohawk exceptions derive from this base.
     """
-<<<<<<< master
 
 
 class MissingAuthorization(HawkFail):
     """
     No authorization header was sent by the client.
     """
-=======
->>>>>>> 14f3100
 
 
 class InvalidCredentials(HawkFail):
@@ -65,7 +59,6 @@ class TokenExpired(HawkFail):
     """
     The timestamp on a message received has expired.
 
-<<<<<<< master
     You may also receive this message if your server clock is out of sync.
     Consider synchronizing it with something like `TLSdate`_.
 
@@ -78,7 +71,8 @@ class TokenExpired(HawkFail):
     that can be returned to the client. If the value is not None, it
     will include a timestamp HMAC'd with the sender's credentials.
     This will allow the client
-    to verify the value and safely apply an offset.
+    to verify the value and safely apply an offset,
+    for example with :class:`mohawk.clock.ClockOffsetTracker`.
 
     .. _`Hawk`: https://github.com/hueniverse/hawk
     .. _`adjust`: https://github.com/hueniverse/hawk#future-time-manipulation
@@ -88,21 +82,6 @@ class TokenExpired(HawkFail):
     localtime_in_seconds = None
     # A header containing an HMAC'd server timestamp that the sender can verify.
     www_authenticate = None
-=======
-    .. important::
-
-        The `Hawk`_ spec mentions how you can synchronize
-        your sender's time with the receiver in the case
-        of unexpected expiration. However, do not expose a local
-        timestamp in the raw since it can potentially be used for an attack.
-        See the Hawk Node lib for an example of HMAC'ing the
-        timestamp for comparison.
-
-    .. _`Hawk`: https://github.com/hueniverse/hawk
-    """
-    #: Current local time in seconds that was used to compare timestamps.
-    localtime_in_seconds = None
->>>>>>> 14f3100
 
     def __init__(self, *args, **kw):
         self.localtime_in_seconds = kw.pop('localtime_in_seconds')
@@ -113,7 +92,6 @@ class TokenExpired(HawkFail):
 class AlreadyProcessed(HawkFail):
     """
     The message has already been processed and cannot be re-processed.
-<<<<<<< master
 
     See :ref:`nonce` for details.
     """
@@ -131,8 +109,4 @@ class MissingContent(HawkFail):
     A payload's `content` or `content_type` were not provided.
 
     See :ref:`skipping-content-checks` for details.
-=======
-
-    See :ref:`nonce` for details.
->>>>>>> 14f3100
     """
@@ -0,0 +1,856 @@
+"""
+Ready-made ``seen_nonce`` callables.
+
+Each store in this module can be passed as the ``seen_nonce`` argument of
+:class:`mohawk.Receiver` (or :class:`mohawk.Sender`). See :ref:`nonce`
+for details.
+
+A store only has to remember a nonce for as long as the receiver would
+accept its timestamp. Create it with a ``timestamp_skew_in_seconds`` at
+least as large as the one you give the receiver.
+"""
+import hashlib
+import heapq
+import logging
+import math
+import mmap
+import multiprocessing
+import os
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import weakref
+
+import six
+
+from .base import default_ts_skew_in_seconds
+from .util import utc_now
+
+__all__ = ['BloomNonceStore', 'MemoryNonceStore', 'RedisNonceStore',
+           'SharedMemoryNonceStore', 'SQLiteNonceStore']
+log = logging.getLogger(__name__)
+
+
+class MemoryNonceStore(object):
+    """
+    A thread-safe, in-memory ``seen_nonce`` store.
+
+    Nonces are kept in buckets of ``bucket_seconds`` according to their
+    timestamps. Once every timestamp in a bucket is older than
+    ``timestamp_skew_in_seconds``, the whole bucket is dropped at once,
+    so memory stays bounded by the request rate within the skew window.
+
+    :param timestamp_skew_in_seconds=60:
+        Max seconds a timestamp may differ from the current time.
+    :type timestamp_skew_in_seconds=60: int
+
+    :param bucket_seconds=None:
+        How many seconds of timestamps share a bucket.
+        Defaults to a quarter of ``timestamp_skew_in_seconds``.
+    :type bucket_seconds=None: int
+
+    :param clock=utc_now: Callable returning the current UTC timestamp.
+    :type clock=utc_now: callable
+    """
+
+    def __init__(self, timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 bucket_seconds=None, clock=utc_now):
+        self.timestamp_skew_in_seconds = timestamp_skew_in_seconds
+        self.bucket_seconds = int(bucket_seconds or
+                                  max(1, timestamp_skew_in_seconds // 4))
+        self.clock = clock
+        #: Number of nonces currently stored.
+        self.size = 0
+        #: Number of nonces dropped because they expired.
+        self.evictions = 0
+        self._buckets = {}
+        self._bucket_heap = []
+        self._lock = threading.Lock()
+
+    def __call__(self, sender_id, nonce, timestamp):
+        """Returns True if the nonce was seen before; stores it otherwise."""
+        ts = int(timestamp)
+        bucket_id = ts // self.bucket_seconds
+        key = (sender_id, nonce, ts)
+
+        with self._lock:
+            oldest = self._expire()
+            if bucket_id < oldest:
+                # This timestamp has already expired so the request
+                # will be rejected anyway.
+                return False
+            bucket = self._buckets.get(bucket_id)
+            if bucket is None:
+                bucket = self._buckets[bucket_id] = set()
+                heapq.heappush(self._bucket_heap, bucket_id)
+            elif key in bucket:
+                return True
+            bucket.add(key)
+            self.size += 1
+            return False
+
+    def _expire(self):
+        # Drops buckets whose timestamps are all too old and returns
+        # the first bucket ID that can still hold valid timestamps.
+        cutoff = self.clock() - self.timestamp_skew_in_seconds
+        oldest = cutoff // self.bucket_seconds
+        heap = self._bucket_heap
+        while heap and heap[0] < oldest:
+            bucket = self._buckets.pop(heapq.heappop(heap))
+            self.size -= len(bucket)
+            self.evictions += len(bucket)
+        return oldest
+
+    def clear(self):
+        """Forgets all nonces."""
+        with self._lock:
+            self._buckets.clear()
+            del self._bucket_heap[:]
+            self.size = 0
+
+    def stats(self):
+        """Returns a dict of store statistics."""
+        with self._lock:
+            self._expire()
+            return {'size': self.size,
+                    'buckets': len(self._buckets),
+                    'evictions': self.evictions}
+
+
+def _nonce_key(sender_id, nonce, ts):
+    key = u'{id}\n{nonce}\n{ts}'.format(id=sender_id, nonce=nonce, ts=ts)
+    return key.encode('utf8')
+
+
+class _BloomFilter(object):
+    # A fixed size Bloom filter using double hashing.
+
+    def __init__(self, num_bits, num_hashes):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.count = 0
+        self.bits = bytearray((num_bits + 7) // 8)
+
+    def add(self, h1, h2):
+        # Adds an item and returns True if it was (probably) already there.
+        bits = self.bits
+        present = True
+        for i in range(self.num_hashes):
+            index = (h1 + i * h2) % self.num_bits
+            mask = 1 << (index & 7)
+            byte = bits[index >> 3]
+            if not byte & mask:
+                present = False
+                bits[index >> 3] = byte | mask
+        if not present:
+            self.count += 1
+        return present
+
+    def false_positive_rate(self):
+        return (1 - math.exp(-float(self.num_hashes) * self.count /
+                             self.num_bits)) ** self.num_hashes
+
+
+class BloomNonceStore(object):
+    """
+    A thread-safe, memory-compact ``seen_nonce`` store built on
+    Bloom filters.
+
+    Instead of the nonces themselves this keeps one Bloom filter for
+    each ``timestamp_skew_in_seconds`` window of timestamps. At most three
+    windows can hold valid timestamps at any time and older filters are
+    dropped, so memory use is fixed by ``capacity`` and ``error_rate``.
+
+    A replayed nonce is always detected while its timestamp is valid.
+    However, with probability ``error_rate`` a new nonce is reported as seen,
+    which makes :class:`mohawk.Receiver` reject a legitimate request with
+    :class:`mohawk.exc.AlreadyProcessed`. Tune ``capacity`` to the number
+    of requests you expect per window to keep that rate.
+
+    :param capacity=100000:
+        Expected number of requests per ``timestamp_skew_in_seconds``.
+    :type capacity=100000: int
+
+    :param error_rate=0.001: Target false positive rate at ``capacity``.
+    :type error_rate=0.001: float
+
+    :param timestamp_skew_in_seconds=60:
+        Max seconds a timestamp may differ from the current time.
+    :type timestamp_skew_in_seconds=60: int
+
+    :param clock=utc_now: Callable returning the current UTC timestamp.
+    :type clock=utc_now: callable
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001,
+                 timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 clock=utc_now):
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.timestamp_skew_in_seconds = int(timestamp_skew_in_seconds)
+        self.clock = clock
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) /
+                                      math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(
+            float(self.num_bits) / capacity * math.log(2))))
+        #: Number of filters dropped because their window expired.
+        self.rotations = 0
+        self._salt = os.urandom(16)
+        self._filters = {}
+        self._lock = threading.Lock()
+
+    def _hashes(self, sender_id, nonce, ts):
+        # The salt keeps senders from crafting colliding nonces.
+        digest = hashlib.sha256(self._salt +
+                                _nonce_key(sender_id, nonce, ts)).digest()
+        h1, h2 = struct.unpack('>QQ', digest[:16])
+        return h1, h2 | 1
+
+    def __call__(self, sender_id, nonce, timestamp):
+        """
+        Returns True if the nonce was (probably) seen before;
+        stores it otherwise.
+        """
+        ts = int(timestamp)
+        window = ts // self.timestamp_skew_in_seconds
+        h1, h2 = self._hashes(sender_id, nonce, ts)
+
+        with self._lock:
+            oldest, newest = self._rotate()
+            if not oldest <= window <= newest:
+                # This timestamp is out of range so the request
+                # will be rejected anyway.
+                return False
+            bloom = self._filters.get(window)
+            if bloom is None:
+                bloom = self._filters[window] = _BloomFilter(
+                    self.num_bits, self.num_hashes)
+            return bloom.add(h1, h2)
+
+    def _rotate(self):
+        # Drops filters of expired windows and returns the range of
+        # windows that can hold valid timestamps.
+        now = self.clock()
+        skew = self.timestamp_skew_in_seconds
+        oldest = (now - skew) // skew
+        newest = (now + skew) // skew
+        for window in [w for w in self._filters if w < oldest]:
+            del self._filters[window]
+            self.rotations += 1
+        return oldest, newest
+
+    def clear(self):
+        """Forgets all nonces."""
+        with self._lock:
+            self._filters.clear()
+
+    def stats(self):
+        """
+        Returns a dict of store statistics.
+
+        ``false_positive_rate`` is the current estimate for the fullest
+        filter.
+        """
+        with self._lock:
+            self._rotate()
+            filters = list(self._filters.values())
+        return {'capacity': self.capacity,
+                'error_rate': self.error_rate,
+                'filters': len(filters),
+                'num_bits': self.num_bits,
+                'num_hashes': self.num_hashes,
+                'memory_bytes': sum(len(f.bits) for f in filters),
+                'max_memory_bytes': 3 * ((self.num_bits + 7) // 8),
+                'count': sum(f.count for f in filters),
+                'false_positive_rate': max(
+                    [f.false_positive_rate() for f in filters] or [0.0]),
+                'rotations': self.rotations}
+
+
+class SharedMemoryNonceStore(object):
+    """
+    A ``seen_nonce`` store in memory shared by forked worker processes.
+
+    Nonces are kept in a fixed size hash table in an anonymous
+    shared :mod:`mmap`, so a nonce seen by one worker is seen by all of them.
+    Create the store in the parent process *before* workers are forked,
+    for example at import time of an app that gunicorn preloads with
+    ``--preload``. This is only supported on platforms with ``fork()``.
+
+    The table is split into ``stripes`` that each have their own
+    process-shared lock. Each slot holds a fingerprint of the
+    sender ID, nonce and timestamp plus the timestamp itself; a slot is
+    reused as soon as its timestamp is older than
+    ``timestamp_skew_in_seconds``.
+
+    If all the slots a nonce could go in are taken by valid nonces,
+    the store cannot remember it and reports it as seen, which rejects the
+    request with :class:`mohawk.exc.AlreadyProcessed`. This is counted as
+    an overflow in :meth:`stats`; add more ``slots`` if you see any.
+
+    :param slots=65536:
+        Number of nonces the table can hold. Each takes 24 bytes.
+    :type slots=65536: int
+
+    :param stripes=64: Number of independently locked parts of the table.
+    :type stripes=64: int
+
+    :param timestamp_skew_in_seconds=60:
+        Max seconds a timestamp may differ from the current time.
+    :type timestamp_skew_in_seconds=60: int
+
+    :param max_probes=16: Slots to try for each nonce.
+    :type max_probes=16: int
+
+    :param clock=utc_now: Callable returning the current UTC timestamp.
+    :type clock=utc_now: callable
+    """
+    _slot = struct.Struct('=16sq')
+    _counters = struct.Struct('=qq')
+
+    def __init__(self, slots=65536, stripes=64,
+                 timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 max_probes=16, clock=utc_now):
+        self.stripes = stripes
+        self.stripe_slots = max(1, slots // stripes)
+        self.slots = self.stripe_slots * stripes
+        self.max_probes = min(max_probes, self.stripe_slots)
+        self.timestamp_skew_in_seconds = timestamp_skew_in_seconds
+        self.clock = clock
+        self._stripe_size = (self._counters.size +
+                             self.stripe_slots * self._slot.size)
+        # Anonymous maps are shared with child processes after a fork.
+        self._map = mmap.mmap(-1, self._stripe_size * stripes)
+        self._locks = [multiprocessing.Lock() for i in range(stripes)]
+        self._salt = os.urandom(16)
+
+    def __call__(self, sender_id, nonce, timestamp):
+        """Returns True if the nonce was seen before; stores it otherwise."""
+        ts = int(timestamp)
+        now = self.clock()
+        cutoff = now - self.timestamp_skew_in_seconds
+        if not cutoff <= ts <= now + self.timestamp_skew_in_seconds:
+            # This timestamp is out of range so the request
+            # will be rejected anyway.
+            return False
+
+        fingerprint = hashlib.sha256(
+            self._salt + _nonce_key(sender_id, nonce, ts)).digest()[:16]
+        stripe, start = struct.unpack('>QQ', fingerprint)
+        stripe %= self.stripes
+        base = stripe * self._stripe_size
+        first_slot = base + self._counters.size
+        slot_size = self._slot.size
+        unpack_from = self._slot.unpack_from
+        mm = self._map
+
+        with self._locks[stripe]:
+            free = None
+            for i in range(self.max_probes):
+                offset = (first_slot +
+                          ((start + i) % self.stripe_slots) * slot_size)
+                slot_fingerprint, slot_ts = unpack_from(mm, offset)
+                if slot_ts >= cutoff:
+                    if slot_fingerprint == fingerprint:
+                        return True
+                elif free is None:
+                    free = offset
+                if slot_ts == 0:
+                    # Nothing was ever stored past an unused slot.
+                    break
+
+            inserts, overflows = self._counters.unpack_from(mm, base)
+            if free is None:
+                self._counters.pack_into(mm, base, inserts, overflows + 1)
+                log.warning('shared nonce table is full; '
+                            'rejecting nonce %s for %s', nonce, sender_id)
+                return True
+            self._slot.pack_into(mm, free, fingerprint, ts)
+            self._counters.pack_into(mm, base, inserts + 1, overflows)
+            return False
+
+    def clear(self):
+        """Forgets all nonces."""
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            self._map[:] = b'\x00' * len(self._map)
+        finally:
+            for lock in self._locks:
+                lock.release()
+
+    def stats(self):
+        """
+        Returns a dict of store statistics, counted across all processes.
+
+        This scans the whole table so avoid calling it on every request.
+        """
+        cutoff = self.clock() - self.timestamp_skew_in_seconds
+        size = inserts = overflows = 0
+        for stripe in range(self.stripes):
+            base = stripe * self._stripe_size
+            first_slot = base + self._counters.size
+            with self._locks[stripe]:
+                stripe_inserts, stripe_overflows = (
+                    self._counters.unpack_from(self._map, base))
+                for slot in range(self.stripe_slots):
+                    slot_fingerprint, slot_ts = self._slot.unpack_from(
+                        self._map, first_slot + slot * self._slot.size)
+                    if slot_ts >= cutoff:
+                        size += 1
+            inserts += stripe_inserts
+            overflows += stripe_overflows
+        return {'size': size,
+                'slots': self.slots,
+                'memory_bytes': len(self._map),
+                'inserts': inserts,
+                'overflows': overflows}
+
+
+class SQLiteNonceStore(object):
+    """
+    A ``seen_nonce`` store that survives restarts by saving nonces
+    in an SQLite database.
+
+    Nonces are checked against an in-memory
+    :class:`mohawk.nonce.MemoryNonceStore` and new ones are written to the
+    database in batches of ``batch_size``. A background thread writes the
+    rest once ``flush_interval`` seconds have passed since the last write,
+    even if no more requests come in. Expired rows are pruned on each
+    write. On startup, the nonces in the database that are still valid are
+    loaded back into memory.
+
+    Nonces that were not written yet, for up to ``flush_interval`` seconds,
+    are lost if the process dies, so call :meth:`close` (or :meth:`flush`)
+    when shutting down. Use ``batch_size=1`` to write every nonce
+    immediately. A write that fails, for example because the database is
+    locked, is logged and retried with the next batch. Calling the store
+    after :meth:`close` raises ``ValueError``.
+
+    :param path: Path to the database file.
+    :type path: str
+
+    :param timestamp_skew_in_seconds=60:
+        Max seconds a timestamp may differ from the current time.
+    :type timestamp_skew_in_seconds=60: int
+
+    :param batch_size=100: Number of nonces to write at once.
+    :type batch_size=100: int
+
+    :param flush_interval=1.0: Max seconds to hold back a write.
+    :type flush_interval=1.0: float
+
+    :param clock=utc_now: Callable returning the current UTC timestamp.
+    :type clock=utc_now: callable
+    """
+
+    def __init__(self, path,
+                 timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 batch_size=100, flush_interval=1.0, clock=utc_now):
+        self.timestamp_skew_in_seconds = timestamp_skew_in_seconds
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+        #: Number of nonces written to the database.
+        self.writes = 0
+        #: Number of expired rows deleted from the database.
+        self.pruned = 0
+        self._front = MemoryNonceStore(
+            timestamp_skew_in_seconds=timestamp_skew_in_seconds, clock=clock)
+        self._pending = []
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+        self._db = sqlite3.connect(path, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS hawk_nonces ('
+                         'sender_id TEXT NOT NULL, '
+                         'nonce TEXT NOT NULL, '
+                         'ts INTEGER NOT NULL, '
+                         'PRIMARY KEY (sender_id, nonce, ts))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS hawk_nonces_ts '
+                         'ON hawk_nonces (ts)')
+        self._warm()
+
+        if batch_size > 1 and flush_interval > 0:
+            flusher = threading.Thread(
+                target=_flush_periodically,
+                args=(weakref.ref(self), self._closed, flush_interval),
+                name='mohawk-nonce-flush')
+            flusher.daemon = True
+            flusher.start()
+
+    def _warm(self):
+        cutoff = self.clock() - self.timestamp_skew_in_seconds
+        rows = self._db.execute('SELECT sender_id, nonce, ts '
+                                'FROM hawk_nonces WHERE ts >= ?', (cutoff,))
+        count = 0
+        for sender_id, nonce, ts in rows:
+            self._front(sender_id, nonce, ts)
+            count += 1
+        log.debug('loaded %d nonce(s) from the database', count)
+
+    def __call__(self, sender_id, nonce, timestamp):
+        """Returns True if the nonce was seen before; stores it otherwise."""
+        if self._closed.is_set():
+            raise ValueError('nonce store is closed')
+        if self._front(sender_id, nonce, timestamp):
+            return True
+        ts = int(timestamp)
+        if ts < self.clock() - self.timestamp_skew_in_seconds:
+            # The request will be rejected anyway.
+            return False
+
+        with self._lock:
+            if self._closed.is_set():
+                raise ValueError('nonce store is closed')
+            self._pending.append((sender_id, nonce, ts))
+            if (len(self._pending) >= self.batch_size or
+                    time.time() - self._last_flush >= self.flush_interval):
+                try:
+                    self._flush()
+                except sqlite3.Error:
+                    # The nonce is already in memory and stays pending, so
+                    # the next write tries again.
+                    etype, val, tb = sys.exc_info()
+                    log.warning('could not write nonces to the database: %s',
+                                val)
+        return False
+
+    def flush(self):
+        """Writes all pending nonces to the database."""
+        with self._lock:
+            if self._closed.is_set():
+                raise ValueError('nonce store is closed')
+            self._flush()
+
+    def _flush_if_due(self):
+        with self._lock:
+            if (self._pending and not self._closed.is_set() and
+                    time.time() - self._last_flush >= self.flush_interval):
+                self._flush()
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        self._last_flush = time.time()
+        cutoff = self.clock() - self.timestamp_skew_in_seconds
+        db = self._db
+        try:
+            db.execute('BEGIN')
+        except Exception:
+            self._pending = pending + self._pending
+            raise
+        try:
+            db.executemany('INSERT OR IGNORE INTO hawk_nonces '
+                           '(sender_id, nonce, ts) VALUES (?, ?, ?)',
+                           pending)
+            pruned = db.execute('DELETE FROM hawk_nonces WHERE ts < ?',
+                                (cutoff,)).rowcount
+            db.execute('COMMIT')
+        except Exception:
+            self._pending = pending + self._pending
+            db.execute('ROLLBACK')
+            raise
+        self.writes += len(pending)
+        self.pruned += pruned
+
+    def close(self):
+        """Writes all pending nonces and closes the database."""
+        with self._lock:
+            if self._closed.is_set():
+                return
+            self._closed.set()
+            try:
+                if self._pending:
+                    self._flush()
+            finally:
+                self._db.close()
+
+    def stats(self):
+        """Returns a dict of store statistics."""
+        with self._lock:
+            stats = self._front.stats()
+            stats.update({'pending': len(self._pending),
+                          'writes': self.writes,
+                          'pruned': self.pruned})
+        return stats
+
+
+def _flush_periodically(store_ref, closed, interval):
+    # Writes the pending nonces of an idle SQLiteNonceStore. This only holds
+    # a weak reference so that the store can still be garbage collected.
+    while not closed.wait(interval):
+        store = store_ref()
+        if store is None:
+            return
+        try:
+            store._flush_if_due()
+        except sqlite3.Error:
+            etype, val, tb = sys.exc_info()
+            log.warning('could not write nonces to the database: %s', val)
+        del store
+
+
+class RedisError(Exception):
+    """An error reply from a Redis server."""
+
+
+def _redis_command(*args):
+    # Encodes a command in the Redis protocol (RESP).
+    parts = [b'*' + str(len(args)).encode('ascii') + b'\r\n']
+    for arg in args:
+        if not isinstance(arg, six.binary_type):
+            arg = six.text_type(arg).encode('utf8')
+        parts.append(b'$' + str(len(arg)).encode('ascii') + b'\r\n' +
+                     arg + b'\r\n')
+    return b''.join(parts)
+
+
+def _redis_reply(reader):
+    # Reads a single reply in the Redis protocol (RESP).
+    line = reader.readline()
+    if not line.endswith(b'\r\n'):
+        raise socket.error('connection closed by Redis server')
+    kind, value = line[:1], line[1:-2]
+    if kind == b'+':
+        return value
+    if kind == b'-':
+        raise RedisError(value.decode('utf8', 'replace'))
+    if kind == b':':
+        return int(value)
+    if kind == b'$':
+        size = int(value)
+        if size < 0:
+            return None
+        return reader.read(size + 2)[:-2]
+    if kind == b'*':
+        size = int(value)
+        if size < 0:
+            return None
+        return [_redis_reply(reader) for i in range(size)]
+    raise RedisError('unexpected reply: {line!r}'.format(line=line))
+
+
+class _PendingNonce(object):
+
+    def __init__(self, command):
+        self.command = command
+        self.done = threading.Event()
+        self.seen = None
+
+
+class RedisNonceStore(object):
+    """
+    A ``seen_nonce`` store shared by many hosts through Redis
+    (or any server speaking the Redis protocol).
+
+    Each nonce is stored with ``SET key 1 NX EX ttl`` so the check and the
+    write are one atomic operation that expires when the timestamp does.
+    Checks from concurrent threads are sent together: while one round-trip
+    is in flight, new checks queue up and go out in the next pipeline.
+
+    If the server can't be reached, checks go to the ``fallback`` store,
+    a :class:`mohawk.nonce.MemoryNonceStore` by default, and the server is
+    retried after ``retry_interval`` seconds. Nonces seen during an outage
+    are only known to the process that saw them. To reject requests during
+    an outage instead, pass ``fallback=lambda *args: True``.
+
+    :param host='localhost': Server host name.
+    :type host='localhost': str
+
+    :param port=6379: Server port.
+    :type port=6379: int
+
+    :param db=0: Database number to select.
+    :type db=0: int
+
+    :param password=None: Password to authenticate with.
+    :type password=None: str
+
+    :param key_prefix='hawk-nonce:': Prefix of all keys.
+    :type key_prefix='hawk-nonce:': str
+
+    :param timestamp_skew_in_seconds=60:
+        Max seconds a timestamp may differ from the current time.
+    :type timestamp_skew_in_seconds=60: int
+
+    :param socket_timeout=1.0:
+        Seconds to wait for the server. A check waiting for the round-trip
+        of another thread falls back after three times as long.
+    :type socket_timeout=1.0: float
+
+    :param fallback=None: ``seen_nonce`` callable to use during outages.
+    :type fallback=None: callable
+
+    :param retry_interval=5.0: Seconds to wait before reconnecting.
+    :type retry_interval=5.0: float
+
+    :param clock=utc_now: Callable returning the current UTC timestamp.
+    :type clock=utc_now: callable
+    """
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None,
+                 key_prefix='hawk-nonce:',
+                 timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 socket_timeout=1.0, fallback=None, retry_interval=5.0,
+                 clock=utc_now):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.key_prefix = key_prefix.encode('utf8')
+        self.timestamp_skew_in_seconds = timestamp_skew_in_seconds
+        self.socket_timeout = socket_timeout
+        if fallback is None:
+            fallback = MemoryNonceStore(
+                timestamp_skew_in_seconds=timestamp_skew_in_seconds,
+                clock=clock)
+        self.fallback = fallback
+        self.retry_interval = retry_interval
+        self.clock = clock
+        #: Number of pipelines sent to the server.
+        self.round_trips = 0
+        #: Number of checks sent to the server.
+        self.commands = 0
+        #: Number of checks that went to the fallback store.
+        self.fallbacks = 0
+        self._sock = None
+        self._reader = None
+        self._down_until = 0
+        self._queue = []
+        self._flushing = False
+        self._lock = threading.Lock()
+        # Only the thread flushing the queue uses the connection.
+        self._io_lock = threading.Lock()
+
+    def __call__(self, sender_id, nonce, timestamp):
+        """Returns True if the nonce was seen before; stores it otherwise."""
+        ts = int(timestamp)
+        now = self.clock()
+        skew = self.timestamp_skew_in_seconds
+        if not now - skew <= ts <= now + skew:
+            # This timestamp is out of range so the request
+            # will be rejected anyway.
+            return False
+        if time.time() < self._down_until:
+            return self._fall_back(sender_id, nonce, timestamp)
+
+        pending = _PendingNonce(_redis_command(
+            'SET', self.key_prefix + _nonce_key(sender_id, nonce, ts), '1',
+            'NX', 'EX', ts + skew - now + 1))
+        with self._lock:
+            self._queue.append(pending)
+            leader = not self._flushing
+            self._flushing = True
+
+        if leader:
+            self._flush_queue()
+        elif not pending.done.wait(self._wait_timeout()):
+            log.warning('gave up waiting for the Redis nonce store at %s:%s',
+                        self.address[0], self.address[1])
+
+        if pending.seen is None:
+            return self._fall_back(sender_id, nonce, timestamp)
+        return pending.seen
+
+    def _wait_timeout(self):
+        # How long to wait for another thread's round-trip: connecting,
+        # sending and reading may each take up to socket_timeout.
+        if self.socket_timeout is None:
+            return None
+        return 3 * self.socket_timeout
+
+    def _fall_back(self, sender_id, nonce, timestamp):
+        self.fallbacks += 1
+        return self.fallback(sender_id, nonce, timestamp)
+
+    def _flush_queue(self):
+        # Sends everything in the queue, in as many round-trips as it takes
+        # for the queue to stay empty.
+        try:
+            self._flush_batches()
+        except Exception:
+            # Don't leave the checks queued by other threads waiting
+            # for a flush that won't happen; they use the fallback store.
+            with self._lock:
+                self._flushing = False
+                stranded, self._queue = self._queue, []
+            for pending in stranded:
+                pending.done.set()
+            with self._io_lock:
+                self._disconnect()
+            raise
+
+    def _flush_batches(self):
+        while True:
+            with self._lock:
+                batch, self._queue = self._queue, []
+                if not batch:
+                    self._flushing = False
+                    return
+            try:
+                with self._io_lock:
+                    replies = self._pipeline([p.command for p in batch])
+                for pending, reply in zip(batch, replies):
+                    pending.seen = reply is None
+            except (socket.error, RedisError, ValueError):
+                etype, val, tb = sys.exc_info()
+                log.warning('Redis nonce store at %s:%s failed; '
+                            'using the fallback store for %ss: %s',
+                            self.address[0], self.address[1],
+                            self.retry_interval, val)
+                self._disconnect()
+                self._down_until = time.time() + self.retry_interval
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+    def _pipeline(self, commands):
+        if self._sock is None:
+            self._connect()
+        self._sock.sendall(b''.join(commands))
+        self.round_trips += 1
+        self.commands += len(commands)
+        return [_redis_reply(self._reader) for command in commands]
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, self.socket_timeout)
+        self._sock = sock
+        self._reader = sock.makefile('rb')
+        setup = []
+        if self.password:
+            setup.append(_redis_command('AUTH', self.password))
+        if self.db:
+            setup.append(_redis_command('SELECT', self.db))
+        if setup:
+            sock.sendall(b''.join(setup))
+            for command in setup:
+                _redis_reply(self._reader)
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except socket.error:
+                pass
+        self._sock = self._reader = None
+
+    def close(self):
+        """Closes the connection to the server."""
+        with self._io_lock:
+            self._disconnect()
+
+    def stats(self):
+        """Returns a dict of store statistics."""
+        return {'round_trips': self.round_trips,
+                'commands': self.commands,
+                'fallbacks': self.fallbacks,
+                'connected': self._sock is not None}
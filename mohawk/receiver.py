@@ -1,16 +1,22 @@
+from collections import namedtuple, OrderedDict
 import logging
 import sys
 
 from .base import (default_ts_skew_in_seconds,
                    HawkAuthority,
+                   ParsedURL,
                    Resource,
                    EmptyValue)
-from .exc import CredentialsLookupError, MissingAuthorization
+from .exc import (BadHeaderValue,
+                  CredentialsLookupError,
+                  HawkFail,
+                  MissingAuthorization)
 from .util import (calculate_mac,
+                   compile_credentials,
                    parse_authorization_header,
                    validate_credentials)
 
-__all__ = ['Receiver']
+__all__ = ['Receiver', 'verify_batch']
 log = logging.getLogger(__name__)
 
 
@@ -23,6 +29,8 @@ class Receiver(HawkAuthority):
         The credentials dict must have the keys:
         ``id``, ``key``, and ``algorithm``.
         See :ref:`receiving-request` for an example.
+        The callable can also return a :class:`mohawk.util.Credentials`
+        object to avoid preparing the key on every request.
     :type credentials_map: callable
 
     :param request_header:
@@ -36,8 +44,9 @@ class Receiver(HawkAuthority):
     :param method: Method of the request. E.G. POST, GET
     :type method: str
 
-<<<<<<< master
-    :param content=EmptyValue: Byte string of request body.
+    :param content=EmptyValue:
+        Byte string of request body or a
+        :class:`mohawk.util.PayloadHasher` that hashed the body.
     :type content=EmptyValue: str
 
     :param content_type=EmptyValue: content-type header value for request.
@@ -46,19 +55,6 @@ class Receiver(HawkAuthority):
     :param accept_untrusted_content=False:
         When True, allow requests that do not hash their content.
         Read :ref:`skipping-content-checks` to learn more.
-=======
-    :param content=None: Byte string of request body.
-    :type content=None: str
-
-    :param content_type=None: content-type header value for request.
-    :type content_type=None: str
-
-    :param accept_untrusted_content=False:
-        When True, allow requests that do not hash their content or
-        allow None type ``content`` and ``content_type``
-        arguments. Read :ref:`skipping-content-checks`
-        to learn more.
->>>>>>> 14f3100
     :type accept_untrusted_content=False: bool
 
     :param localtime_offset_in_seconds=0:
@@ -72,8 +68,14 @@ class Receiver(HawkAuthority):
 
     .. _`Hawk`: https://github.com/hueniverse/hawk
     """
-    #: Value suitable for a ``Server-Authorization`` header.
-    response_header = None
+    __slots__ = {
+        'response_header':
+            'Value suitable for a ``Server-Authorization`` header.',
+        'credentials_map': None,
+        'seen_nonce': None,
+        'parsed_header': None,
+        'resource': None,
+    }
 
     def __init__(self,
                  credentials_map,
@@ -88,38 +90,52 @@ class Receiver(HawkAuthority):
                  timestamp_skew_in_seconds=default_ts_skew_in_seconds,
                  **auth_kw):
 
-        self.response_header = None  # make into property that can raise exc?
-        self.credentials_map = credentials_map
-        self.seen_nonce = seen_nonce
+        self._setup(credentials_map, seen_nonce)
 
-        log.debug('accepting request {header}'.format(header=request_header))
+        log.debug('accepting request %s', request_header)
 
         if not request_header:
             raise MissingAuthorization()
 
         parsed_header = parse_authorization_header(request_header)
+        credentials = _lookup_credentials(self.credentials_map,
+                                          parsed_header['id'])
+
+        self._accept(parsed_header, credentials, url, method,
+                     content=content,
+                     content_type=content_type,
+                     localtime_offset_in_seconds=localtime_offset_in_seconds,
+                     accept_untrusted_content=accept_untrusted_content,
+                     timestamp_skew_in_seconds=timestamp_skew_in_seconds,
+                     **auth_kw)
+
+    @classmethod
+    def _from_parsed_header(cls, credentials_map, parsed_header, credentials,
+                            url, method, seen_nonce=None, **kw):
+        # Accepts a request whose header was already parsed and whose
+        # credentials were already looked up.
+        receiver = cls.__new__(cls)
+        receiver._setup(credentials_map, seen_nonce)
+        receiver._accept(parsed_header, credentials, url, method, **kw)
+        return receiver
+
+    def _setup(self, credentials_map, seen_nonce):
+        self.response_header = None  # make into property that can raise exc?
+        self.credentials_map = credentials_map
+        self.seen_nonce = seen_nonce
 
-        try:
-            credentials = self.credentials_map(parsed_header['id'])
-        except LookupError:
-            etype, val, tb = sys.exc_info()
-            log.debug('Catching {etype}: {val}'.format(etype=etype, val=val))
-            raise CredentialsLookupError(
-                'Could not find credentials for ID {0}'
-                .format(parsed_header['id']))
-        validate_credentials(credentials)
-
-        resource = Resource(url=url,
-                            method=method,
-                            ext=parsed_header.get('ext', None),
-                            app=parsed_header.get('app', None),
-                            dlg=parsed_header.get('dlg', None),
-                            credentials=credentials,
-                            nonce=parsed_header['nonce'],
-                            seen_nonce=self.seen_nonce,
-                            content=content,
-                            timestamp=parsed_header['ts'],
-                            content_type=content_type)
+    def _accept(self, parsed_header, credentials, url, method,
+                content=EmptyValue,
+                content_type=EmptyValue,
+                localtime_offset_in_seconds=0,
+                accept_untrusted_content=False,
+                timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                mac_credentials=None,
+                **auth_kw):
+
+        resource = self._request_resource(parsed_header, credentials,
+                                          url, method, content, content_type)
+        resource._mac_credentials = mac_credentials
 
         self._authorize(
             'header', parsed_header, resource,
@@ -134,19 +150,32 @@ class Receiver(HawkAuthority):
         self.parsed_header = parsed_header
         self.resource = resource
 
+    def _request_resource(self, parsed_header, credentials, url, method,
+                          content, content_type):
+        return Resource(credentials, url, method, content, content_type,
+                        True,
+                        parsed_header.get('ext', None),
+                        parsed_header.get('app', None),
+                        parsed_header.get('dlg', None),
+                        parsed_header['ts'],
+                        parsed_header['nonce'],
+                        self.seen_nonce)
+
     def respond(self,
                 content=EmptyValue,
                 content_type=EmptyValue,
                 always_hash_content=True,
-                ext=None):
+                ext=None,
+                as_bytes=False):
         """
         Respond to the request.
 
         This generates the :attr:`mohawk.Receiver.response_header`
         attribute.
 
-<<<<<<< master
-        :param content=EmptyValue: Byte string of response body that will be sent.
+        :param content=EmptyValue:
+            Byte string of response body that will be sent or a
+            :class:`mohawk.util.PayloadHasher` that hashed it.
         :type content=EmptyValue: str
 
         :param content_type=EmptyValue: content-type header value for response.
@@ -154,16 +183,6 @@ class Receiver(HawkAuthority):
 
         :param always_hash_content=True:
             When True, ``content`` and ``content_type`` must be provided.
-=======
-        :param content=None: Byte string of response body that will be sent.
-        :type content=None: str
-
-        :param content_type=None: content-type header value for response.
-        :type content_type=None: str
-
-        :param always_hash_content=True:
-            When True, ``content`` and ``content_type`` cannot be None.
->>>>>>> 14f3100
             Read :ref:`skipping-content-checks` to learn more.
         :type always_hash_content=True: bool
 
@@ -172,25 +191,175 @@ class Receiver(HawkAuthority):
             signed so that the sender can trust it.
         :type ext=None: str
 
+        :param as_bytes=False:
+            When True, the header is returned and stored as a byte string,
+            for servers that send byte string headers.
+        :type as_bytes=False: bool
+
         .. _`Hawk`: https://github.com/hueniverse/hawk
         """
 
         log.debug('generating response header')
 
-        resource = Resource(url=self.resource.url,
-                            credentials=self.resource.credentials,
-                            ext=ext,
-                            app=self.parsed_header.get('app', None),
-                            dlg=self.parsed_header.get('dlg', None),
-                            method=self.resource.method,
-                            content=content,
-                            content_type=content_type,
-                            always_hash_content=always_hash_content,
-                            nonce=self.parsed_header['nonce'],
-                            timestamp=self.parsed_header['ts'])
-
-        mac = calculate_mac('response', resource, resource.gen_content_hash())
+        resource = self._response_resource(content, content_type,
+                                           always_hash_content, ext)
+        return self._sign_response(resource, resource.gen_content_hash(),
+                                   as_bytes)
+
+    def _response_resource(self, content, content_type, always_hash_content,
+                           ext):
+        request = self.resource
+        resource = Resource(request.credentials,
+                            ParsedURL(request.name, request.host,
+                                      request.port),
+                            request.method,
+                            content,
+                            content_type,
+                            always_hash_content,
+                            ext,
+                            self.parsed_header.get('app', None),
+                            self.parsed_header.get('dlg', None),
+                            self.parsed_header['ts'],
+                            self.parsed_header['nonce'])
+        resource._mac_credentials = request._mac_credentials
+        return resource
+
+    def _sign_response(self, resource, content_hash, as_bytes=False):
+        mac = calculate_mac('response', resource, content_hash)
 
         self.response_header = self._make_header(resource, mac,
-                                                 additional_keys=['ext'])
+                                                 additional_keys=['ext'],
+                                                 as_bytes=as_bytes)
         return self.response_header
+
+
+class _StreamedContent(object):
+    # Lets a receiver accept a request before reading its body.
+    # The request must pass a PayloadHasher as content; once it has
+    # hashed the whole body, check_content() verifies the content hash.
+    # Subclasses need an _accept_untrusted_content slot.
+    __slots__ = ()
+
+    def _should_check_hash(self, parsed_header, resource,
+                           accept_untrusted_content):
+        self._accept_untrusted_content = accept_untrusted_content
+        return False
+
+    def check_content(self):
+        resource = self.resource
+        if super(_StreamedContent, self)._should_check_hash(
+                self.parsed_header, resource,
+                self._accept_untrusted_content):
+            self._check_content_hash(self.parsed_header, resource,
+                                     resource.gen_content_digest())
+
+
+def _lookup_credentials(credentials_map, sender_id):
+    try:
+        credentials = credentials_map(sender_id)
+    except LookupError:
+        etype, val, tb = sys.exc_info()
+        log.debug('Catching %s: %s', etype, val)
+        raise CredentialsLookupError(
+            'Could not find credentials for ID {0}'.format(sender_id))
+    validate_credentials(credentials)
+    return credentials
+
+
+#: The outcome of verifying one request with :func:`mohawk.verify_batch`.
+#: ``receiver`` is the :class:`mohawk.Receiver` for a valid request and
+#: ``error`` is the exception that rejected an invalid one.
+BatchResult = namedtuple('BatchResult', 'receiver error')
+
+
+# Keys a request header needs to be verified at all.
+_required_header_keys = ('id', 'ts', 'nonce', 'mac')
+
+
+def _parse_request_header(request_header):
+    # Parses a request header, making sure that it can be verified.
+    try:
+        parsed_header = parse_authorization_header(request_header)
+    except ValueError:
+        raise BadHeaderValue('header is not of the form: Hawk key="value", ...')
+    missing = [key for key in _required_header_keys
+               if parsed_header.get(key) is None]
+    if missing:
+        raise BadHeaderValue(
+            'header is missing {keys}'.format(keys=', '.join(missing)))
+    return parsed_header
+
+
+def verify_batch(credentials_map, requests, seen_nonce=None, **kw):
+    """
+    Verifies many requests at once.
+
+    Requests are grouped by their Hawk ID so that credentials are looked up
+    and their key is prepared only once per ID. Nothing is raised for a
+    rejected request, nor for an error while verifying it, such as one
+    raised by ``credentials_map`` or ``seen_nonce``; instead, a
+    :class:`mohawk.receiver.BatchResult` is returned for each request in
+    the order they were given. The credentials of each receiver are the
+    ones ``credentials_map`` returned.
+
+    :param credentials_map:
+        Callable to look up the credentials dict by sender ID,
+        just like for :class:`mohawk.Receiver`.
+    :type credentials_map: callable
+
+    :param requests:
+        An iterable of ``(request_header, url, method, content,
+        content_type)`` tuples.
+
+    :param seen_nonce=None:
+        A callable that returns True if a nonce has been seen.
+        See :ref:`nonce` for details.
+    :type seen_nonce=None: callable
+
+    Any other keyword arguments, such as ``timestamp_skew_in_seconds``,
+    are passed on as if creating a :class:`mohawk.Receiver`.
+    """
+    results = []
+    by_id = OrderedDict()
+
+    for index, (request_header, url, method, content,
+                content_type) in enumerate(requests):
+        results.append(None)
+        if not request_header:
+            results[index] = BatchResult(None, MissingAuthorization())
+            continue
+        try:
+            parsed_header = _parse_request_header(request_header)
+        except HawkFail:
+            etype, exc, tb = sys.exc_info()
+            results[index] = BatchResult(None, exc)
+            continue
+        by_id.setdefault(parsed_header['id'], []).append(
+            (index, parsed_header, url, method, content, content_type))
+
+    for sender_id, group in by_id.items():
+        try:
+            credentials = _lookup_credentials(credentials_map, sender_id)
+            mac_credentials = compile_credentials(credentials)
+        except Exception:
+            etype, exc, tb = sys.exc_info()
+            for item in group:
+                results[item[0]] = BatchResult(None, exc)
+            continue
+
+        for index, parsed_header, url, method, content, content_type in group:
+            try:
+                receiver = Receiver._from_parsed_header(
+                    credentials_map, parsed_header, credentials, url, method,
+                    seen_nonce=seen_nonce, content=content,
+                    content_type=content_type,
+                    mac_credentials=mac_credentials, **kw)
+            except Exception:
+                etype, exc, tb = sys.exc_info()
+                log.debug('rejecting request %d of batch: %s: %s',
+                          index, etype.__name__, exc)
+                results[index] = BatchResult(None, exc)
+            else:
+                results[index] = BatchResult(receiver, None)
+
+    return results
@@ -1,14 +1,24 @@
+from base64 import b64encode
 import logging
 
+import six
+
 from .base import (default_ts_skew_in_seconds,
                    HawkAuthority,
+                   ParsedURL,
                    Resource,
-                   EmptyValue)
+                   EmptyValue,
+                   split_url)
 from .util import (calculate_mac,
+                   compile_credentials,
+                   HAWK_VER,
+                   normalize_header_attr,
                    parse_authorization_header,
-                   validate_credentials)
+                   prepare_header_val,
+                   validate_credentials,
+                   validate_header_attr)
 
-__all__ = ['Sender']
+__all__ = ['EndpointSigner', 'Sender']
 log = logging.getLogger(__name__)
 
 
@@ -18,6 +28,8 @@ class Sender(HawkAuthority):
 
     :param credentials: Dict of credentials with keys ``id``, ``key``,
                         and ``algorithm``. See :ref:`usage` for an example.
+                        This can also be a
+                        :class:`mohawk.util.Credentials` object.
     :type credentials: dict
 
     :param url: Absolute URL of the request.
@@ -26,8 +38,9 @@ class Sender(HawkAuthority):
     :param method: Method of the request. E.G. POST, GET
     :type method: str
 
-<<<<<<< master
-    :param content=EmptyValue: Byte string of request body or a file-like object.
+    :param content=EmptyValue:
+        Byte string of request body, a file-like object or a
+        :class:`mohawk.util.PayloadHasher` that hashed the body.
     :type content=EmptyValue: str or file-like object
 
     :param content_type=EmptyValue: content-type header value for request.
@@ -35,16 +48,6 @@ class Sender(HawkAuthority):
 
     :param always_hash_content=True:
         When True, ``content`` and ``content_type`` must be provided.
-=======
-    :param content=None: Byte string of request body.
-    :type content=None: str
-
-    :param content_type=None: content-type header value for request.
-    :type content_type=None: str
-
-    :param always_hash_content=True:
-        When True, ``content`` and ``content_type`` cannot be None.
->>>>>>> 14f3100
         Read :ref:`skipping-content-checks` to learn more.
     :type always_hash_content=True: bool
 
@@ -74,10 +77,20 @@ class Sender(HawkAuthority):
         See :ref:`nonce` for details.
     :type seen_nonce=None: callable
 
+    :param clock_offsets=None:
+        A :class:`mohawk.clock.ClockOffsetTracker`. When given, the request
+        is timestamped with the receiver's time it learned.
+    :type clock_offsets=None: :class:`mohawk.clock.ClockOffsetTracker`
+
     .. _`Hawk`: https://github.com/hueniverse/hawk
     """
-    #: Value suitable for an ``Authorization`` header.
-    request_header = None
+    __slots__ = {
+        'request_header': 'Value suitable for an ``Authorization`` header.',
+        'credentials': None,
+        'seen_nonce': None,
+        'req_resource': None,
+        '_clock_offset': None,
+    }
 
     def __init__(self, credentials,
                  url,
@@ -90,28 +103,38 @@ class Sender(HawkAuthority):
                  app=None,
                  dlg=None,
                  seen_nonce=None,
+                 clock_offsets=None,
                  # For easier testing:
                  _timestamp=None):
 
+        self._setup(credentials, url, method, content, content_type,
+                    always_hash_content, nonce, ext, app, dlg, seen_nonce,
+                    _timestamp, clock_offsets)
+        self._sign_request(self.req_resource.gen_content_hash())
+
+    def _setup(self, credentials, url, method, content, content_type,
+               always_hash_content, nonce, ext, app, dlg, seen_nonce,
+               timestamp, clock_offsets=None):
         self.reconfigure(credentials)
+        self._clock_offset = 0
+        if timestamp is None and clock_offsets is not None:
+            self._clock_offset = clock_offsets.offset(self.credentials)
+            timestamp = clock_offsets.clock() + self._clock_offset
         self.request_header = None
         self.seen_nonce = seen_nonce
+        if nonce is not None:
+            validate_header_attr(normalize_header_attr(nonce), name='nonce')
+        if timestamp is not None:
+            validate_header_attr(str(normalize_header_attr(timestamp)),
+                                 name='ts')
 
         log.debug('generating request header')
-        self.req_resource = Resource(url=url,
-                                     credentials=self.credentials,
-                                     ext=ext,
-                                     app=app,
-                                     dlg=dlg,
-                                     nonce=nonce,
-                                     method=method,
-                                     content=content,
-                                     always_hash_content=always_hash_content,
-                                     timestamp=_timestamp,
-                                     content_type=content_type)
-
-        mac = calculate_mac('header', self.req_resource,
-                            self.req_resource.gen_content_hash())
+        self.req_resource = Resource(self.credentials, url, method, content,
+                                     content_type, always_hash_content,
+                                     ext, app, dlg, timestamp, nonce)
+
+    def _sign_request(self, content_hash):
+        mac = calculate_mac('header', self.req_resource, content_hash)
         self.request_header = self._make_header(self.req_resource, mac)
 
     def accept_response(self,
@@ -130,8 +153,9 @@ class Sender(HawkAuthority):
             such as one created by :class:`mohawk.Receiver`.
         :type response_header: str
 
-<<<<<<< master
-        :param content=EmptyValue: Byte string of the response body received.
+        :param content=EmptyValue:
+            Byte string of the response body received or a
+            :class:`mohawk.util.PayloadHasher` that hashed it.
         :type content=EmptyValue: str
 
         :param content_type=EmptyValue:
@@ -141,24 +165,12 @@ class Sender(HawkAuthority):
         :param accept_untrusted_content=False:
             When True, allow responses that do not hash their content.
             Read :ref:`skipping-content-checks` to learn more.
-=======
-        :param content=None: Byte string of the response body received.
-        :type content=None: str
-
-        :param content_type=None:
-            Content-Type header value of the response received.
-        :type content_type=None: str
-
-        :param accept_untrusted_content=False:
-            When True, allow responses that do not hash their content or
-            allow None type ``content`` and ``content_type``
-            arguments. Read :ref:`skipping-content-checks`
-            to learn more.
->>>>>>> 14f3100
         :type accept_untrusted_content=False: bool
 
         :param localtime_offset_in_seconds=0:
             Seconds to add to local time in case it's out of sync.
+            When 0, the offset the request was signed with by
+            ``clock_offsets`` is used.
         :type localtime_offset_in_seconds=0: float
 
         :param timestamp_skew_in_seconds=60:
@@ -168,25 +180,13 @@ class Sender(HawkAuthority):
 
         .. _`Hawk`: https://github.com/hueniverse/hawk
         """
-        log.debug('accepting response {header}'
-                  .format(header=response_header))
+        log.debug('accepting response %s', response_header)
+        if not localtime_offset_in_seconds:
+            localtime_offset_in_seconds = self._clock_offset
 
         parsed_header = parse_authorization_header(response_header)
-
-        resource = Resource(ext=parsed_header.get('ext', None),
-                            content=content,
-                            content_type=content_type,
-                            # The following response attributes are
-                            # in reference to the original request,
-                            # not to the reponse header:
-                            timestamp=self.req_resource.timestamp,
-                            nonce=self.req_resource.nonce,
-                            url=self.req_resource.url,
-                            method=self.req_resource.method,
-                            app=self.req_resource.app,
-                            dlg=self.req_resource.dlg,
-                            credentials=self.credentials,
-                            seen_nonce=self.seen_nonce)
+        resource = self._response_resource(parsed_header, content,
+                                           content_type)
 
         self._authorize(
             'response', parsed_header, resource,
@@ -200,6 +200,170 @@ class Sender(HawkAuthority):
             accept_untrusted_content=accept_untrusted_content,
             **auth_kw)
 
+    def _response_resource(self, parsed_header, content, content_type):
+        request = self.req_resource
+        # The response attributes other than ext are in reference
+        # to the original request, not to the response header.
+        return Resource(self.credentials,
+                        ParsedURL(request.name, request.host, request.port),
+                        request.method,
+                        content,
+                        content_type,
+                        True,
+                        parsed_header.get('ext', None),
+                        request.app,
+                        request.dlg,
+                        request.timestamp,
+                        request.nonce,
+                        self.seen_nonce)
+
     def reconfigure(self, credentials):
         validate_credentials(credentials)
         self.credentials = credentials
+
+
+def _to_bytes(val):
+    if isinstance(val, six.binary_type):
+        return val
+    return val.encode('utf8')
+
+
+class EndpointSigner(object):
+    """
+    Signs many requests to the same endpoint.
+
+    This is faster than creating a :class:`mohawk.Sender` for each
+    request because the method, resource name, host and port of the
+    normalized string are encoded only once and each request only
+    adds the parts that change to a copy of a prepared HMAC::
+
+        signer = EndpointSigner(credentials, url, 'POST',
+                                content_type='application/json')
+        sender = signer.sign(content=body)
+        request_header = sender.request_header
+
+    :param credentials: Dict of credentials with keys ``id``, ``key``,
+                        and ``algorithm``, or a
+                        :class:`mohawk.util.Credentials` object.
+    :type credentials: dict
+
+    :param url:
+        Absolute URL of the endpoint or its
+        :data:`mohawk.base.ParsedURL`.
+    :type url: str
+
+    :param method: Method of the requests. E.G. POST, GET
+    :type method: str
+
+    :param content_type=EmptyValue:
+        Default content-type header value of the requests.
+    :type content_type=EmptyValue: str
+
+    The ``always_hash_content``, ``ext``, ``app``, ``dlg`` and
+    ``clock_offsets`` arguments are used like the ones of
+    :class:`mohawk.Sender` for every request.
+    """
+
+    def __init__(self, credentials,
+                 url,
+                 method,
+                 content_type=EmptyValue,
+                 always_hash_content=True,
+                 ext=None,
+                 app=None,
+                 dlg=None,
+                 clock_offsets=None):
+        self.credentials = credentials
+        if not isinstance(url, ParsedURL):
+            url = split_url(url)
+        self.url = url
+        self.method = method.upper()
+        self.content_type = content_type
+        self.always_hash_content = always_hash_content
+        self.ext = ext
+        self.app = app
+        self.dlg = dlg
+        self.clock_offsets = clock_offsets
+
+        self._hmac = compile_credentials(credentials)._hmac.copy()
+        self._hmac.update(_to_bytes('hawk.{ver}.header\n'.format(ver=HAWK_VER)))
+        self._static = _to_bytes(u'\n'.join([
+            self.method, url.name, url.host, url.port, '']))
+        self._tail = self._encode_tail(ext)
+
+    def _encode_tail(self, ext):
+        # Everything after the content hash.
+        tail = [prepare_header_val(ext or '')]
+        if self.app:
+            tail.append(prepare_header_val(self.app))
+            tail.append(prepare_header_val(self.dlg or ''))
+        tail.append('')
+        return _to_bytes(u'\n'.join(tail))
+
+    def sign(self,
+             content=EmptyValue,
+             content_type=None,
+             nonce=None,
+             ext=None,
+             seen_nonce=None,
+             # For easier testing:
+             _timestamp=None):
+        """
+        Signs a request and returns its :class:`mohawk.Sender`.
+
+        Use :attr:`mohawk.Sender.request_header` of the returned object as
+        the ``Authorization`` header and call
+        :meth:`mohawk.Sender.accept_response` on it to verify the response.
+
+        :param content=EmptyValue:
+            Byte string of request body, a file-like object or a
+            :class:`mohawk.util.PayloadHasher` that hashed the body.
+        :type content=EmptyValue: str or file-like object
+
+        :param content_type=None:
+            Content-type header value of this request,
+            if it differs from the one of the signer.
+        :type content_type=None: str
+
+        :param nonce=None:
+            A string that uniquely identifies this request.
+            If None, a nonce will be generated for you.
+        :type nonce=None: str
+
+        :param ext=None:
+            An external `Hawk`_ string for this request,
+            if it differs from the one of the signer.
+        :type ext=None: str
+
+        :param seen_nonce=None:
+            A callable that returns True if a nonce has been seen.
+            See :ref:`nonce` for details.
+        :type seen_nonce=None: callable
+
+        .. _`Hawk`: https://github.com/hueniverse/hawk
+        """
+        if content_type is None:
+            content_type = self.content_type
+        if ext is None:
+            ext = self.ext
+            tail = self._tail
+        else:
+            tail = self._encode_tail(ext)
+
+        sender = Sender.__new__(Sender)
+        sender._setup(self.credentials, self.url, self.method, content,
+                      content_type, self.always_hash_content, nonce, ext,
+                      self.app, self.dlg, seen_nonce, _timestamp,
+                      self.clock_offsets)
+        resource = sender.req_resource
+        content_hash = resource.gen_content_hash()
+
+        h = self._hmac.copy()
+        h.update(b'\n'.join([_to_bytes(resource.timestamp),
+                             _to_bytes(resource.nonce),
+                             self._static + _to_bytes(content_hash or b''),
+                             tail]))
+        # ext, app and dlg were validated when they were encoded.
+        sender.request_header = sender._make_header(
+            resource, b64encode(h.digest()), validated=('ext', 'app', 'dlg'))
+        return sender
@@ -1,14 +1,55 @@
+import gc
+import logging
+import os
+import shutil
+import socket
+import sqlite3
 import sys
+import tempfile
+import threading
 import warnings
-from unittest import TestCase
+from unittest import skipIf, TestCase
 from base64 import b64decode, urlsafe_b64encode
+import io
 
 import mock
 from nose.tools import eq_, raises
 import six
-
-from . import Receiver, Sender
-from .base import Resource, EmptyValue
+from six.moves import socketserver
+
+try:
+    import requests
+    from requests.adapters import BaseAdapter
+except ImportError:
+    requests = None
+    BaseAdapter = object
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+from . import EndpointSigner, Receiver, Sender, verify_batch
+from .auth import HttpxHawkAuth, RequestsHawkAuth
+from .base import (configure_url_cache,
+                   EmptyValue,
+                   ParsedURL,
+                   Resource,
+                   split_url,
+                   url_cache_stats)
+from .cache import CredentialsCache, LRUCache
+from .clock import ClockOffsetTracker
+from .nonce import (BloomNonceStore,
+                    MemoryNonceStore,
+                    RedisNonceStore,
+                    SharedMemoryNonceStore,
+                    SQLiteNonceStore,
+                    _redis_reply)
 from .exc import (AlreadyProcessed,
                   BadHeaderValue,
                   CredentialsLookupError,
@@ -22,10 +63,23 @@ from .exc import (AlreadyProcessed,
                   MissingContent)
 from .util import (parse_authorization_header,
                    utc_now,
+                   calculate_payload_digest,
                    calculate_payload_hash,
                    calculate_ts_mac,
+                   compile_credentials,
+                   Credentials,
+                   credentials_fingerprint,
+                   decode_digest,
+                   digest_matches,
+                   NonceSource,
+                   PayloadHasher,
+                   random_string,
+                   strings_match,
                    validate_credentials)
-from .bewit import (get_bewit,
+from .wsgi import environ_url, HashingInput, HawkMiddleware as WSGIMiddleware
+from .bewit import (BewitCache,
+                    get_bewit,
+                    get_bewits,
                     check_bewit,
                     strip_bewit,
                     parse_bewit)
@@ -89,6 +143,109 @@ class TestConfig(Base):
         validate_credentials(WeirdThing())
 
 
+class TestCredentials(Base):
+
+    def compiled(self):
+        return compile_credentials(self.credentials)
+
+    def test_mapping_access(self):
+        cr = self.compiled()
+        eq_(cr['id'], self.credentials['id'])
+        eq_(cr['key'], self.credentials['key'])
+        eq_(cr['algorithm'], self.credentials['algorithm'])
+        eq_(cr.get('nope', 'default'), 'default')
+        validate_credentials(cr)
+
+    @raises(KeyError)
+    def test_unknown_item(self):
+        self.compiled()['key_bytes']
+
+    @raises(AttributeError)
+    def test_immutable(self):
+        self.compiled().key = 'something else'
+
+    def test_compile_compiled(self):
+        cr = self.compiled()
+        assert compile_credentials(cr) is cr
+
+    @raises(InvalidCredentials)
+    def test_unknown_algorithm(self):
+        Credentials('some-id', 'some key', 'no-such-algo')
+
+    @raises(InvalidCredentials)
+    def test_compile_invalid_credentials(self):
+        c = self.credentials.copy()
+        del c['key']
+        compile_credentials(c)
+
+    def test_repr_hides_key(self):
+        assert self.credentials['key'] not in repr(self.compiled())
+
+    def test_binary_id(self):
+        eq_(Credentials(b'some-id', 'key', 'sha256').id, u'some-id')
+
+    def test_same_mac_as_dict(self):
+        url = 'https://site.com/foo?bar=1'
+        kw = dict(content='foo', content_type='text/plain',
+                  nonce='abc', _timestamp=1234)
+        sn1 = Sender(self.credentials, url, 'POST', **kw)
+        sn2 = Sender(self.compiled(), url, 'POST', **kw)
+        eq_(sn1.request_header, sn2.request_header)
+
+    def test_sender_keeps_credentials_dict(self):
+        credentials = dict(self.credentials, user='someone')
+        sn = Sender(credentials, 'https://site.com/foo', 'GET',
+                    content='', content_type='')
+        assert sn.credentials is credentials
+        eq_(sn.req_resource.credentials['user'], 'someone')
+
+    def test_receiver_keeps_credentials_dict(self):
+        credentials = dict(self.credentials, user='someone')
+        url = 'https://site.com/foo'
+        sn = Sender(credentials, url, 'GET', content='', content_type='')
+        rc = Receiver(lambda id: credentials, sn.request_header, url, 'GET',
+                      content='', content_type='')
+        assert rc.resource.credentials is credentials
+        eq_(rc.resource.credentials['user'], 'someone')
+
+    def test_same_payload_hash_as_dict(self):
+        eq_(calculate_payload_hash('foo', 'sha256', 'text/plain'),
+            calculate_payload_hash('foo', self.compiled(), 'text/plain'))
+
+    def test_fingerprint(self):
+        eq_(credentials_fingerprint(self.compiled()),
+            credentials_fingerprint(self.credentials))
+        other = dict(self.credentials, key='other key')
+        assert (credentials_fingerprint(self.compiled()) !=
+                credentials_fingerprint(other))
+        other = dict(self.credentials, algorithm='sha1')
+        assert (credentials_fingerprint(self.compiled()) !=
+                credentials_fingerprint(other))
+
+    def test_same_ts_mac_as_dict(self):
+        eq_(calculate_ts_mac(1234, self.credentials),
+            calculate_ts_mac(1234, self.compiled()))
+
+    def test_send_and_receive(self):
+        cr = self.compiled()
+        url = 'https://site.com/foo?bar=1'
+        sn = Sender(cr, url, 'POST', content='foo', content_type='text/plain')
+        rc = Receiver(lambda id: cr, sn.request_header, url, 'POST',
+                      content='foo', content_type='text/plain')
+        rc.respond(content='bar', content_type='text/plain')
+        sn.accept_response(rc.response_header,
+                           content='bar', content_type='text/plain')
+
+    @raises(MacMismatch)
+    def test_receive_with_wrong_key(self):
+        url = 'https://site.com/foo?bar=1'
+        sn = Sender(self.compiled(), url, 'GET',
+                    content='', content_type='')
+        wrong = Credentials(self.credentials['id'], 'wrong key', 'sha256')
+        Receiver(lambda id: wrong, sn.request_header, url, 'GET',
+                 content='', content_type='')
+
+
 class TestSender(Base):
 
     def setUp(self):
@@ -381,6 +538,43 @@ class TestSender(Base):
     def test_invalid_key(self):
         parse_authorization_header('Hawk mac="validmac" unknownkey="value"')
 
+    def test_parsed_header_attributes(self):
+        sn = self.Sender(ext='some ext')
+        parsed = parse_authorization_header(sn.request_header)
+        eq_(parsed.id, self.credentials['id'])
+        eq_(parsed.ext, 'some ext')
+        eq_(parsed.app, None)
+        eq_(parsed.get('app', 'default'), 'default')
+        assert 'ext' in parsed
+        assert 'app' not in parsed
+        eq_(sorted(parsed.keys()),
+            ['ext', 'hash', 'id', 'mac', 'nonce', 'ts'])
+
+    def test_parsed_header_equals_dict(self):
+        parsed = parse_authorization_header('Hawk id="a", mac="b"')
+        eq_(parsed, {'id': 'a', 'mac': 'b'})
+
+    @raises(KeyError)
+    def test_parsed_header_missing_key(self):
+        parse_authorization_header('Hawk id="a", mac="b"')['ext']
+
+    @raises(BadHeaderValue)
+    def test_value_with_illegal_char(self):
+        parse_authorization_header('Hawk id="a", ext="tab\there"')
+
+    @raises(HawkFail)
+    def test_invalid_key_after_unparseable(self):
+        # Unknown keys are reported before unparsed parts of the header.
+        parse_authorization_header('Hawk mac="a", garbage unknownkey="b"')
+
+    def test_unparseable_parts_are_reported(self):
+        try:
+            parse_authorization_header('Hawk one mac="a", two')
+        except BadHeaderValue as exc:
+            eq_(exc.args[1], 'one two')
+        else:
+            self.fail('should raise')
+
     def test_ext_with_all_valid_characters(self):
         valid_characters = "!#$%&'()*+,-./:;<=>?@[]^_`{|}~ azAZ09_"
         sender = self.Sender(ext=valid_characters)
@@ -416,6 +610,35 @@ class TestSender(Base):
         # range.
         self.Sender(ext=u'Ivan Kristi\u0107'.encode('utf8'))
 
+    @raises(BadHeaderValue)
+    def test_nonce_with_quotes(self):
+        self.Sender(nonce='a"b')
+
+    @raises(BadHeaderValue)
+    def test_timestamp_with_quotes(self):
+        self.Sender(_timestamp='1", x="')
+
+    @raises(BadHeaderValue)
+    def test_app_with_new_line(self):
+        self.Sender(app='new line \n in the middle')
+
+    @raises(BadHeaderValue)
+    def test_dlg_with_illegal_unicode(self):
+        self.Sender(app='app', dlg=u'Ivan Kristi\u0107')
+
+    def test_header_layout(self):
+        now = utc_now()
+        sn = self.Sender(content='foo', content_type='text/plain',
+                         nonce=b'abc', ext='e', app='a', dlg='d',
+                         _timestamp=now)
+        parsed = parse_authorization_header(sn.request_header)
+        eq_(sn.request_header,
+            'Hawk mac="{mac}", hash="{hash}", id="my-hawk-id", ts="{ts}", '
+            'nonce="abc", ext="e", app="a", dlg="d"'
+            .format(mac=parsed['mac'], hash=parsed['hash'], ts=now))
+        self.receive(sn.request_header, content='foo',
+                     content_type='text/plain')
+
     def test_app_ok(self):
         app = 'custom-app'
         sn = self.Sender(app=app)
@@ -613,6 +836,18 @@ class TestReceiver(Base):
         header = parse_authorization_header(self.receiver.response_header)
         eq_(header['ext'], ext)
 
+    @raises(BadHeaderValue)
+    def test_respond_with_illegal_ext(self):
+        self.receive()
+        self.respond(ext='new line \n in the middle')
+
+    def test_respond_as_bytes(self):
+        self.receive(sender_kw=dict(app='app', dlg='dlg'))
+        header = self.respond(ext='custom-ext', as_bytes=True)
+        assert isinstance(header, six.binary_type), repr(header)
+        eq_(parse_authorization_header(header.decode('ascii'))['ext'],
+            'custom-ext')
+
     @raises(MacMismatch)
     def test_respond_with_wrong_app(self):
         self.receive(sender_kw=dict(app='TAMPERED-WITH', dlg='delegation'))
@@ -860,6 +1095,1709 @@ class TestSendAndReceive(Base):
                                content_type=content_type)
 
 
+class TestEndpointSigner(Base):
+
+    def setUp(self):
+        super(TestEndpointSigner, self).setUp()
+        self.url = 'https://My-Site.com:8080/foo?bar=1'
+
+    def sign_both(self, content=b'{"a": 1}', content_type='application/json',
+                  **kw):
+        signer_keys = ('always_hash_content', 'app', 'dlg', 'ext')
+        signer_kw = dict((k, kw.pop(k)) for k in signer_keys if k in kw)
+        signer = EndpointSigner(self.credentials, self.url, 'post',
+                                content_type=content_type, **signer_kw)
+        signed = signer.sign(content=content, nonce='abc', _timestamp=1, **kw)
+        kw.update(signer_kw)
+        sender = Sender(self.credentials, self.url, 'POST',
+                        content=content, content_type=content_type,
+                        nonce='abc', _timestamp=1, **kw)
+        return signed, sender
+
+    @raises(BadHeaderValue)
+    def test_timestamp_with_quotes(self):
+        signer = EndpointSigner(self.credentials, self.url, 'GET')
+        signer.sign(_timestamp='1", x="')
+
+    def test_same_header_as_sender(self):
+        signed, sender = self.sign_both()
+        eq_(signed.request_header, sender.request_header)
+
+    def test_same_header_with_ext_app_dlg(self):
+        signed, sender = self.sign_both(ext='some ext', app='some app',
+                                        dlg='some dlg')
+        eq_(signed.request_header, sender.request_header)
+
+    def test_same_header_with_app_only(self):
+        signed, sender = self.sign_both(app='some app')
+        eq_(signed.request_header, sender.request_header)
+
+    def test_same_header_without_content(self):
+        signed, sender = self.sign_both(content=EmptyValue,
+                                        content_type=EmptyValue,
+                                        always_hash_content=False)
+        eq_(signed.request_header, sender.request_header)
+
+    def test_ext_per_request(self):
+        signer = EndpointSigner(self.credentials, self.url, 'GET',
+                                always_hash_content=False, ext='default')
+        first = signer.sign(ext='other')
+        second = signer.sign()
+        eq_(parse_authorization_header(first.request_header)['ext'],
+            'other')
+        eq_(parse_authorization_header(second.request_header)['ext'],
+            'default')
+        Receiver(self.credentials_map, first.request_header,
+                 self.url, 'GET', accept_untrusted_content=True,
+                 seen_nonce=self.seen_nonce)
+
+    def test_content_type_per_request(self):
+        signer = EndpointSigner(self.credentials, self.url, 'POST',
+                                content_type='text/plain')
+        sender = signer.sign(content=b'{}', content_type='application/json')
+        Receiver(self.credentials_map, sender.request_header,
+                 self.url, 'POST', content=b'{}',
+                 content_type='application/json',
+                 seen_nonce=self.seen_nonce)
+
+    def test_parsed_url(self):
+        signer = EndpointSigner(self.credentials, split_url(self.url), 'GET',
+                                always_hash_content=False)
+        Receiver(self.credentials_map, signer.sign().request_header,
+                 self.url, 'GET', accept_untrusted_content=True,
+                 seen_nonce=self.seen_nonce)
+
+    def test_unique_nonces(self):
+        signer = EndpointSigner(self.credentials, self.url, 'GET',
+                                always_hash_content=False)
+        nonces = set(signer.sign().req_resource.nonce for i in range(20))
+        eq_(len(nonces), 20)
+
+    def test_round_trip(self):
+        signer = EndpointSigner(compile_credentials(self.credentials),
+                                self.url, 'POST', content_type='text/plain')
+        for content in (b'one', b'two'):
+            sender = signer.sign(content=content)
+            receiver = Receiver(self.credentials_map, sender.request_header,
+                                self.url, 'POST', content=content,
+                                content_type='text/plain',
+                                seen_nonce=self.seen_nonce)
+            receiver.respond(content=b'ok', content_type='text/plain')
+            sender.accept_response(receiver.response_header,
+                                   content=b'ok', content_type='text/plain')
+
+    @raises(MisComputedContentHash)
+    def test_tampered_content(self):
+        signer = EndpointSigner(self.credentials, self.url, 'POST',
+                                content_type='text/plain')
+        sender = signer.sign(content=b'one')
+        Receiver(self.credentials_map, sender.request_header,
+                 self.url, 'POST', content=b'two',
+                 content_type='text/plain', seen_nonce=self.seen_nonce)
+
+    @raises(BadHeaderValue)
+    def test_invalid_ext(self):
+        EndpointSigner(self.credentials, self.url, 'GET', ext='bad\next')
+
+
+class TestVerifyBatch(Base):
+
+    def setUp(self):
+        super(TestVerifyBatch, self).setUp()
+        self.url = 'http://site.com/foo?bar=1'
+        self.other_credentials = {
+            'id': 'other-hawk-id',
+            'key': 'other hAwK sekret',
+            'algorithm': 'sha1',
+        }
+        self.lookups = []
+
+    def credentials_map(self, id):
+        self.lookups.append(id)
+        for credentials in (self.credentials, self.other_credentials):
+            if credentials['id'] == id:
+                return credentials
+        raise LookupError(id)
+
+    def request(self, credentials=None, content='', method='POST'):
+        sn = Sender(credentials or self.credentials, self.url, method,
+                    content=content, content_type='text/plain')
+        return (sn.request_header, self.url, method, content, 'text/plain')
+
+    def test_batch(self):
+        unknown = self.credentials.copy()
+        unknown['id'] = 'unknown'
+        tampered = self.request(content='foo')
+        tampered = tampered[:3] + ('TAMPERED', 'text/plain')
+
+        results = verify_batch(self.credentials_map, [
+            self.request(),
+            self.request(credentials=self.other_credentials),
+            tampered,
+            self.request(credentials=unknown),
+            ('', self.url, 'GET', '', ''),
+            ('Hawk mac="a", garbage', self.url, 'GET', '', ''),
+            self.request(content='bar'),
+        ], seen_nonce=self.seen_nonce)
+
+        eq_([type(r.error) for r in results],
+            [type(None), type(None), MisComputedContentHash,
+             CredentialsLookupError, MissingAuthorization, BadHeaderValue,
+             type(None)])
+        eq_([bool(r.receiver) for r in results],
+            [True, True, False, False, False, False, True])
+        eq_(sorted(self.lookups),
+            ['my-hawk-id', 'other-hawk-id', 'unknown'])
+
+    def test_respond(self):
+        header, url, method, content, content_type = self.request()
+        results = verify_batch(self.credentials_map,
+                               [(header, url, method, content, content_type)])
+        receiver = results[0].receiver
+        receiver.respond(content='ok', content_type='text/plain')
+        assert receiver.response_header.startswith('Hawk mac=')
+
+    def test_replay_in_batch(self):
+        seen = set()
+
+        def seen_nonce(id, nonce, ts):
+            if (id, nonce, ts) in seen:
+                return True
+            seen.add((id, nonce, ts))
+            return False
+
+        request = self.request()
+        results = verify_batch(self.credentials_map, [request, request],
+                               seen_nonce=seen_nonce)
+        eq_(results[0].error, None)
+        eq_(type(results[1].error), AlreadyProcessed)
+
+    def test_receiver_options(self):
+        sn = Sender(self.credentials, self.url, 'GET',
+                    content='', content_type='', _timestamp=utc_now() - 120)
+        request = (sn.request_header, self.url, 'GET', '', '')
+        results = verify_batch(self.credentials_map, [request],
+                               timestamp_skew_in_seconds=200)
+        eq_(results[0].error, None)
+
+    def test_compiles_once_per_id(self):
+        self.credentials['user'] = 'someone'
+        requests = [self.request(), self.request(content='bar'),
+                    self.request(credentials=self.other_credentials)]
+        with mock.patch('mohawk.receiver.compile_credentials',
+                        wraps=compile_credentials) as compile_:
+            results = verify_batch(self.credentials_map, requests,
+                                   seen_nonce=self.seen_nonce)
+        eq_(compile_.call_count, 2)
+        eq_([r.error for r in results], [None, None, None])
+        receiver = results[0].receiver
+        assert receiver.resource.credentials is self.credentials
+        eq_(receiver.resource.credentials['user'], 'someone')
+        eq_(type(receiver.resource._mac_credentials), Credentials)
+        receiver.respond(content='ok', content_type='text/plain')
+        assert receiver.response_header.startswith('Hawk mac=')
+
+    def test_nonce_store_error(self):
+        def seen_nonce(id, nonce, ts):
+            if nonce == broken_nonce:
+                raise RuntimeError('nonce store is down')
+            return False
+
+        requests = [self.request(), self.request(content='bar'),
+                    self.request(content='baz')]
+        broken_nonce = parse_authorization_header(requests[1][0])['nonce']
+        results = verify_batch(self.credentials_map, requests,
+                               seen_nonce=seen_nonce)
+        eq_([type(r.error) for r in results],
+            [type(None), RuntimeError, type(None)])
+        eq_([bool(r.receiver) for r in results], [True, False, True])
+
+    def test_credentials_map_error(self):
+        def credentials_map(id):
+            if id == self.other_credentials['id']:
+                raise RuntimeError('database is down')
+            return self.credentials_map(id)
+
+        results = verify_batch(credentials_map, [
+            self.request(),
+            self.request(credentials=self.other_credentials),
+            self.request(content='bar'),
+        ], seen_nonce=self.seen_nonce)
+        eq_([type(r.error) for r in results],
+            [type(None), RuntimeError, type(None)])
+
+    def check_incomplete_header(self, header):
+        results = verify_batch(self.credentials_map, [
+            self.request(),
+            (header, self.url, 'GET', '', ''),
+            self.request(content='bar'),
+        ], seen_nonce=self.seen_nonce)
+        eq_([type(r.error) for r in results],
+            [type(None), BadHeaderValue, type(None)])
+        eq_([bool(r.receiver) for r in results], [True, False, True])
+
+    def test_header_without_id(self):
+        self.check_incomplete_header(
+            'Hawk ts="1", nonce="n", mac="x"')
+
+    def test_header_without_ts(self):
+        self.check_incomplete_header(
+            'Hawk id="my-hawk-id", nonce="n", mac="x"')
+
+    def test_header_without_nonce(self):
+        self.check_incomplete_header(
+            'Hawk id="my-hawk-id", ts="1", mac="x"')
+
+    def test_header_with_only_id_and_mac(self):
+        self.check_incomplete_header('Hawk id="a", mac="x"')
+
+
+class TestNonceSource(TestCase):
+
+    def test_length(self):
+        source = NonceSource(block_size=30)
+        for length in (1, 6, 39, 100):
+            value = source.random_string(length)
+            assert isinstance(value, six.binary_type), repr(value)
+            eq_(len(value), length)
+
+    def test_urlsafe(self):
+        value = NonceSource().random_string(1000)
+        eq_(value.strip(b'abcdefghijklmnopqrstuvwxyz'
+                        b'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_'), b'')
+
+    def test_unique(self):
+        source = NonceSource(block_size=300)
+        nonces = [source.random_string(6) for i in range(1000)]
+        eq_(len(set(nonces)), 1000)
+
+    def test_reads_in_blocks(self):
+        source = NonceSource(block_size=3000)
+        with mock.patch('mohawk.util.os.urandom',
+                        side_effect=os.urandom) as urandom:
+            for i in range(600):
+                source.random_string(6)
+        # 3000 bytes encode to 4000 characters; enough for 666 nonces.
+        eq_(urandom.call_count, 1)
+        eq_(urandom.call_args[0], (3000,))
+
+    def test_block_size_is_whole_base64_groups(self):
+        eq_(NonceSource(block_size=100).block_size, 99)
+        eq_(NonceSource(block_size=1).block_size, 3)
+
+    def test_threads(self):
+        source = NonceSource(block_size=30)
+        results = []
+
+        def generate():
+            results.extend([source.random_string(6) for i in range(500)])
+
+        threads = [threading.Thread(target=generate) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(len(set(results)), 2000)
+
+    @skipIf(not hasattr(os, 'fork'), 'os.fork() is not available')
+    def test_fork(self):
+        source = NonceSource()
+        source.random_string(6)
+        read_end, write_end = os.pipe()
+        with warnings.catch_warnings():
+            # Python 3.12 warns about forking a process with threads.
+            warnings.simplefilter('ignore', DeprecationWarning)
+            pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            try:
+                os.close(read_end)
+                os.write(write_end, source.random_string(6))
+            finally:
+                os._exit(0)
+        os.close(write_end)
+        try:
+            child_nonce = os.read(read_end, 6)
+        finally:
+            os.close(read_end)
+            os.waitpid(pid, 0)
+        eq_(len(child_nonce), 6)
+        assert child_nonce != source.random_string(6)
+
+    def test_random_string(self):
+        value = random_string(6)
+        assert isinstance(value, six.binary_type), repr(value)
+        eq_(len(value), 6)
+        assert value != random_string(6)
+
+
+class TestClockOffsetTracker(Base):
+
+    def setUp(self):
+        super(TestClockOffsetTracker, self).setUp()
+        self.url = 'https://site.com/foo'
+        self.clock_offsets = ClockOffsetTracker()
+
+    def receive(self, sender, offset=600):
+        return Receiver(self.credentials_map, sender.request_header,
+                        self.url, 'GET', content='', content_type='',
+                        localtime_offset_in_seconds=offset,
+                        seen_nonce=self.seen_nonce)
+
+    def sender(self, **kw):
+        credentials = kw.pop('credentials', self.credentials)
+        kw.setdefault('clock_offsets', self.clock_offsets)
+        return Sender(credentials, self.url, 'GET', content='',
+                      content_type='', **kw)
+
+    def challenge(self, offset=600):
+        try:
+            self.receive(self.sender(), offset=offset)
+        except TokenExpired:
+            return sys.exc_info()[1].www_authenticate
+        self.fail('the request was not rejected')
+
+    def test_learn_offset(self):
+        assert self.clock_offsets.update(self.challenge(), self.credentials)
+        offset = self.clock_offsets.offset(self.credentials)
+        assert 599 <= offset <= 601, offset
+
+        sender = self.sender()
+        receiver = self.receive(sender)
+        receiver.respond(content='', content_type='')
+        sender.accept_response(receiver.response_header, content='',
+                               content_type='')
+
+    def test_learn_negative_offset(self):
+        assert self.clock_offsets.update(self.challenge(offset=-600),
+                                         self.credentials)
+        self.receive(self.sender(), offset=-600)
+
+    def test_compiled_credentials(self):
+        credentials = compile_credentials(self.credentials)
+        assert self.clock_offsets.update(self.challenge(), credentials)
+        self.receive(self.sender(credentials=credentials))
+
+    def test_bytes_challenge(self):
+        assert self.clock_offsets.update(self.challenge().encode('ascii'),
+                                         self.credentials)
+
+    def test_endpoint_signer(self):
+        self.clock_offsets.update(self.challenge(), self.credentials)
+        signer = EndpointSigner(self.credentials, self.url, 'GET',
+                                content_type='',
+                                clock_offsets=self.clock_offsets)
+        self.receive(signer.sign(content=''))
+
+    def test_offset_per_credentials(self):
+        self.clock_offsets.update(self.challenge(), self.credentials)
+        eq_(self.clock_offsets.offset({'id': 'someone-else'}), 0)
+
+    def test_reset(self):
+        self.clock_offsets.update(self.challenge(), self.credentials)
+        self.clock_offsets.reset(self.credentials)
+        eq_(self.clock_offsets.offset(self.credentials), 0)
+        self.clock_offsets.update(self.challenge(), self.credentials)
+        self.clock_offsets.reset()
+        eq_(self.clock_offsets.offset(self.credentials), 0)
+
+    def test_fake_clock(self):
+        clock_offsets = ClockOffsetTracker(clock=FakeClock(1000))
+        ts = 1600
+        challenge = 'Hawk ts="{ts}", tsm="{tsm}", error="expired"'.format(
+            ts=ts, tsm=calculate_ts_mac(ts, self.credentials).decode('ascii'))
+        assert clock_offsets.update(challenge, self.credentials)
+        eq_(clock_offsets.offset(self.credentials), 600)
+        eq_(clock_offsets.now(self.credentials), 1600)
+
+    @raises(MacMismatch)
+    def test_forged_tsm(self):
+        challenge = self.challenge()
+        other = dict(self.credentials, key='another key')
+        self.clock_offsets.update(challenge, other)
+
+    @raises(MacMismatch)
+    def test_tampered_ts(self):
+        challenge = parse_authorization_header(self.challenge())
+        self.clock_offsets.update(
+            'Hawk ts="{ts}", tsm="{tsm}"'.format(ts=int(challenge['ts']) + 1,
+                                                 tsm=challenge['tsm']),
+            self.credentials)
+
+    @raises(HawkFail)
+    def test_missing_tsm(self):
+        self.clock_offsets.update('Hawk ts="1"', self.credentials)
+
+    def test_challenge_without_ts(self):
+        for challenge in ('', 'Hawk', 'Hawk error="bad mac"'):
+            assert not self.clock_offsets.update(challenge, self.credentials)
+        eq_(self.clock_offsets.offset(self.credentials), 0)
+
+
+class TestUTCNow(TestCase):
+
+    def test_truncates(self):
+        with mock.patch('mohawk.util.time.time', return_value=100.9):
+            eq_(utc_now(), 100)
+            eq_(utc_now(0.5), 100)
+            eq_(utc_now(-0.5), 99)
+            eq_(utc_now(60), 160)
+
+
+class FakeClock(object):
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(TestCase):
+
+    def test_get_and_set(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        eq_(cache.get('a'), 1)
+        eq_(cache.get('b', 'default'), 'default')
+        eq_((cache.hits, cache.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        eq_(cache.get('b'), None)
+        eq_(cache.get('a'), 1)
+        eq_(cache.evictions, 1)
+        eq_(len(cache), 2)
+
+    def test_expiry(self):
+        clock = FakeClock()
+        cache = LRUCache(2, clock=clock)
+        cache.set('a', 1, ttl=10)
+        eq_(cache.peek('a'), 1)
+        clock.now += 10
+        eq_(cache.get('a'), None)
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.set('a', 1)
+        eq_(cache.get('a'), None)
+
+
+class TestCredentialsCache(Base):
+
+    def setUp(self):
+        super(TestCredentialsCache, self).setUp()
+        self.clock = FakeClock()
+        self.lookups = []
+
+    def credentials_map(self, id):
+        self.lookups.append(id)
+        return super(TestCredentialsCache, self).credentials_map(id)
+
+    def cache(self, **kw):
+        kw.setdefault('clock', self.clock)
+        return CredentialsCache(self.credentials_map, **kw)
+
+    def test_hit(self):
+        cache = self.cache()
+        cr = cache('my-hawk-id')
+        assert isinstance(cr, Credentials)
+        assert cache('my-hawk-id') is cr
+        eq_(self.lookups, ['my-hawk-id'])
+        stats = cache.stats()
+        eq_((stats.size, stats.hits, stats.misses, stats.lookups),
+            (1, 1, 1, 1))
+
+    def test_not_compiled(self):
+        credentials = dict(self.credentials, user='alice')
+        cache = CredentialsCache(lambda id: credentials, compiled=False)
+        assert cache('my-hawk-id') is credentials
+        assert cache('my-hawk-id') is credentials
+
+    def test_not_compiled_receiver(self):
+        credentials = dict(self.credentials, user='alice')
+        cache = CredentialsCache(lambda id: credentials, compiled=False)
+        url = 'https://site.com/foo'
+        sn = Sender(credentials, url, 'GET', content='', content_type='')
+        rc = Receiver(cache, sn.request_header, url, 'GET',
+                      content='', content_type='')
+        assert rc.resource.credentials is credentials
+        eq_(rc.resource.credentials['user'], 'alice')
+
+    def test_ttl(self):
+        cache = self.cache(ttl=10)
+        cache('my-hawk-id')
+        self.clock.now += 10
+        cache('my-hawk-id')
+        eq_(len(self.lookups), 2)
+
+    def test_negative_caching(self):
+        cache = self.cache(negative_ttl=5)
+        for i in range(2):
+            self.assertRaises(LookupError, cache, 'unknown')
+        eq_(self.lookups, ['unknown'])
+        eq_(cache.stats().negative_hits, 1)
+        self.clock.now += 5
+        self.assertRaises(LookupError, cache, 'unknown')
+        eq_(len(self.lookups), 2)
+
+    def test_errors_are_not_cached(self):
+        calls = []
+
+        def broken(id):
+            calls.append(id)
+            raise RuntimeError('database is down')
+
+        cache = CredentialsCache(broken)
+        for i in range(2):
+            self.assertRaises(RuntimeError, cache, 'my-hawk-id')
+        eq_(len(calls), 2)
+
+    def test_invalidate(self):
+        cache = self.cache()
+        cache('my-hawk-id')
+        cache.invalidate('my-hawk-id')
+        cache('my-hawk-id')
+        eq_(len(self.lookups), 2)
+
+    def test_maxsize(self):
+        cache = self.cache(maxsize=1)
+        cache('my-hawk-id')
+        self.assertRaises(LookupError, cache, 'unknown')
+        eq_(cache.stats().evictions, 1)
+
+    def test_single_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_lookup(id):
+            calls.append(id)
+            started.set()
+            release.wait()
+            return self.credentials
+
+        cache = CredentialsCache(slow_lookup)
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(cache('my-hawk-id')))
+            for i in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while cache.stats().coalesced < 4:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        eq_(calls, ['my-hawk-id'])
+        eq_(len(set(id(r) for r in results)), 1)
+        eq_(cache.stats().coalesced, 4)
+
+    def test_receiver(self):
+        url = 'http://site.com/'
+        cache = self.cache()
+        sn = Sender(self.credentials, url, 'GET',
+                    content='', content_type='')
+        for i in range(2):
+            Receiver(cache, sn.request_header, url, 'GET',
+                     content='', content_type='')
+        eq_(self.lookups, ['my-hawk-id'])
+
+    @raises(CredentialsLookupError)
+    def test_receiver_unknown_id(self):
+        url = 'http://site.com/'
+        cr = self.credentials.copy()
+        cr['id'] = 'unknown'
+        sn = Sender(cr, url, 'GET', content='', content_type='')
+        Receiver(self.cache(), sn.request_header, url, 'GET',
+                 content='', content_type='')
+
+
+class TestMemoryNonceStore(Base):
+
+    def setUp(self):
+        super(TestMemoryNonceStore, self).setUp()
+        self.clock = FakeClock(1000)
+        self.store = MemoryNonceStore(timestamp_skew_in_seconds=60,
+                                      bucket_seconds=10, clock=self.clock)
+
+    def test_seen(self):
+        assert not self.store('id', 'nonce', '1000')
+        assert self.store('id', 'nonce', '1000')
+        eq_(self.store.size, 1)
+
+    def test_different_values(self):
+        assert not self.store('id', 'nonce', '1000')
+        assert not self.store('other-id', 'nonce', '1000')
+        assert not self.store('id', 'other-nonce', '1000')
+        assert not self.store('id', 'nonce', '1001')
+        eq_(self.store.size, 4)
+
+    def test_expiry(self):
+        self.store('id', 'nonce', '995')
+        self.store('id', 'nonce', '1005')
+        self.clock.now = 1055
+        eq_(self.store.stats()['size'], 2)
+        self.clock.now = 1061
+        eq_(self.store.stats(),
+            {'size': 1, 'buckets': 1, 'evictions': 1})
+        # The nonce is still remembered while its timestamp is valid.
+        self.clock.now = 1065
+        assert self.store('id', 'nonce', '1005')
+
+    def test_expired_timestamp_is_not_stored(self):
+        assert not self.store('id', 'nonce', '900')
+        eq_(self.store.size, 0)
+
+    def test_clear(self):
+        self.store('id', 'nonce', '1000')
+        self.store.clear()
+        assert not self.store('id', 'nonce', '1000')
+
+    def test_threads(self):
+        results = []
+
+        def check():
+            results.append(self.store('id', 'nonce', '1000'))
+
+        threads = [threading.Thread(target=check) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(sorted(results), [False] + [True] * 9)
+
+    @raises(AlreadyProcessed)
+    def test_receiver(self):
+        url = 'http://site.com/'
+        store = MemoryNonceStore()
+        sn = Sender(self.credentials, url, 'GET',
+                    content='', content_type='')
+        for i in range(2):
+            Receiver(self.credentials_map, sn.request_header, url, 'GET',
+                     content='', content_type='', seen_nonce=store)
+
+
+class TestBloomNonceStore(Base):
+
+    def setUp(self):
+        super(TestBloomNonceStore, self).setUp()
+        self.clock = FakeClock(1000)
+        self.store = BloomNonceStore(capacity=1000, error_rate=0.01,
+                                     timestamp_skew_in_seconds=60,
+                                     clock=self.clock)
+
+    def test_seen(self):
+        assert not self.store('id', 'nonce', '1000')
+        assert self.store('id', 'nonce', '1000')
+        assert not self.store('other-id', 'nonce', '1000')
+        assert not self.store('id', 'nonce', '1001')
+
+    def test_replay_detected_until_expiry(self):
+        self.store('id', 'nonce', '959')
+        for now in range(1000, 1020):
+            self.clock.now = now
+            assert self.store('id', 'nonce', '959')
+        self.clock.now = 1020
+        # Now the timestamp is too old to be valid.
+        assert not self.store('id', 'nonce', '959')
+        eq_(self.store.stats()['rotations'], 1)
+
+    def test_out_of_range_timestamps_are_not_stored(self):
+        assert not self.store('id', 'nonce', '500')
+        assert not self.store('id', 'nonce', '1500')
+        eq_(self.store.stats()['filters'], 0)
+
+    def test_bounded_memory(self):
+        for now in range(1000, 1300, 10):
+            self.clock.now = now
+            self.store('id', 'nonce', str(now))
+        stats = self.store.stats()
+        assert stats['filters'] <= 3, stats
+        assert stats['memory_bytes'] <= stats['max_memory_bytes'], stats
+
+    def test_false_positive_rate(self):
+        for i in range(900):
+            self.store('id', 'nonce-{0}'.format(i), '1000')
+        # Each of these is stored too, which fills up the filter
+        # to its capacity.
+        false_positives = sum(
+            self.store('id', 'other-nonce-{0}'.format(i), '1000')
+            for i in range(100))
+        assert false_positives < 10, false_positives
+        stats = self.store.stats()
+        assert 0.005 < stats['false_positive_rate'] < 0.02, stats
+
+    @raises(ValueError)
+    def test_invalid_error_rate(self):
+        BloomNonceStore(error_rate=0)
+
+    @raises(AlreadyProcessed)
+    def test_receiver(self):
+        url = 'http://site.com/'
+        store = BloomNonceStore(capacity=100)
+        sn = Sender(self.credentials, url, 'GET',
+                    content='', content_type='')
+        for i in range(2):
+            Receiver(self.credentials_map, sn.request_header, url, 'GET',
+                     content='', content_type='', seen_nonce=store)
+
+
+class TestSharedMemoryNonceStore(Base):
+
+    def setUp(self):
+        super(TestSharedMemoryNonceStore, self).setUp()
+        self.clock = FakeClock(1000)
+        self.store = SharedMemoryNonceStore(slots=256, stripes=4,
+                                            timestamp_skew_in_seconds=60,
+                                            clock=self.clock)
+
+    def test_seen(self):
+        assert not self.store('id', 'nonce', '1000')
+        assert self.store('id', 'nonce', '1000')
+        assert not self.store('other-id', 'nonce', '1000')
+        assert not self.store('id', 'nonce', '1001')
+        eq_(self.store.stats()['size'], 3)
+
+    def test_expiry(self):
+        self.store('id', 'nonce', '990')
+        self.clock.now = 1050
+        assert self.store('id', 'nonce', '990')
+        self.clock.now = 1051
+        eq_(self.store.stats()['size'], 0)
+        assert not self.store('id', 'nonce', '990')
+
+    def test_out_of_range_timestamps_are_not_stored(self):
+        assert not self.store('id', 'nonce', '900')
+        assert not self.store('id', 'nonce', '1100')
+        eq_(self.store.stats()['inserts'], 0)
+
+    def test_many_nonces(self):
+        store = SharedMemoryNonceStore(slots=2048, stripes=4,
+                                       clock=self.clock)
+        for i in range(200):
+            assert not store('id', 'nonce-{0}'.format(i), '1000')
+        for i in range(200):
+            assert store('id', 'nonce-{0}'.format(i), '1000')
+        eq_(store.stats()['overflows'], 0)
+
+    def test_full_table_rejects(self):
+        store = SharedMemoryNonceStore(slots=2, stripes=1, clock=self.clock)
+        assert not store('id', 'nonce-1', '1000')
+        assert not store('id', 'nonce-2', '1000')
+        assert store('id', 'nonce-3', '1000')
+        eq_(store.stats()['overflows'], 1)
+        # Expired slots are reused.
+        self.clock.now = 1061
+        assert not store('id', 'nonce-3', '1001')
+
+    def test_clear(self):
+        self.store('id', 'nonce', '1000')
+        self.store.clear()
+        assert not self.store('id', 'nonce', '1000')
+
+    @skipIf(not hasattr(os, 'fork'), 'requires fork()')
+    def test_shared_with_forked_process(self):
+        store = SharedMemoryNonceStore(slots=256, stripes=4)
+        now = str(utc_now())
+        pid = os.fork()
+        if pid == 0:
+            try:
+                seen = store('id', 'nonce', now)
+            finally:
+                os._exit(3 if seen else 0)
+        pid, status = os.waitpid(pid, 0)
+        eq_(os.WEXITSTATUS(status), 0)
+        assert store('id', 'nonce', now)
+
+
+class TestSQLiteNonceStore(Base):
+
+    def setUp(self):
+        super(TestSQLiteNonceStore, self).setUp()
+        self.clock = FakeClock(1000)
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'nonces.db')
+
+    def store(self, **kw):
+        kw.setdefault('clock', self.clock)
+        kw.setdefault('timestamp_skew_in_seconds', 60)
+        store = SQLiteNonceStore(self.path, **kw)
+        self.addCleanup(store.close)
+        return store
+
+    def rows(self):
+        db = sqlite3.connect(self.path)
+        try:
+            return sorted(db.execute('SELECT sender_id, nonce, ts '
+                                     'FROM hawk_nonces').fetchall())
+        finally:
+            db.close()
+
+    def test_seen(self):
+        store = self.store()
+        assert not store('id', 'nonce', '1000')
+        assert store('id', 'nonce', '1000')
+        assert not store('id', 'nonce', '1001')
+
+    def test_wal_mode(self):
+        store = self.store()
+        eq_(store._db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_batched_writes(self):
+        store = self.store(batch_size=3, flush_interval=3600)
+        store('id', 'nonce-1', '1000')
+        store('id', 'nonce-2', '1000')
+        eq_(self.rows(), [])
+        eq_(store.stats()['pending'], 2)
+        store('id', 'nonce-3', '1000')
+        eq_(len(self.rows()), 3)
+        eq_(store.stats()['writes'], 3)
+
+    def test_flush_interval(self):
+        store = self.store(batch_size=100, flush_interval=0)
+        store('id', 'nonce', '1000')
+        eq_(self.rows(), [('id', 'nonce', 1000)])
+
+    def test_flushes_when_idle(self):
+        store = self.store(batch_size=100, flush_interval=0.05)
+        store('id', 'nonce', '1000')
+        for i in range(100):
+            if self.rows():
+                break
+            threading.Event().wait(0.02)
+        eq_(self.rows(), [('id', 'nonce', 1000)])
+        eq_(store.stats()['pending'], 0)
+
+    def test_close_stops_flushing(self):
+        store = self.store(batch_size=100, flush_interval=0.01)
+        store.close()
+        assert store._closed.is_set()
+        store.close()
+
+    @raises(ValueError)
+    def test_call_after_close(self):
+        store = self.store(batch_size=1)
+        store.close()
+        store('id', 'nonce', '1000')
+
+    @raises(ValueError)
+    def test_flush_after_close(self):
+        store = self.store()
+        store.close()
+        store.flush()
+
+    def test_locked_database(self):
+        store = self.store(batch_size=1)
+        db = store._db
+
+        def execute(sql, *args):
+            if sql == 'BEGIN':
+                raise sqlite3.OperationalError('database is locked')
+            return db.execute(sql, *args)
+
+        store._db = mock.Mock(execute=execute)
+        assert not store('id', 'nonce-1', '1000')
+        assert store('id', 'nonce-1', '1000')
+        eq_(store.stats()['pending'], 1)
+
+        store._db = db
+        store('id', 'nonce-2', '1000')
+        eq_(self.rows(), [('id', 'nonce-1', 1000), ('id', 'nonce-2', 1000)])
+        eq_(store.stats()['pending'], 0)
+
+    def test_survives_restart(self):
+        store = self.store()
+        store('id', 'nonce', '1000')
+        store.close()
+
+        store = self.store()
+        assert store('id', 'nonce', '1000')
+
+    def test_expired_rows_are_pruned_and_not_loaded(self):
+        store = self.store(batch_size=1)
+        store('id', 'old-nonce', '990')
+        self.clock.now = 1051
+        store('id', 'nonce', '1050')
+        eq_(self.rows(), [('id', 'nonce', 1050)])
+        eq_(store.stats()['pruned'], 1)
+
+        self.clock.now = 1111
+        store.close()
+        store = self.store()
+        assert not store('id', 'nonce', '1111')
+        eq_(store.stats()['size'], 1)
+
+    def test_expired_timestamp_is_not_stored(self):
+        store = self.store(batch_size=1)
+        store('id', 'nonce', '900')
+        eq_(self.rows(), [])
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                command = _redis_reply(self.rfile)
+            except socket.error:
+                return
+            server.received.set()
+            server.gate.wait()
+            if server.hang_up:
+                server.hang_up = False
+                return
+            server.commands.append(command)
+            name = command[0].upper()
+            if name == b'AUTH':
+                reply = (b'+OK\r\n' if command[1] == server.password
+                         else b'-ERR invalid password\r\n')
+            elif name == b'SELECT':
+                reply = b'+OK\r\n'
+            elif name == b'SET':
+                with server.lock:
+                    if command[1] in server.data:
+                        reply = b'$-1\r\n'
+                    else:
+                        server.data[command[1]] = command[2]
+                        reply = b'+OK\r\n'
+            else:
+                reply = b'-ERR unknown command\r\n'
+            self.wfile.write(reply)
+            self.wfile.flush()
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    # Speaks just enough of the Redis protocol for RedisNonceStore.
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+                                                 FakeRedisHandler)
+        self.data = {}
+        self.commands = []
+        self.password = None
+        self.hang_up = False
+        self.lock = threading.Lock()
+        self.received = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+
+class TestRedisNonceStore(Base):
+
+    def setUp(self):
+        super(TestRedisNonceStore, self).setUp()
+        self.clock = FakeClock(1000)
+        self.server = FakeRedisServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def store(self, **kw):
+        kw.setdefault('port', self.server.server_address[1])
+        kw.setdefault('clock', self.clock)
+        kw.setdefault('timestamp_skew_in_seconds', 60)
+        store = RedisNonceStore('127.0.0.1', **kw)
+        self.addCleanup(store.close)
+        return store
+
+    def test_seen(self):
+        store = self.store()
+        assert not store('id', 'nonce', '1000')
+        assert store('id', 'nonce', '1000')
+        assert not store('id', 'nonce', '1001')
+        assert not store('other-id', 'nonce', '1000')
+
+    def test_set_command(self):
+        store = self.store(key_prefix='test:')
+        store('id', 'nonce', '1010')
+        eq_(self.server.commands,
+            [[b'SET', b'test:id\nnonce\n1010', b'1', b'NX', b'EX', b'71']])
+
+    def test_expired_timestamp_is_not_stored(self):
+        store = self.store()
+        assert not store('id', 'nonce', '900')
+        assert not store('id', 'nonce', '1100')
+        eq_(self.server.commands, [])
+
+    def test_auth_and_select(self):
+        self.server.password = b'secret'
+        store = self.store(password='secret', db=2)
+        assert not store('id', 'nonce', '1000')
+        eq_([c[0] for c in self.server.commands], [b'AUTH', b'SELECT', b'SET'])
+        eq_(self.server.commands[1], [b'SELECT', b'2'])
+
+    def test_pipelines_concurrent_checks(self):
+        store = self.store()
+        self.server.gate.clear()
+        results = []
+
+        def check(nonce):
+            results.append(store('id', nonce, '1000'))
+
+        first = threading.Thread(target=check, args=('nonce-0',))
+        first.start()
+        # Queue more checks while the first round-trip is in flight.
+        self.server.received.wait(5)
+        threads = [threading.Thread(target=check,
+                                    args=('nonce-{i}'.format(i=i),))
+                   for i in range(1, 10)]
+        for thread in threads:
+            thread.start()
+        while len(store._queue) < 9:
+            threading.Event().wait(0.001)
+        self.server.gate.set()
+        for thread in [first] + threads:
+            thread.join(5)
+
+        eq_(results, [False] * 10)
+        eq_(store.stats()['round_trips'], 2)
+        eq_(store.stats()['commands'], 10)
+
+    def test_falls_back_when_unreachable(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        store = self.store(port=port, retry_interval=60)
+        assert not store('id', 'nonce', '1000')
+        assert store('id', 'nonce', '1000')
+        stats = store.stats()
+        eq_(stats['fallbacks'], 2)
+        eq_(stats['round_trips'], 0)
+
+    def test_falls_back_on_error_reply(self):
+        self.server.password = b'secret'
+        store = self.store(password='wrong', retry_interval=60)
+        assert not store('id', 'nonce', '1000')
+        assert store('id', 'nonce', '1000')
+        eq_(store.stats()['fallbacks'], 2)
+
+    def test_reconnects(self):
+        store = self.store(retry_interval=0)
+        assert not store('id', 'nonce', '1000')
+        self.server.hang_up = True
+        assert not store('id', 'nonce-2', '1000')
+        eq_(store.stats()['fallbacks'], 1)
+        assert store('id', 'nonce', '1000')
+        assert store.stats()['connected']
+
+    def test_custom_fallback(self):
+        store = self.store(port=1, fallback=lambda *args: True)
+        assert store('id', 'nonce', '1000')
+
+    def stuck_pipeline(self, store, error=None):
+        # Makes the next round-trip block until the returned event is set.
+        started = threading.Event()
+        release = threading.Event()
+        pipeline = store._pipeline
+
+        def stuck(commands):
+            store._pipeline = pipeline
+            started.set()
+            release.wait(5)
+            if error is not None:
+                raise error
+            return pipeline(commands)
+
+        store._pipeline = stuck
+        return started, release
+
+    def check_in_thread(self, store, nonce, results):
+        def check():
+            try:
+                results.append(store('id', nonce, '1000'))
+            except Exception:
+                results.append(sys.exc_info()[1])
+
+        thread = threading.Thread(target=check)
+        thread.start()
+        return thread
+
+    def test_unexpected_error_releases_waiting_checks(self):
+        store = self.store()
+        started, release = self.stuck_pipeline(store, RuntimeError('bug'))
+        leader_results, follower_results = [], []
+        leader = self.check_in_thread(store, 'nonce-1', leader_results)
+        started.wait(5)
+        follower = self.check_in_thread(store, 'nonce-2', follower_results)
+        while not store._queue:
+            threading.Event().wait(0.001)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        eq_(type(leader_results[0]), RuntimeError)
+        eq_(follower_results, [False])
+        eq_(store.stats()['fallbacks'], 1)
+        # The next check is sent to the server again.
+        assert not store('id', 'nonce-3', '1000')
+        eq_(store.stats()['round_trips'], 1)
+
+    def test_waiting_check_times_out(self):
+        store = self.store(socket_timeout=0.05)
+        started, release = self.stuck_pipeline(store)
+        self.addCleanup(release.set)
+        leader_results, follower_results = [], []
+        leader = self.check_in_thread(store, 'nonce-1', leader_results)
+        started.wait(5)
+        follower = self.check_in_thread(store, 'nonce-2', follower_results)
+        follower.join(5)
+        eq_(follower_results, [False])
+        eq_(store.stats()['fallbacks'], 1)
+        release.set()
+        leader.join(5)
+        eq_(leader_results, [False])
+
+    def test_receiver(self):
+        store = self.store(clock=utc_now)
+        url = 'http://site.com/'
+        sn = Sender(self.credentials, url, 'GET', content='',
+                    content_type='')
+        Receiver(self.credentials_map, sn.request_header, url, 'GET',
+                 content='', content_type='', seen_nonce=store)
+        with self.assertRaises(AlreadyProcessed):
+            Receiver(self.credentials_map, sn.request_header, url, 'GET',
+                     content='', content_type='', seen_nonce=store)
+
+    @skipIf(not os.environ.get('MOHAWK_TEST_REDIS_PORT'),
+            'set MOHAWK_TEST_REDIS_PORT to test against a Redis server')
+    def test_redis_server(self):
+        store = RedisNonceStore(
+            port=int(os.environ['MOHAWK_TEST_REDIS_PORT']),
+            key_prefix='mohawk-test:{pid}:'.format(pid=os.getpid()))
+        self.addCleanup(store.close)
+        ts = utc_now()
+        assert not store('id', 'nonce', ts)
+        assert store('id', 'nonce', ts)
+        eq_(store.stats()['fallbacks'], 0)
+
+
+def wsgi_echo_app(environ, start_response):
+    # Responds with the request body.
+    body = environ['wsgi.input'].read()
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [body[:2], body[2:]]
+
+
+def wsgi_lazy_app(environ, start_response):
+    # Responds without reading the request body.
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'ok']
+
+
+class TestEnvironURL(TestCase):
+
+    def environ(self, **kw):
+        environ = {'wsgi.url_scheme': 'http', 'SERVER_NAME': 'Localhost',
+                   'SERVER_PORT': '8000', 'SCRIPT_NAME': '',
+                   'PATH_INFO': '/foo', 'QUERY_STRING': ''}
+        environ.update(kw)
+        return environ
+
+    def test_server(self):
+        eq_(environ_url(self.environ()),
+            ParsedURL('/foo', 'localhost', '8000'))
+
+    def test_host(self):
+        eq_(environ_url(self.environ(HTTP_HOST='Site.com:8080')),
+            ParsedURL('/foo', 'site.com', '8080'))
+
+    def test_default_port(self):
+        eq_(environ_url(self.environ(HTTP_HOST='site.com',
+                                     **{'wsgi.url_scheme': 'https'})),
+            ParsedURL('/foo', 'site.com', '443'))
+
+    def test_script_name_and_query(self):
+        eq_(environ_url(self.environ(SCRIPT_NAME='/app',
+                                     QUERY_STRING='a=1&b=%20'))[0],
+            '/app/foo?a=1&b=%20')
+
+    def test_quoted_path(self):
+        path = u'/caf\xe9 bar'.encode('utf8')
+        if six.PY3:
+            path = path.decode('latin-1')
+        eq_(environ_url(self.environ(PATH_INFO=path))[0], '/caf%C3%A9%20bar')
+
+    def test_raw_uri(self):
+        # PATH_INFO is decoded, so its escapes can't be rebuilt reliably.
+        for key in ('RAW_URI', 'REQUEST_URI'):
+            environ = self.environ(PATH_INFO='/a/b c', QUERY_STRING='x=1',
+                                   **{key: '/a%2Fb%20c%7e?x=1'})
+            eq_(environ_url(environ),
+                ParsedURL('/a%2Fb%20c%7e?x=1', 'localhost', '8000'))
+
+    def test_raw_uri_matches_sender_url(self):
+        url = 'https://site.com/a%2fb%7E?q=%2F'
+        resource = Resource(url=url, method='GET', credentials=self.creds(),
+                            nonce='x', timestamp=1)
+        environ = self.environ(HTTP_HOST='site.com', PATH_INFO='/a/b~',
+                               QUERY_STRING='q=%2F',
+                               RAW_URI='/a%2fb%7E?q=%2F',
+                               **{'wsgi.url_scheme': 'https'})
+        eq_(environ_url(environ),
+            ParsedURL(resource.name, resource.host, resource.port))
+
+    def test_absolute_raw_uri_is_ignored(self):
+        environ = self.environ(REQUEST_URI='http://localhost:8000/foo')
+        eq_(environ_url(environ), ParsedURL('/foo', 'localhost', '8000'))
+
+    def test_matches_sender_url(self):
+        url = 'https://site.com/foo/bar?a=1'
+        resource = Resource(url=url, method='GET', credentials=self.creds(),
+                            nonce='x', timestamp=1)
+        eq_(environ_url(self.environ(HTTP_HOST='site.com',
+                                     PATH_INFO='/foo/bar',
+                                     QUERY_STRING='a=1',
+                                     **{'wsgi.url_scheme': 'https'})),
+            ParsedURL(resource.name, resource.host, resource.port))
+
+    def creds(self):
+        return {'id': 'id', 'key': 'key', 'algorithm': 'sha256'}
+
+
+class TestHashingInput(TestCase):
+
+    def stream(self, body=b'line 1\nline 2\n', length=None, on_eof=None):
+        self.hasher = PayloadHasher('sha256', 'text/plain')
+        if length is None:
+            length = len(body)
+        return HashingInput(io.BytesIO(body + b'not the body'), self.hasher,
+                            length, on_eof=on_eof)
+
+    def test_read(self):
+        stream = self.stream()
+        eq_(stream.read(), b'line 1\nline 2\n')
+        assert stream.done
+        eq_(stream.read(), b'')
+        eq_(self.hasher.finalize(),
+            calculate_payload_hash(b'line 1\nline 2\n', 'sha256',
+                                   'text/plain'))
+
+    def test_read_in_chunks(self):
+        stream = self.stream()
+        eq_(stream.read(4), b'line')
+        assert not stream.done
+        eq_(stream.read(100), b' 1\nline 2\n')
+        assert stream.done
+
+    def test_readline(self):
+        stream = self.stream()
+        eq_(list(stream), [b'line 1\n', b'line 2\n'])
+        assert stream.done
+
+    def test_readlines(self):
+        eq_(self.stream().readlines(), [b'line 1\n', b'line 2\n'])
+
+    def test_unknown_length(self):
+        stream = HashingInput(io.BytesIO(b'body'),
+                              PayloadHasher('sha256', ''), None)
+        eq_(stream.read(2), b'bo')
+        eq_(stream.read(2), b'dy')
+        assert not stream.done
+        eq_(stream.read(2), b'')
+        assert stream.done
+
+    def test_on_eof_error(self):
+        def on_eof():
+            raise MisComputedContentHash()
+
+        stream = self.stream(on_eof=on_eof)
+        stream.read(4)
+        with self.assertRaises(MisComputedContentHash):
+            stream.read()
+        eq_(type(stream.error), MisComputedContentHash)
+
+    def test_drain(self):
+        calls = []
+        stream = self.stream(on_eof=lambda: calls.append(1))
+        stream.drain(block_size=3)
+        eq_(calls, [1])
+        eq_(self.hasher.length, 14)
+
+    def test_empty(self):
+        calls = []
+        stream = self.stream(b'', on_eof=lambda: calls.append(1))
+        eq_(stream.read(), b'')
+        eq_(calls, [1])
+
+
+class TestWSGIMiddleware(Base):
+
+    def setUp(self):
+        super(TestWSGIMiddleware, self).setUp()
+        self.url = 'https://my-site.com/foo?bar=1'
+        self.nonces = set()
+
+    def seen(self, id, nonce, ts):
+        if (id, nonce, ts) in self.nonces:
+            return True
+        self.nonces.add((id, nonce, ts))
+        return False
+
+    def sender(self, content=b'hello world', content_type='text/plain',
+               **kw):
+        return Sender(self.credentials, self.url, 'POST', content=content,
+                      content_type=content_type, **kw)
+
+    def call(self, app, header, body=b'hello world',
+             content_type='text/plain'):
+        environ = {'REQUEST_METHOD': 'POST', 'wsgi.url_scheme': 'https',
+                   'HTTP_HOST': 'my-site.com', 'SCRIPT_NAME': '',
+                   'PATH_INFO': '/foo', 'QUERY_STRING': 'bar=1',
+                   'CONTENT_LENGTH': str(len(body)),
+                   'wsgi.input': io.BytesIO(body)}
+        if header:
+            environ['HTTP_AUTHORIZATION'] = header
+        if content_type:
+            environ['CONTENT_TYPE'] = content_type
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started.append((status, dict(headers)))
+
+        middleware = WSGIMiddleware(app, self.credentials_map,
+                                    seen_nonce=self.seen)
+        body = b''.join(middleware(environ, start_response))
+        eq_(len(started), 1)
+        self.environ = environ
+        return started[0][0], started[0][1], body
+
+    def test_echo(self):
+        sn = self.sender()
+        status, headers, body = self.call(wsgi_echo_app, sn.request_header)
+        eq_(status, '200 OK')
+        eq_(body, b'hello world')
+        sn.accept_response(headers['Server-Authorization'],
+                           content=body, content_type='text/plain')
+        eq_(self.environ['hawk'].resource.credentials['id'], 'my-hawk-id')
+
+    def test_missing_authorization(self):
+        status, headers, body = self.call(wsgi_echo_app, None)
+        eq_(status, '401 Unauthorized')
+        eq_(headers['WWW-Authenticate'], 'Hawk')
+
+    def test_mac_mismatch(self):
+        self.url = 'https://my-site.com/other'
+        status, headers, body = self.call(wsgi_echo_app,
+                                          self.sender().request_header)
+        eq_(status, '401 Unauthorized')
+
+    def test_malformed_authorization(self):
+        for header in ('Hawk', 'Hawk mac="x"', 'Hawk id="a", mac="x"',
+                       'Hawk id="my-hawk-id", ts="1", mac="x"'):
+            status, headers, body = self.call(wsgi_echo_app, header)
+            eq_(status, '401 Unauthorized', header)
+            eq_(headers['WWW-Authenticate'], 'Hawk')
+
+    def test_expired(self):
+        sn = self.sender(_timestamp=utc_now() - 120)
+        status, headers, body = self.call(wsgi_echo_app, sn.request_header)
+        eq_(status, '401 Unauthorized')
+        assert headers['WWW-Authenticate'].startswith('Hawk ts=')
+
+    def test_replay(self):
+        sn = self.sender()
+        self.call(wsgi_echo_app, sn.request_header)
+        status, headers, body = self.call(wsgi_echo_app, sn.request_header)
+        eq_(status, '401 Unauthorized')
+
+    def test_tampered_body(self):
+        sn = self.sender()
+        status, headers, body = self.call(wsgi_echo_app, sn.request_header,
+                                          body=b'hello TAMPER')
+        eq_(status, '401 Unauthorized')
+
+    def test_tampered_body_error_handled_by_app(self):
+        def app(environ, start_response):
+            try:
+                return wsgi_echo_app(environ, start_response)
+            except MisComputedContentHash:
+                return wsgi_lazy_app(environ, start_response)
+
+        sn = self.sender()
+        status, headers, body = self.call(app, sn.request_header,
+                                          body=b'hello TAMPER')
+        eq_(status, '401 Unauthorized')
+
+    def test_tampered_body_not_read_by_app(self):
+        sn = self.sender()
+        status, headers, body = self.call(wsgi_lazy_app, sn.request_header,
+                                          body=b'hello TAMPER')
+        eq_(status, '401 Unauthorized')
+
+    def test_body_not_read_by_app(self):
+        sn = self.sender()
+        status, headers, body = self.call(wsgi_lazy_app, sn.request_header)
+        eq_(status, '200 OK')
+        eq_(body, b'ok')
+
+    def test_empty_body(self):
+        sn = self.sender(content=b'', content_type='')
+        status, headers, body = self.call(wsgi_echo_app, sn.request_header,
+                                          body=b'', content_type=None)
+        eq_(status, '200 OK')
+
+    def test_write_callable(self):
+        def app(environ, start_response):
+            write = start_response('200 OK', [('Content-Type', 'text/plain')])
+            write(b'hello ')
+            return [b'world']
+
+        sn = self.sender()
+        status, headers, body = self.call(app, sn.request_header)
+        eq_(body, b'hello world')
+        sn.accept_response(headers['Server-Authorization'],
+                           content=body, content_type='text/plain')
+
+
+class HawkServer(object):
+    # Verifies signed requests and signs responses like a server would.
+
+    def __init__(self, test, content=b'ok', content_type='text/plain',
+                 sign=True, tamper=False, localtime_offset_in_seconds=0):
+        self.test = test
+        self.content = content
+        self.content_type = content_type
+        self.sign = sign
+        self.tamper = tamper
+        self.localtime_offset_in_seconds = localtime_offset_in_seconds
+        self.requests = []
+        self.rejected = 0
+
+    def __call__(self, header, url, method, content, content_type):
+        try:
+            receiver = Receiver(
+                self.test.credentials_map, header, url, method,
+                content=content, content_type=content_type,
+                localtime_offset_in_seconds=self.localtime_offset_in_seconds)
+        except TokenExpired:
+            etype, exc, tb = sys.exc_info()
+            self.rejected += 1
+            return 401, {'WWW-Authenticate': exc.www_authenticate}, b''
+        self.requests.append((receiver, content))
+        headers = {'Content-Type': self.content_type}
+        if self.sign:
+            headers['Server-Authorization'] = receiver.respond(
+                content=self.content, content_type=self.content_type)
+        content = self.content
+        if self.tamper:
+            content = b'TAMPERED'
+        return 200, headers, content
+
+
+class HawkAdapter(BaseAdapter):
+    # A requests transport that sends requests to a HawkServer.
+
+    def __init__(self, server):
+        super(HawkAdapter, self).__init__()
+        self.server = server
+
+    def send(self, request, **kw):
+        body = request.body
+        if hasattr(body, 'read'):
+            body = body.read()
+        elif body is not None and not isinstance(body, six.binary_type):
+            body = b''.join(body)
+        status, headers, content = self.server(
+            request.headers['Authorization'], request.url, request.method,
+            body or b'', request.headers.get('Content-Type', ''))
+        response = requests.models.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response._content = content
+        response.request = request
+        response.url = request.url
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+
+@skipIf(requests is None, 'requests is not installed')
+class TestRequestsHawkAuth(Base):
+
+    def session(self, **kw):
+        self.server = HawkServer(self, **kw)
+        session = requests.Session()
+        session.mount('https://', HawkAdapter(self.server))
+        return session
+
+    def test_get(self):
+        auth = RequestsHawkAuth(self.credentials)
+        response = self.session().get('https://site.com/foo?bar=1',
+                                      auth=auth)
+        eq_(response.content, b'ok')
+        receiver, content = self.server.requests[0]
+        eq_(receiver.resource.name, '/foo?bar=1')
+
+    def test_post(self):
+        session = self.session()
+        session.auth = RequestsHawkAuth(self.credentials)
+        session.post('https://site.com/', data=b'hello',
+                     headers={'Content-Type': 'text/plain'})
+        eq_(self.server.requests[0][1], b'hello')
+
+    def test_file_body(self):
+        session = self.session()
+        body = io.BytesIO(b'xhello')
+        body.read(1)
+        session.post('https://site.com/', data=body,
+                     headers={'Content-Type': 'text/plain'},
+                     auth=RequestsHawkAuth(self.credentials, block_size=2))
+        eq_(self.server.requests[0][1], b'hello')
+
+    def test_generator_body(self):
+        session = self.session()
+        session.post('https://site.com/', data=(c for c in [b'hel', b'lo']),
+                     headers={'Content-Type': 'text/plain'},
+                     auth=RequestsHawkAuth(self.credentials))
+        eq_(self.server.requests[0][1], b'hello')
+
+    @raises(MisComputedContentHash)
+    def test_tampered_response(self):
+        self.session(tamper=True).get(
+            'https://site.com/', auth=RequestsHawkAuth(self.credentials))
+
+    @raises(MissingAuthorization)
+    def test_unsigned_response(self):
+        self.session(sign=False).get(
+            'https://site.com/', auth=RequestsHawkAuth(self.credentials))
+
+    @raises(MissingAuthorization)
+    def test_require_response_signature(self):
+        auth = RequestsHawkAuth(self.credentials,
+                                require_response_signature=True)
+        self.session(sign=False).get('https://site.com/', auth=auth)
+
+    def test_allow_unsigned_response(self):
+        auth = RequestsHawkAuth(self.credentials,
+                                require_response_signature=False)
+        response = self.session(sign=False).get('https://site.com/',
+                                                auth=auth)
+        eq_(response.content, b'ok')
+
+    def test_no_response_verification(self):
+        auth = RequestsHawkAuth(self.credentials, verify_response=False)
+        self.session(tamper=True).get('https://site.com/', auth=auth)
+
+    def test_url_cache(self):
+        session = self.session()
+        session.auth = RequestsHawkAuth(self.credentials)
+        session.get('https://site.com/foo')
+        session.get('https://site.com/foo')
+        eq_(session.auth._urls.hits, 1)
+
+    def test_clock_offset_retry(self):
+        session = self.session(localtime_offset_in_seconds=600)
+        session.auth = RequestsHawkAuth(self.credentials,
+                                        clock_offsets=ClockOffsetTracker())
+        body = io.BytesIO(b'hello')
+        response = session.post('https://site.com/', data=body,
+                                headers={'Content-Type': 'text/plain'})
+        eq_(response.status_code, 200)
+        eq_(response.content, b'ok')
+        eq_([r.status_code for r in response.history], [401])
+        eq_(self.server.requests[0][1], b'hello')
+
+        # Later requests use the server's time straight away.
+        session.get('https://site.com/')
+        eq_(self.server.rejected, 1)
+
+    def test_clock_offset_without_tracker(self):
+        session = self.session(localtime_offset_in_seconds=600)
+        session.auth = RequestsHawkAuth(self.credentials)
+        eq_(session.get('https://site.com/').status_code, 401)
+
+
+@skipIf(httpx is None, 'httpx is not installed')
+class TestHttpxHawkAuth(Base):
+
+    def client(self, auth, **kw):
+        self.server = HawkServer(self, **kw)
+
+        def handler(request):
+            status, headers, content = self.server(
+                request.headers['Authorization'], str(request.url),
+                request.method, request.read(),
+                request.headers.get('Content-Type', ''))
+            return httpx.Response(status, headers=headers, content=content)
+
+        client = httpx.Client(auth=auth,
+                              transport=httpx.MockTransport(handler))
+        self.addCleanup(client.close)
+        return client
+
+    def test_get(self):
+        client = self.client(HttpxHawkAuth(self.credentials))
+        eq_(client.get('https://site.com/foo?bar=1').content, b'ok')
+        eq_(self.server.requests[0][0].resource.name, '/foo?bar=1')
+
+    def test_post(self):
+        client = self.client(HttpxHawkAuth(self.credentials))
+        client.post('https://site.com/', content=b'hello',
+                    headers={'Content-Type': 'text/plain'})
+        eq_(self.server.requests[0][1], b'hello')
+
+    @raises(MisComputedContentHash)
+    def test_tampered_response(self):
+        self.client(HttpxHawkAuth(self.credentials),
+                    tamper=True).get('https://site.com/')
+
+    @raises(MissingAuthorization)
+    def test_require_response_signature(self):
+        auth = HttpxHawkAuth(self.credentials,
+                             require_response_signature=True)
+        self.client(auth, sign=False).get('https://site.com/')
+
+    @raises(MissingAuthorization)
+    def test_unsigned_response(self):
+        self.client(HttpxHawkAuth(self.credentials),
+                    sign=False).get('https://site.com/')
+
+    def test_allow_unsigned_response(self):
+        auth = HttpxHawkAuth(self.credentials,
+                             require_response_signature=False)
+        eq_(self.client(auth, sign=False).get('https://site.com/').content,
+            b'ok')
+
+    def test_rejected_request(self):
+        client = self.client(HttpxHawkAuth(self.credentials),
+                             localtime_offset_in_seconds=600)
+        eq_(client.get('https://site.com/').status_code, 401)
+
+    def test_url_cache(self):
+        auth = HttpxHawkAuth(self.credentials)
+        client = self.client(auth)
+        client.get('https://site.com/foo')
+        client.get('https://site.com/foo')
+        eq_(auth._urls.hits, 1)
+
+    def test_clock_offset_retry(self):
+        auth = HttpxHawkAuth(self.credentials,
+                             clock_offsets=ClockOffsetTracker())
+        client = self.client(auth, localtime_offset_in_seconds=-600)
+        response = client.post('https://site.com/', content=b'hello',
+                               headers={'Content-Type': 'text/plain'})
+        eq_(response.status_code, 200)
+        eq_([r.status_code for r in response.history], [401])
+        client.get('https://site.com/')
+        eq_(self.server.rejected, 1)
+
+
 class TestBewit(Base):
 
     # Test cases copied from
@@ -958,6 +2896,43 @@ class TestBewit(Base):
                        timestamp=1356420407 + 300, nonce='')
         get_bewit(res)
 
+    def test_get_bewits(self):
+        urls = ['https://example.com/somewhere/over/the/rainbow',
+                'https://example.com:8080/somewhere/over/the/rainbow',
+                'https://example.com/rainbow?color=red']
+        bewit_urls = list(get_bewits(self.credentials, 1356420707, urls,
+                                     ext='xandyandz'))
+
+        eq_(len(bewit_urls), len(urls))
+        for url, bewit_url in zip(urls, bewit_urls):
+            res = Resource(url=url, method='GET',
+                           credentials=self.credentials,
+                           timestamp=1356420707, nonce='', ext='xandyandz')
+            sep = '&' if '?' in url else '?'
+            eq_(bewit_url, '{url}{sep}bewit={bewit}'.format(
+                url=url, sep=sep, bewit=get_bewit(res)))
+            self.assertTrue(check_bewit(
+                bewit_url, self.make_credential_lookup({'123456':
+                                                        self.credentials}),
+                now=1356420407))
+
+    def test_get_bewits_keeps_fragment(self):
+        url, = get_bewits(self.credentials, 1356420707,
+                          ['https://example.com/rainbow#colors'])
+        res = Resource(url='https://example.com/rainbow', method='GET',
+                       credentials=self.credentials,
+                       timestamp=1356420707, nonce='')
+        eq_(url, 'https://example.com/rainbow?bewit={bewit}#colors'
+            .format(bewit=get_bewit(res)))
+
+    def test_get_bewits_without_urls(self):
+        eq_(list(get_bewits(self.credentials, 1356420707, [])), [])
+
+    @raises(BadHeaderValue)
+    def test_get_bewits_with_invalid_ext(self):
+        next(get_bewits(self.credentials, 1356420707,
+                        ['https://example.com/rainbow'], ext='xand\\yandz'))
+
     def test_strip_bewit(self):
         bewit = b'123456\\1356420707\\IGYmLgIqLrCe8CxvKPs4JlWIA+UjWJJouwgARiVhCAg=\\'
         bewit = urlsafe_b64encode(bewit).decode('ascii')
@@ -1026,6 +3001,25 @@ class TestBewit(Base):
         })
         self.assertTrue(check_bewit(url, credential_lookup=credential_lookup, now=1356420407 + 10))
 
+    def test_validate_bewit_does_not_compile_dict_credentials(self):
+        credential_lookup = self.make_credential_lookup({
+            self.credentials['id']: self.credentials,
+        })
+        with mock.patch('mohawk.bewit.compile_credentials') as compile_:
+            self.assertTrue(check_bewit(self.make_bewit_url(),
+                                        credential_lookup=credential_lookup,
+                                        now=1356420407 + 10))
+        eq_(compile_.call_count, 0)
+
+    def test_validate_bewit_with_compiled_credentials(self):
+        bewit = b'123456\\1356420707\\IGYmLgIqLrCe8CxvKPs4JlWIA+UjWJJouwgARiVhCAg=\\'
+        bewit = urlsafe_b64encode(bewit).decode('ascii')
+        url = "https://example.com/somewhere/over/the/rainbow?bewit={bewit}".format(bewit=bewit)
+        credential_lookup = self.make_credential_lookup({
+            self.credentials['id']: compile_credentials(self.credentials),
+        })
+        self.assertTrue(check_bewit(url, credential_lookup=credential_lookup, now=1356420407 + 10))
+
     @raises(InvalidBewit)
     def test_validate_bewit_with_ext_and_backslashes(self):
         bewit = b'123456\\1356420707\\b82LLIxG5UDkaChLU953mC+SMrbniV1sb8KiZi9cSsc=\\xand\\yandz'
@@ -1056,6 +3050,446 @@ class TestBewit(Base):
         })
         check_bewit(url, credential_lookup=credential_lookup, now=1356420407 + 10)
 
+    def make_bewit_url(self, url='https://example.com/somewhere/over/the/rainbow'):
+        bewit = b'123456\\1356420707\\IGYmLgIqLrCe8CxvKPs4JlWIA+UjWJJouwgARiVhCAg=\\'
+        bewit = urlsafe_b64encode(bewit).decode('ascii')
+        return "{url}?bewit={bewit}".format(url=url, bewit=bewit)
+
+    def test_validate_bewit_with_parsed_url(self):
+        name, host, port = split_url(self.make_bewit_url())
+        credential_lookup = self.make_credential_lookup({
+            self.credentials['id']: self.credentials,
+        })
+        self.assertTrue(check_bewit(ParsedURL(name, host, port),
+                                    credential_lookup=credential_lookup,
+                                    now=1356420407 + 10))
+
+    @raises(MacMismatch)
+    def test_validate_bewit_with_other_parsed_url(self):
+        name, host, port = split_url(self.make_bewit_url())
+        credential_lookup = self.make_credential_lookup({
+            self.credentials['id']: self.credentials,
+        })
+        check_bewit(ParsedURL(name, host, '8080'),
+                    credential_lookup=credential_lookup,
+                    now=1356420407 + 10)
+
+    def test_validate_expired_bewit_within_skew(self):
+        credential_lookup = self.make_credential_lookup({
+            self.credentials['id']: self.credentials,
+        })
+        self.assertTrue(check_bewit(self.make_bewit_url(),
+                                    credential_lookup=credential_lookup,
+                                    now=1356420707 + 60,
+                                    timestamp_skew_in_seconds=60))
+
+    @raises(TokenExpired)
+    def test_validate_expired_bewit_past_skew(self):
+        credential_lookup = self.make_credential_lookup({
+            self.credentials['id']: self.credentials,
+        })
+        check_bewit(self.make_bewit_url(),
+                    credential_lookup=credential_lookup,
+                    now=1356420707 + 61,
+                    timestamp_skew_in_seconds=60)
+
+    @raises(TokenExpired)
+    def test_validate_bewit_with_localtime_offset(self):
+        credential_lookup = self.make_credential_lookup({
+            self.credentials['id']: self.credentials,
+        })
+        with mock.patch('mohawk.util.time.time') as time:
+            time.return_value = 1356420407
+            check_bewit(self.make_bewit_url(),
+                        credential_lookup=credential_lookup,
+                        localtime_offset_in_seconds=301)
+
+    def test_validate_expired_bewit_without_lookup(self):
+        credential_lookup = mock.Mock()
+        try:
+            check_bewit(self.make_bewit_url(),
+                        credential_lookup=credential_lookup,
+                        now=1356420407 + 1000)
+        except TokenExpired:
+            pass
+        else:
+            raise AssertionError('TokenExpired not raised')
+        eq_(credential_lookup.call_count, 0)
+
+    @raises(InvalidBewit)
+    def test_validate_bewit_with_invalid_expiration(self):
+        bewit = b'123456\\soon\\IGYmLgIqLrCe8CxvKPs4JlWIA+UjWJJouwgARiVhCAg=\\'
+        bewit = urlsafe_b64encode(bewit).decode('ascii')
+        url = "https://example.com/somewhere/over/the/rainbow?bewit={bewit}".format(bewit=bewit)
+        check_bewit(url, credential_lookup=mock.Mock(),
+                    now=1356420407 + 10)
+
+
+class TestBewitCache(TestCase):
+
+    def setUp(self):
+        self.credentials = {
+            'id': '123456',
+            'key': '2983d45yun89q',
+            'algorithm': 'sha256',
+        }
+        self.lookups = 0
+        self.cache = BewitCache()
+        self.url, = get_bewits(self.credentials, 1356420707,
+                               ['https://example.com/rainbow'])
+
+    def credential_lookup(self, id):
+        self.lookups += 1
+        if id != self.credentials['id']:
+            raise LookupError(id)
+        return self.credentials
+
+    def check(self, url=None, now=1356420407):
+        return check_bewit(url or self.url, self.credential_lookup,
+                           now=now, cache=self.cache)
+
+    def test_hit_skips_mac(self):
+        self.check()
+        with mock.patch('mohawk.bewit.digest_matches') as matches:
+            eq_(self.check(), True)
+        eq_(matches.call_count, 0)
+        eq_(self.cache._cache.hits, 1)
+
+    def test_hit_looks_up_credentials(self):
+        self.check()
+        self.check()
+        eq_(self.lookups, 2)
+
+    @raises(TokenExpired)
+    def test_hit_expires(self):
+        self.check()
+        self.check(now=1356420707 + 1)
+
+    def test_ttl_ends_at_expiration(self):
+        with mock.patch.object(self.cache._cache, 'set') as set_:
+            self.check(now=1356420707 - 60)
+        eq_(set_.call_args[1]['ttl'], 60)
+
+    def test_expired_bewit_is_not_cached(self):
+        try:
+            self.check(now=1356420707 + 1)
+        except TokenExpired:
+            pass
+        eq_(len(self.cache._cache), 0)
+
+    @raises(MacMismatch)
+    def test_changed_key(self):
+        self.check()
+        self.credentials = dict(self.credentials, key='new key')
+        self.check()
+
+    def test_changed_key_discards_entry(self):
+        self.check()
+        self.credentials = dict(self.credentials, key='new key')
+        try:
+            self.check()
+        except MacMismatch:
+            pass
+        eq_(len(self.cache._cache), 0)
+
+    @raises(MacMismatch)
+    def test_changed_algorithm(self):
+        self.check()
+        self.credentials = dict(self.credentials, algorithm='sha1')
+        self.check()
+
+    @raises(CredentialsLookupError)
+    def test_removed_credentials(self):
+        self.check()
+        self.credentials = dict(self.credentials, id='other')
+        self.check()
+
+    @raises(MacMismatch)
+    def test_tampered_url_misses(self):
+        self.check()
+        self.check(self.url.replace('rainbow', 'rain'))
+
+    def test_invalid_bewit_is_not_cached(self):
+        url = self.url.replace('rainbow', 'rain')
+        for attempt in range(2):
+            try:
+                self.check(url)
+            except MacMismatch:
+                pass
+        eq_(len(self.cache._cache), 0)
+
+    def test_hit_with_compiled_credentials(self):
+        self.credentials = compile_credentials(self.credentials)
+        self.check()
+        with mock.patch('hmac.new') as new, \
+                mock.patch('mohawk.util.Credentials.mac') as mac:
+            eq_(self.check(), True)
+        eq_(new.call_count, 0)
+        eq_(mac.call_count, 0)
+
+    def test_key_is_not_stored(self):
+        self.check()
+        entry = self.cache._cache.peek(next(iter(self.cache._cache._data)))
+        for value in entry:
+            assert value != self.credentials['key']
+            assert value != self.credentials['key'].encode('ascii')
+        assert self.credentials['key'] not in repr(entry)
+
+    def test_clear(self):
+        self.check()
+        self.cache.clear()
+        self.check()
+        eq_(self.cache._cache.hits, 0)
+
+
+class TestTracing(Base):
+
+    def setUp(self):
+        super(TestTracing, self).setUp()
+        self.url = 'http://site.com/foo?bar=1'
+        self.log = logging.getLogger('mohawk')
+        self.level = self.log.level
+        self.addCleanup(self.log.setLevel, self.level)
+
+    def mismatched_receive(self):
+        class NoRepr(str):
+            def __repr__(self):
+                raise AssertionError('content was formatted')
+
+        sn = Sender(self.credentials, self.url, 'POST',
+                    content='foo', content_type='text/plain')
+        Receiver(self.credentials_map, sn.request_header, self.url, 'POST',
+                 content=NoRepr('TAMPERED'), content_type='text/plain',
+                 seen_nonce=self.seen_nonce)
+
+    @raises(MisComputedContentHash)
+    def test_no_formatting_when_disabled(self):
+        self.log.setLevel(logging.INFO)
+        with mock.patch('pprint.pformat') as pformat:
+            pformat.side_effect = AssertionError('pformat was called')
+            self.mismatched_receive()
+
+    def test_formatting_when_enabled(self):
+        self.log.setLevel(logging.DEBUG)
+        records = []
+        handler = logging.Handler()
+        handler.emit = lambda record: records.append(record.getMessage())
+        self.log.addHandler(handler)
+        self.addCleanup(self.log.removeHandler, handler)
+
+        Resource(url=self.url, method='GET', credentials=self.credentials)
+
+        assert any('parsed URL parts' in msg and "host='site.com'"
+                   in msg for msg in records), records
+
+
+class TestURLCache(Base):
+
+    def setUp(self):
+        super(TestURLCache, self).setUp()
+        configure_url_cache(8)
+        self.addCleanup(configure_url_cache, 1024)
+
+    def test_split_url(self):
+        eq_(split_url('https://Site.com/foo?bar=1'),
+            ParsedURL('/foo?bar=1', 'site.com', '443'))
+        eq_(split_url('http://site.com:8080'),
+            ParsedURL('', 'site.com', '8080'))
+
+    def test_stats(self):
+        split_url('http://site.com/')
+        split_url('http://site.com/')
+        split_url('http://site.com/other')
+        stats = url_cache_stats()
+        eq_((stats.size, stats.maxsize, stats.hits, stats.misses),
+            (2, 8, 1, 2))
+
+    def test_resource_uses_cache(self):
+        url = 'http://site.com/foo'
+        Resource(url=url, method='GET', credentials=self.credentials)
+        with mock.patch('mohawk.base._parse_url') as parse_url:
+            parse_url.side_effect = AssertionError('URL was parsed')
+            res = Resource(url=url, method='GET',
+                           credentials=self.credentials)
+        eq_((res.name, res.host, res.port), ('/foo', 'site.com', '80'))
+
+    def test_eviction(self):
+        for i in range(10):
+            split_url('http://site.com/{i}'.format(i=i))
+        stats = url_cache_stats()
+        eq_((stats.size, stats.evictions), (8, 2))
+
+    def test_disable(self):
+        configure_url_cache(0)
+        split_url('http://site.com/')
+        eq_(split_url('http://site.com/'), ParsedURL('/', 'site.com', '80'))
+        eq_(url_cache_stats().size, 0)
+
+    def test_respond_reuses_parts(self):
+        sn = Sender(self.credentials, 'http://site.com/foo', 'GET',
+                    content='', content_type='')
+        rc = Receiver(self.credentials_map, sn.request_header,
+                      'http://site.com/foo', 'GET', content='',
+                      content_type='')
+        with mock.patch('mohawk.base.split_url') as split:
+            split.side_effect = AssertionError('URL was split')
+            rc.respond(content='', content_type='')
+            sn.accept_response(rc.response_header, content='',
+                               content_type='')
+
+
+class TestCompactObjects(Base):
+
+    def round_trip(self, credentials):
+        url = 'https://site.com/foo?bar=1'
+        sn = Sender(credentials, url, 'POST', content=b'hello',
+                    content_type='text/plain')
+        rc = Receiver(lambda id: credentials, sn.request_header, url, 'POST',
+                      content=b'hello', content_type='text/plain',
+                      seen_nonce=self.seen_nonce)
+        rc.respond(content=b'ok', content_type='text/plain')
+        sn.accept_response(rc.response_header, content=b'ok',
+                           content_type='text/plain')
+        return sn, rc
+
+    def test_no_instance_dicts(self):
+        sn, rc = self.round_trip(self.credentials)
+        for obj in (sn, rc, sn.req_resource, rc.resource):
+            assert not hasattr(obj, '__dict__'), obj
+
+    def test_positional_resource(self):
+        res = Resource(self.credentials, 'https://site.com/foo', 'get',
+                       b'', 'text/plain', True, 'ext', None, None, 1, 'n')
+        eq_((res.method, res.name, res.ext, res.timestamp, res.nonce),
+            ('GET', '/foo', 'ext', '1', 'n'))
+
+    @skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def test_retained_allocations(self):
+        # Counts what a signed and verified request with its response
+        # keeps allocated, as allocated by Mohawk itself. Temporary
+        # objects are covered by test_peak_allocations.
+        credentials = compile_credentials(self.credentials)
+        for i in range(10):
+            self.round_trip(credentials)
+        gc.collect()
+        package = os.path.dirname(os.path.abspath(__file__))
+        filters = [tracemalloc.Filter(True, os.path.join(package, '*')),
+                   tracemalloc.Filter(False, __file__)]
+
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot().filter_traces(filters)
+            kept = [self.round_trip(credentials) for i in range(50)]
+            after = tracemalloc.take_snapshot().filter_traces(filters)
+        finally:
+            tracemalloc.stop()
+
+        stats = after.compare_to(before, 'filename')
+        blocks = sum(stat.count_diff for stat in stats) / float(len(kept))
+        size = sum(stat.size_diff for stat in stats) / float(len(kept))
+        assert blocks <= 24, 'allocated {0} blocks per round-trip'.format(
+            blocks)
+        assert size <= 2048, 'allocated {0} bytes per round-trip'.format(size)
+
+    @skipIf(not hasattr(tracemalloc, 'reset_peak'),
+            'tracemalloc.reset_peak is not available')
+    def test_peak_allocations(self):
+        # Caps the memory a round trip allocates on top of what it keeps,
+        # which is what creating and dropping temporary objects costs.
+        log = logging.getLogger('mohawk')
+        self.addCleanup(log.setLevel, log.level)
+        log.setLevel(logging.ERROR)
+        credentials = compile_credentials(self.credentials)
+        for i in range(10):
+            self.round_trip(credentials)
+        gc.collect()
+
+        peaks = []
+        tracemalloc.start()
+        try:
+            for i in range(5):
+                start = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                self.round_trip(credentials)
+                peaks.append(tracemalloc.get_traced_memory()[1] - start)
+        finally:
+            tracemalloc.stop()
+
+        peak = min(peaks)
+        assert peak <= 8192, 'allocated {0} bytes at peak per round-trip'.format(
+            peak)
+
+
+class TestDigests(Base):
+
+    def test_strings_match(self):
+        assert strings_match('abc', 'abc')
+        assert strings_match(b'abc', u'abc')
+        assert not strings_match('abc', 'abd')
+        assert not strings_match('abc', 'abcd')
+
+    def test_decode_digest(self):
+        eq_(decode_digest(u'AAEC/w=='), b'\x00\x01\x02\xff')
+        eq_(decode_digest(b'AAEC/w=='), b'\x00\x01\x02\xff')
+
+    def test_decode_invalid_digest(self):
+        for value in (u'AA!EC/w==', u'AAEC/w', u'AAEC\u00e9w==', u'AAEC/w==\n'):
+            eq_(decode_digest(value), None)
+
+    def test_decode_non_canonical_digest(self):
+        # These decode to the same bytes as AAEC/w== but set unused bits.
+        for value in (u'AAEC/x==', u'AAEC/3==', b'AAEC/x=='):
+            eq_(decode_digest(value), None)
+
+    def test_digest_matches(self):
+        digest = b'\x00\x01\x02\xff'
+        assert digest_matches(digest, 'AAEC/w==')
+        assert not digest_matches(digest, 'AAEC/g==')
+        assert not digest_matches(digest, 'AAECAw8=')
+        assert not digest_matches(digest, 'AAEC/x==')
+        assert not digest_matches(None, 'AAEC/w==')
+        assert not digest_matches(digest, '')
+
+    def test_payload_digest(self):
+        hasher = PayloadHasher('sha256', 'text/plain')
+        hasher.update(b'hello')
+        eq_(b64decode(hasher.finalize()), hasher.digest())
+        eq_(hasher.digest(),
+            calculate_payload_digest(b'hello', 'sha256', 'text/plain'))
+        assert hasher.finalized
+
+    def test_resource_content_digest(self):
+        resource = Resource(self.credentials, 'https://site.com/', 'POST',
+                            content=b'hello', content_type='text/plain')
+        eq_(b64decode(resource.gen_content_hash()),
+            resource.gen_content_digest())
+
+    @raises(MacMismatch)
+    def test_mac_with_ignored_characters(self):
+        # Lenient base64 decoding would skip the extra character.
+        url = 'https://site.com/'
+        sender = Sender(self.credentials, url, 'GET', content='',
+                        content_type='')
+        mac = parse_authorization_header(sender.request_header)['mac']
+        header = sender.request_header.replace(
+            'mac="{mac}"'.format(mac=mac), 'mac="!{mac}"'.format(mac=mac))
+        Receiver(self.credentials_map, header, url, 'GET', content='',
+                 content_type='', seen_nonce=self.seen_nonce)
+
+    @raises(MisComputedContentHash)
+    def test_hash_with_ignored_characters(self):
+        url = 'https://site.com/'
+        content = b'hello'
+        hasher = PayloadHasher('sha256', 'text/plain')
+        hasher.update(content)
+        their_hash = '{0}!'.format(hasher.finalize().decode('ascii'))
+        parsed = parse_authorization_header(
+            'Hawk mac="x", hash="{hash}"'.format(hash=their_hash))
+        resource = Resource(self.credentials, url, 'POST', content=content,
+                            content_type='text/plain')
+        Receiver.__new__(Receiver)._check_content_hash(
+            parsed, resource, resource.gen_content_digest())
+
 
 class TestPayloadHash(Base):
     def test_hash_file_read_blocks(self):
@@ -1064,3 +3498,100 @@ class TestPayloadHash(Base):
         payload.seek(0)
         h2 = calculate_payload_hash(payload, 'sha256', 'application/json', block_size=1024)
         self.assertEqual(h1, h2)
+
+    def test_hash_text_file(self):
+        eq_(calculate_payload_hash(six.StringIO(u'hello world'), 'sha256',
+                                   'text/plain', block_size=3),
+            calculate_payload_hash(b'hello world', 'sha256', 'text/plain'))
+
+
+class TestPayloadHasher(Base):
+
+    def setUp(self):
+        super(TestPayloadHasher, self).setUp()
+        self.url = 'http://site.com/foo?bar=1'
+        self.content = b'{"some": "content", "more": "stuff"}'
+        self.content_type = 'application/json; charset=utf-8'
+
+    def hasher(self, chunks=None, algorithm='sha256'):
+        hasher = PayloadHasher(algorithm, self.content_type)
+        if chunks is None:
+            chunks = [self.content[:10], self.content[10:]]
+        hasher.update_from(chunks)
+        return hasher
+
+    def expected_hash(self):
+        return calculate_payload_hash(self.content, 'sha256',
+                                      self.content_type)
+
+    def test_chunks(self):
+        eq_(self.hasher().finalize(), self.expected_hash())
+
+    def test_buffers(self):
+        buf = bytearray(self.content)
+        view = memoryview(buf)
+        eq_(self.hasher([view[:5], bytearray(buf[5:20]), view[20:]])
+            .finalize(), self.expected_hash())
+
+    def test_text(self):
+        eq_(self.hasher([self.content.decode('utf8')]).finalize(),
+            self.expected_hash())
+
+    def test_file(self):
+        hasher = PayloadHasher('sha256', self.content_type)
+        hasher.update_from_file(six.BytesIO(self.content), block_size=7)
+        eq_(hasher.finalize(), self.expected_hash())
+        eq_(hasher.length, len(self.content))
+
+    def test_compiled_credentials(self):
+        hasher = self.hasher(algorithm=compile_credentials(self.credentials))
+        eq_(hasher.algorithm, 'sha256')
+        eq_(hasher.finalize(), self.expected_hash())
+
+    def test_finalize_twice(self):
+        hasher = self.hasher()
+        eq_(hasher.finalize(), hasher.finalize())
+        assert hasher.finalized
+
+    @raises(ValueError)
+    def test_update_after_finalize(self):
+        hasher = self.hasher()
+        hasher.finalize()
+        hasher.update(b'more')
+
+    def test_empty_is_falsy(self):
+        hasher = PayloadHasher('sha256', '')
+        assert not hasher
+        hasher.update(b'x')
+        assert hasher
+
+    def test_send_and_receive(self):
+        sn = Sender(self.credentials, self.url, 'POST',
+                    content=self.hasher())
+        rc = Receiver(self.credentials_map, sn.request_header, self.url,
+                      'POST', content=self.hasher(),
+                      content_type=self.content_type)
+        rc.respond(content=self.hasher())
+        sn.accept_response(rc.response_header, content=self.content,
+                           content_type=self.content_type)
+
+    @raises(MisComputedContentHash)
+    def test_receive_tampered(self):
+        sn = Sender(self.credentials, self.url, 'POST',
+                    content=self.hasher())
+        Receiver(self.credentials_map, sn.request_header, self.url, 'POST',
+                 content=self.hasher([b'TAMPERED']))
+
+    @raises(ValueError)
+    def test_algorithm_mismatch(self):
+        Sender(self.credentials, self.url, 'POST',
+               content=self.hasher(algorithm='sha1'))
+
+    @raises(ValueError)
+    def test_content_type_mismatch(self):
+        Sender(self.credentials, self.url, 'POST',
+               content=self.hasher(), content_type='text/plain')
+
+
+if sys.version_info >= (3, 5):
+    from .aiotests import *
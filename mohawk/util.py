@@ -1,17 +1,23 @@
-from base64 import b64encode, urlsafe_b64encode
-import calendar
+from base64 import b64decode, b64encode, urlsafe_b64encode
+import functools
 import hashlib
 import hmac
 import logging
 import math
 import os
-import pprint
 import re
 import sys
+import threading
 import time
+import weakref
 
 import six
 
+try:
+    from collections.abc import Mapping
+except ImportError:  # Python 2
+    from collections import Mapping
+
 from .exc import (
     BadHeaderValue,
     HawkFail,
@@ -27,6 +33,9 @@ allowable_header_keys = set(['id', 'ts', 'tsm', 'nonce', 'hash',
 
 
 def validate_credentials(creds):
+    if isinstance(creds, Credentials):
+        # Compiled credentials were validated when they were created.
+        return
     if not hasattr(creds, '__getitem__'):
         raise InvalidCredentials('credentials must be a dict-like object')
     try:
@@ -39,80 +48,378 @@ def validate_credentials(creds):
                                  .format(etype=etype, val=val))
 
 
+def compile_credentials(creds):
+    """
+    Returns a :class:`mohawk.util.Credentials` object for a credentials dict.
+
+    Compiled credentials are returned as is.
+    """
+    if isinstance(creds, Credentials):
+        return creds
+    validate_credentials(creds)
+    return Credentials(creds['id'], creds['key'], creds['algorithm'])
+
+
+class Credentials(object):
+    """
+    Compiled, immutable Hawk credentials.
+
+    This holds the same values as a credentials dict but the key is
+    encoded, the digest constructor is resolved and a keyed HMAC is
+    prepared only once. Each message is then signed with a copy of that
+    HMAC. You can pass a ``Credentials`` object anywhere a credentials
+    dict is accepted, such as :class:`mohawk.Sender` or the return value
+    of a ``credentials_map`` callable.
+
+    :param id: Hawk ID of the sender.
+    :type id: str
+
+    :param key: Shared secret. It must be ASCII.
+    :type key: str
+
+    :param algorithm: Name of a :mod:`hashlib` algorithm, such as ``sha256``.
+    :type algorithm: str
+    """
+    __slots__ = ('id', 'key', 'algorithm', 'key_bytes', 'digestmod', '_hmac',
+                 '_fingerprint')
+
+    def __init__(self, id, key, algorithm):
+        try:
+            hashlib.new(algorithm)
+        except (TypeError, ValueError):
+            raise InvalidCredentials('Unknown algorithm: {algo!r}'
+                                     .format(algo=algorithm))
+        digestmod = (getattr(hashlib, algorithm, None) or
+                     functools.partial(hashlib.new, algorithm))
+        key_bytes = key
+        if not isinstance(key_bytes, six.binary_type):
+            key_bytes = key_bytes.encode('ascii')
+
+        init = super(Credentials, self).__setattr__
+        init('id', prepare_header_val(id))
+        init('key', key)
+        init('algorithm', algorithm)
+        init('key_bytes', key_bytes)
+        init('digestmod', digestmod)
+        init('_hmac', hmac.new(key_bytes, digestmod=digestmod))
+        init('_fingerprint', self.mac(_fingerprint_msg))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Credentials are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Credentials are immutable')
+
+    def __getitem__(self, name):
+        if name not in ('id', 'key', 'algorithm'):
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return '<{cls} id={id!r} algorithm={algo!r}>'.format(
+            cls=self.__class__.__name__, id=self.id, algo=self.algorithm)
+
+    def mac(self, msg):
+        """Returns the raw HMAC digest of a byte string."""
+        h = self._hmac.copy()
+        h.update(msg)
+        return h.digest()
+
+
+_fingerprint_msg = b'mohawk.fingerprint\n'
+
+
+def credentials_fingerprint(credentials):
+    """
+    Returns a digest that changes when the key or algorithm of
+    ``credentials`` does, without revealing the key.
+
+    This is computed only once for :class:`mohawk.util.Credentials`.
+    """
+    if isinstance(credentials, Credentials):
+        return credentials._fingerprint
+    return _hmac_digest(credentials, _fingerprint_msg)
+
+
+def _hmac_digest(credentials, msg):
+    if isinstance(credentials, Credentials):
+        return credentials.mac(msg)
+
+    digestmod = getattr(hashlib, credentials['algorithm'])
+    key = credentials['key']
+    if not isinstance(key, six.binary_type):
+        key = key.encode('ascii')
+    return hmac.new(key, msg, digestmod).digest()
+
+
+class NonceSource(object):
+    """
+    Generates random strings from a buffer of :func:`os.urandom` bytes.
+
+    Random bytes are read ``block_size`` at a time and base64 encoded,
+    so that most strings don't need a system call of their own.
+    This is thread-safe because each thread has a buffer of its own.
+    A forked child process throws away the buffers it inherited so that
+    it never hands out the same strings as its parent.
+
+    :param block_size=3072: Number of random bytes to read at a time.
+    :type block_size=3072: int
+    """
+
+    def __init__(self, block_size=3072):
+        # Whole groups of 3 bytes encode to base64 without any padding.
+        self.block_size = max(3, block_size - block_size % 3)
+        self._reseed()
+        _nonce_sources.add(self)
+
+    def _reseed(self):
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def random_string(self, length):
+        """Returns a random base64 byte string of ``length`` characters."""
+        if _check_pid and self._pid != os.getpid():
+            self._reseed()
+        local = self._local
+        try:
+            buffer = local.buffer
+            start = local.pos
+        except AttributeError:  # The first string of this thread.
+            buffer = b''
+            start = 0
+        end = start + length
+        if end > len(buffer):
+            # Each base64 character carries 6 random bits.
+            size = max(self.block_size, -(-length // 4) * 3)
+            buffer = local.buffer = urlsafe_b64encode(os.urandom(size))
+            start, end = 0, length
+        local.pos = end
+        return buffer[start:end]
+
+
+_nonce_sources = weakref.WeakSet()
+
+
+def _reseed_nonce_sources():
+    for source in list(_nonce_sources):
+        source._reseed()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reseed_nonce_sources)
+    _check_pid = False
+else:  # Python < 3.7
+    _check_pid = True
+
+_default_nonce_source = NonceSource()
+
+
 def random_string(length):
     """Generates a random string for a given length."""
-    # this conservatively gets 8*length bits and then returns 6*length of
-    # them. Grabbing (6/8)*length bits could lose some entropy off the ends.
-    return urlsafe_b64encode(os.urandom(length))[:length]
+    return _default_nonce_source.random_string(length)
+
+
+def calculate_payload_hash(payload, algorithm, content_type,
+                           block_size=64 * 1024):
+    """
+    Calculates a hash for a given payload.
 
+    ``payload`` can be a byte string or a file-like object that will be
+    read in chunks of ``block_size`` bytes.
+    ``algorithm`` is the name of a :mod:`hashlib` algorithm or a
+    :class:`mohawk.util.Credentials` object.
+    """
+    return _hash_payload(payload, algorithm, content_type,
+                         block_size).finalize()
+
+
+def calculate_payload_digest(payload, algorithm, content_type,
+                             block_size=64 * 1024):
+    """
+    Like :func:`calculate_payload_hash` but returns the raw digest.
+    """
+    return _hash_payload(payload, algorithm, content_type,
+                         block_size).digest()
+
+
+def _hash_payload(payload, algorithm, content_type, block_size):
+    hasher = PayloadHasher(algorithm, content_type)
+    if hasattr(payload, 'read'):
+        log.debug('payload being handled as a file object')
+        hasher.update_from_file(payload, block_size=block_size)
+    elif payload:
+        hasher.update(payload)
+    return hasher
+
+
+class PayloadHasher(object):
+    """
+    Calculates a payload hash incrementally.
+
+    This lets you hash a body while it is being received or sent instead of
+    buffering it first. Pass the hasher as the ``content`` argument of
+    :class:`mohawk.Sender`, :class:`mohawk.Receiver` or
+    :meth:`mohawk.Receiver.respond` to use the hash it calculated.
 
-def calculate_payload_hash(payload, algorithm, content_type, block_size=1024):
-    """Calculates a hash for a given payload."""
-    p_hash = hashlib.new(algorithm)
+    Example::
 
-    parts = []
-    parts.append('hawk.' + str(HAWK_VER) + '.payload\n')
-    parts.append(parse_content_type(content_type) + '\n')
-    parts.append(payload or '')
-    parts.append('\n')
+        hasher = PayloadHasher('sha256', 'application/json')
+        for chunk in body:
+            hasher.update(chunk)
+        sender = Sender(credentials, url, 'POST', content=hasher)
 
-    for i, p in enumerate(parts):
-        # Make sure we are about to hash binary strings.
-        if hasattr(p, "read"):
-            log.debug("part %i being handled as a file object", i)
+    Like an empty body, a hasher is falsy until some content was added.
+
+    :param algorithm:
+        Name of a :mod:`hashlib` algorithm or a
+        :class:`mohawk.util.Credentials` object.
+    :type algorithm: str
+
+    :param content_type: content-type header value of the payload.
+    :type content_type: str
+    """
+    __slots__ = ('algorithm', 'content_type', 'length', '_hash', '_digest')
+
+    def __init__(self, algorithm, content_type):
+        if isinstance(algorithm, Credentials):
+            self._hash = algorithm.digestmod()
+            algorithm = algorithm.algorithm
+        else:
+            self._hash = hashlib.new(algorithm)
+        self.algorithm = algorithm
+        self.content_type = content_type
+        #: Number of payload bytes hashed so far.
+        self.length = 0
+        self._digest = None
+
+        content_type = parse_content_type(content_type)
+        if not isinstance(content_type, six.binary_type):
+            content_type = content_type.encode('utf8')
+        self._hash.update(b'hawk.' + str(HAWK_VER).encode('ascii') +
+                          b'.payload\n' + content_type + b'\n')
+
+    def __bool__(self):
+        return self.length > 0
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return ('<{cls} algorithm={algo!r} content_type={typ!r} '
+                'length={length}>'.format(cls=self.__class__.__name__,
+                                          algo=self.algorithm,
+                                          typ=self.content_type,
+                                          length=self.length))
+
+    def update(self, chunk):
+        """
+        Adds a chunk of the payload.
+
+        ``chunk`` can be a byte string or any object supporting the buffer
+        protocol, such as a ``bytearray`` or ``memoryview``, which is hashed
+        without being copied. Text is encoded as UTF-8.
+        """
+        if self._digest is not None:
+            raise ValueError('Cannot update a finalized payload hash')
+        if isinstance(chunk, six.text_type):
+            chunk = chunk.encode('utf8')
+        self._hash.update(chunk)
+        if isinstance(chunk, memoryview):
+            self.length += chunk.nbytes
+        else:
+            self.length += len(chunk)
+
+    def update_from(self, chunks):
+        """Adds each chunk of an iterable to the payload."""
+        for chunk in chunks:
+            self.update(chunk)
+
+    def update_from_file(self, fileobj, block_size=64 * 1024):
+        """
+        Reads a file-like object until EOF and adds it to the payload.
+
+        Binary files that support ``readinto()`` are read into a single
+        reusable buffer.
+        """
+        readinto = getattr(fileobj, 'readinto', None)
+        if readinto is None:
             while True:
-                block = p.read(block_size)
+                block = fileobj.read(block_size)
                 if not block:
                     break
-                p_hash.update(block)
-        elif not isinstance(p, six.binary_type):
-            p = p.encode('utf8')
-            p_hash.update(p)
-        else:
-            p_hash.update(p)
-        parts[i] = p
-
-    log.debug('calculating payload hash from:\n{parts}'
-              .format(parts=pprint.pformat(parts)))
-
-    return b64encode(p_hash.digest())
+                self.update(block)
+            return
+
+        buf = bytearray(block_size)
+        view = memoryview(buf)
+        while True:
+            size = readinto(buf)
+            if not size:
+                break
+            self.update(view[:size])
+
+    @property
+    def finalized(self):
+        """True when :meth:`finalize` has been called."""
+        return self._digest is not None
+
+    def finalize(self):
+        """
+        Returns the base64 encoded payload hash.
+
+        No more content can be added after this. Calling it again returns
+        the same hash.
+        """
+        return b64encode(self.digest())
+
+    def digest(self):
+        """
+        Returns the raw payload hash.
+
+        Like :meth:`finalize`, this ends the payload.
+        """
+        if self._digest is None:
+            self._hash.update(b'\n')
+            self._digest = self._hash.digest()
+            log.debug('calculated payload hash over %d byte(s) '
+                      'of content-type %r', self.length, self.content_type)
+        return self._digest
 
 
 def calculate_mac(mac_type, resource, content_hash):
     """Calculates a message authorization code (MAC)."""
+    return b64encode(calculate_mac_digest(mac_type, resource, content_hash))
+
+
+def calculate_mac_digest(mac_type, resource, content_hash):
+    """Like :func:`calculate_mac` but returns the raw digest."""
     normalized = normalize_string(mac_type, resource, content_hash)
-    log.debug(u'normalized resource for mac calc: {norm}'
-              .format(norm=normalized))
-    digestmod = getattr(hashlib, resource.credentials['algorithm'])
+    log.debug(u'normalized resource for mac calc: %s', normalized)
 
     # Make sure we are about to hash binary strings.
 
     if not isinstance(normalized, six.binary_type):
         normalized = normalized.encode('utf8')
-    key = resource.credentials['key']
-    if not isinstance(key, six.binary_type):
-        key = key.encode('ascii')
 
-    result = hmac.new(key, normalized, digestmod)
-    return b64encode(result.digest())
+    return _hmac_digest(getattr(resource, '_mac_credentials', None) or
+                        resource.credentials, normalized)
 
 
 def calculate_ts_mac(ts, credentials):
     """Calculates a message authorization code (MAC) for a timestamp."""
     normalized = ('hawk.{hawk_ver}.ts\n{ts}\n'
                   .format(hawk_ver=HAWK_VER, ts=ts))
-    log.debug(u'normalized resource for ts mac calc: {norm}'
-              .format(norm=normalized))
-    digestmod = getattr(hashlib, credentials['algorithm'])
+    log.debug(u'normalized resource for ts mac calc: %s', normalized)
 
     if not isinstance(normalized, six.binary_type):
         normalized = normalized.encode('utf8')
-    key = credentials['key']
-    if not isinstance(key, six.binary_type):
-        key = key.encode('ascii')
 
-    result = hmac.new(key, normalized, digestmod)
-    return b64encode(result.digest())
+    return b64encode(_hmac_digest(credentials, normalized))
 
 
 def normalize_string(mac_type, resource, content_hash):
@@ -153,12 +460,68 @@ def parse_content_type(content_type):
         return ''
 
 
+class ParsedHeader(Mapping):
+    """
+    Attributes of a parsed Hawk header.
+
+    Each allowed Hawk key is an attribute that is None when the header
+    did not include it. For compatibility this also behaves like a
+    read-only dict of the keys that were included.
+    """
+    __slots__ = ('id', 'ts', 'nonce', 'hash', 'ext', 'mac', 'app', 'dlg',
+                 'tsm', 'error')
+
+    def __init__(self):
+        self.id = None
+        self.ts = None
+        self.nonce = None
+        self.hash = None
+        self.ext = None
+        self.mac = None
+        self.app = None
+        self.dlg = None
+        self.tsm = None
+        self.error = None
+
+    def __getitem__(self, key):
+        if key in allowable_header_keys:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in allowable_header_keys:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        return default
+
+    def __contains__(self, key):
+        return (key in allowable_header_keys and
+                getattr(self, key) is not None)
+
+    def __iter__(self):
+        for key in self.__slots__:
+            if getattr(self, key) is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return '{cls}({attrs!r})'.format(cls=self.__class__.__name__,
+                                         attrs=dict(self.items()))
+
+
 def parse_authorization_header(auth_header):
     """
     Example Authorization header:
 
         'Hawk id="dh37fgj492je", ts="1367076201", nonce="NPHgnG", ext="and
         welcome!", mac="CeWHy4d9kbLGhDlkyw2Nh3PJ7SDOdZDa267KH4ZaNMY="'
+
+    Returns a :class:`mohawk.util.ParsedHeader`.
     """
     if len(auth_header) > MAX_LENGTH:
         raise BadHeaderValue('Header exceeds maximum length of {max_length}'.format(
@@ -174,63 +537,99 @@ def parse_authorization_header(auth_header):
         raise HawkFail("Unknown scheme '{scheme}' when parsing header"
                        .format(scheme=scheme))
 
+    # When every character is allowed in a value (or is a quote, which
+    # can't be inside a value) there is no need to check each value.
+    check_values = _header_chars.match(attributes_string) is None
+
+    attributes = ParsedHeader()
+    unparsed = []
+    pos = 0
 
-    attributes = {}
+    # Walk over all the key="value"-pairs in the header and store them.
+    # Correctly formed headers leave nothing in between the pairs.
+    for match in HAWK_HEADER_RE.finditer(attributes_string):
+        start = match.start()
+        if start != pos:
+            unparsed.append(attributes_string[pos:start])
+        pos = match.end()
 
-    def replace_attribute(match):
-        """Extract the next key="value"-pair in the header."""
-        key = match.group('key')
-        value = match.group('value')
+        key, value = match.group('key', 'value')
         if key not in allowable_header_keys:
             raise HawkFail("Unknown Hawk key '{key}' when parsing header"
                            .format(key=key))
-        validate_header_attr(value, name=key)
-        if key in attributes:
+        if check_values:
+            validate_header_attr(value, name=key)
+        if getattr(attributes, key) is not None:
             raise BadHeaderValue('Duplicate key in header: {key}'.format(key=key))
-        attributes[key] = value
+        setattr(attributes, key, value)
 
-    # Iterate over all the key="value"-pairs in the header, replace them with
-    # an empty string, and store the extracted attribute in the attributes
-    # dict. Correctly formed headers will then leave nothing unparsed ('').
-    unparsed_header = HAWK_HEADER_RE.sub(replace_attribute, attributes_string)
-    if unparsed_header != '':
-        raise BadHeaderValue("Couldn't parse Hawk header", unparsed_header)
+    if pos != len(attributes_string):
+        unparsed.append(attributes_string[pos:])
+    if unparsed:
+        raise BadHeaderValue("Couldn't parse Hawk header", ''.join(unparsed))
 
-    log.debug('parsed Hawk header: {header} into: \n{parsed}'
-              .format(header=auth_header, parsed=pprint.pformat(attributes)))
+    log.debug('parsed Hawk header: %s into: %r', auth_header, attributes)
     return attributes
 
 
 def strings_match(a, b):
     # Constant time string comparision, mitigates side channel attacks.
-    if len(a) != len(b):
-        return False
-    result = 0
+    if isinstance(a, six.text_type):
+        a = a.encode('utf8')
+    if isinstance(b, six.text_type):
+        b = b.encode('utf8')
+    return hmac.compare_digest(a, b)
 
-    def byte_ints(buf):
-        for ch in buf:
-            # In Python 3, if we have a bytes object, iterating it will
-            # already get the integer value. In older pythons, we need
-            # to use ord().
-            if not isinstance(ch, int):
-                ch = ord(ch)
-            yield ch
 
-    for x, y in zip(byte_ints(a), byte_ints(b)):
-        result |= x ^ y
-    return result == 0
+def decode_digest(value):
+    """
+    Decodes a base64 digest sent by the other side.
+
+    Returns None if ``value`` is not the canonical base64 encoding
+    of the digest.
+    """
+    try:
+        if isinstance(value, six.text_type):
+            value = value.encode('ascii')
+        digest = b64decode(value)
+    except (TypeError, ValueError):
+        # binascii.Error and UnicodeEncodeError are ValueErrors.
+        return None
+    # Decoding ignores stray characters and unused bits, so only accept
+    # what encodes back to the same value.
+    if b64encode(digest) != value:
+        return None
+    return digest
+
+
+def digest_matches(digest, value):
+    """
+    Compares a raw digest with a base64 digest sent by the other side
+    in constant time.
+    """
+    their_digest = decode_digest(value)
+    if digest is None or their_digest is None:
+        return False
+    return hmac.compare_digest(digest, their_digest)
 
 
 def utc_now(offset_in_seconds=0.0):
     # TODO: add support for SNTP server? See ntplib module.
-    return int(math.floor(calendar.timegm(time.gmtime()) +
-                          float(offset_in_seconds)))
+    # Truncating time.time() gives the same whole seconds as
+    # calendar.timegm(time.gmtime()) without building a struct_time.
+    now = int(time.time())
+    if not offset_in_seconds:
+        return now
+    return int(math.floor(now + float(offset_in_seconds)))
 
 
 # Allowed value characters:
 # !#$%&'()*+,-./:;<=>?@[]^_`{|}~ and space, a-z, A-Z, 0-9, \, "
 _header_attribute_chars = re.compile(
     r"^[ a-zA-Z0-9_\!#\$%&'\(\)\*\+,\-\./\:;<\=>\?@\[\]\^`\{\|\}~]*$")
+# The same characters plus the quotes around values.
+_header_chars = re.compile(
+    r"^[ a-zA-Z0-9_\!#\$%&'\(\)\*\+,\-\./\:;<\=>\?@\[\]\^`\{\|\}~\"]*$")
 
 
 def validate_header_attr(val, name=None):
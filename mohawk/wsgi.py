@@ -0,0 +1,320 @@
+"""
+WSGI middleware that verifies `Hawk`_ requests and signs their responses.
+
+.. _`Hawk`: https://github.com/hueniverse/hawk
+"""
+import logging
+import sys
+
+import six
+from six.moves.urllib.parse import quote
+
+from .base import (_default_ports,
+                   _split_host,
+                   default_ts_skew_in_seconds,
+                   ParsedURL)
+from .exc import HawkFail, MissingAuthorization
+from .receiver import (_lookup_credentials,
+                       _parse_request_header,
+                       _StreamedContent,
+                       Receiver)
+from .util import PayloadHasher
+
+__all__ = ['HashingInput', 'HawkMiddleware', 'environ_url']
+log = logging.getLogger(__name__)
+
+
+def environ_url(environ):
+    """
+    Returns the :data:`mohawk.base.ParsedURL` of a WSGI request.
+
+    The path and query string are taken as the client sent them from
+    ``RAW_URI`` (gunicorn) or ``REQUEST_URI`` (uWSGI and others) when the
+    server provides one. Otherwise they are rebuilt from the decoded
+    ``PATH_INFO``, which only matches the signed URL if the client quoted
+    it the same way.
+
+    :param environ: The WSGI environment.
+    :type environ: dict
+    """
+    scheme = environ.get('wsgi.url_scheme', 'http')
+    host = environ.get('HTTP_HOST')
+    if host:
+        hostname, port = _split_host(host, scheme)
+    else:
+        hostname = environ['SERVER_NAME'].lower()
+        port = (environ.get('SERVER_PORT') or
+                _default_ports.get(scheme, 'None'))
+
+    raw_uri = environ.get('RAW_URI') or environ.get('REQUEST_URI')
+    if raw_uri and raw_uri.startswith('/'):
+        return ParsedURL(raw_uri, hostname, port)
+
+    path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+    if six.PY3:
+        # WSGI decodes the path bytes as latin-1 on Python 3.
+        path = path.encode('latin-1')
+    name = quote(path, safe="/:@!$&'()*+,;=~")
+    query_string = environ.get('QUERY_STRING')
+    if query_string:
+        name = '{name}?{query}'.format(name=name, query=query_string)
+
+    return ParsedURL(name, hostname, port)
+
+
+class _StreamingReceiver(_StreamedContent, Receiver):
+    __slots__ = ('_accept_untrusted_content',)
+
+
+class HawkMiddleware(object):
+    """
+    WSGI middleware that only lets through requests signed with `Hawk`_.
+
+    The MAC, timestamp and nonce of each request are checked before the
+    wrapped application is called. ``wsgi.input`` is replaced with a stream
+    that hashes the request body as the application reads it, so the body
+    is never held in memory by Mohawk. If the body does not match the hash
+    signed by the sender, the read that reaches the end of the body raises
+    :class:`mohawk.exc.MisComputedContentHash`.
+
+    The response is hashed as the application produces it and held back
+    until it is complete so that a ``Server-Authorization`` header can be
+    added. A response is never sent for a request whose body turns out to
+    be tampered with: the rest of the body is read if the application
+    didn't, and a 401 is sent instead when the hash doesn't match.
+
+    The :class:`mohawk.Receiver` of the request is available to the
+    application as ``environ['hawk']``.
+
+    :param app: The WSGI application to wrap.
+
+    :param credentials_map:
+        Callable to look up the credentials dict by sender ID,
+        just like for :class:`mohawk.Receiver`.
+    :type credentials_map: callable
+
+    :param seen_nonce=None:
+        A callable that returns True if a nonce has been seen.
+        See :ref:`nonce` for details.
+    :type seen_nonce=None: callable
+
+    Other keyword arguments, such as ``timestamp_skew_in_seconds``,
+    are used like the ones of :class:`mohawk.Receiver`.
+
+    .. _`Hawk`: https://github.com/hueniverse/hawk
+    """
+
+    def __init__(self, app, credentials_map, seen_nonce=None,
+                 accept_untrusted_content=False,
+                 localtime_offset_in_seconds=0,
+                 timestamp_skew_in_seconds=default_ts_skew_in_seconds):
+        self.app = app
+        self.credentials_map = credentials_map
+        self.seen_nonce = seen_nonce
+        self.accept_untrusted_content = accept_untrusted_content
+        self.localtime_offset_in_seconds = localtime_offset_in_seconds
+        self.timestamp_skew_in_seconds = timestamp_skew_in_seconds
+
+    def __call__(self, environ, start_response):
+        try:
+            receiver = self._accept(environ)
+        except HawkFail:
+            etype, exc, tb = sys.exc_info()
+            return _unauthorized(start_response, exc)
+
+        body = HashingInput(environ['wsgi.input'], receiver.resource.content,
+                            _content_length(environ),
+                            on_eof=receiver.check_content)
+        environ['wsgi.input'] = body
+        environ['hawk'] = receiver
+        response = _Response(receiver.resource.credentials['algorithm'])
+
+        try:
+            app_iter = self.app(environ, response.start_response)
+            try:
+                for chunk in app_iter:
+                    response.write(chunk)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+        except HawkFail:
+            if body.error is None:
+                raise
+
+        if body.error is None:
+            try:
+                body.drain()
+            except HawkFail:
+                pass
+        if body.error is not None:
+            return _unauthorized(start_response, body.error)
+
+        header = receiver.respond(content=response.hasher)
+        start_response(response.status,
+                       response.headers + [('Server-Authorization', header)],
+                       response.exc_info)
+        return response.body
+
+    def _accept(self, environ):
+        authorization = environ.get('HTTP_AUTHORIZATION')
+        content_type = environ.get('CONTENT_TYPE', '')
+
+        log.debug('accepting request %s', authorization)
+        if not authorization:
+            raise MissingAuthorization()
+
+        parsed_header = _parse_request_header(authorization)
+        credentials = _lookup_credentials(self.credentials_map,
+                                          parsed_header['id'])
+
+        return _StreamingReceiver._from_parsed_header(
+            self.credentials_map, parsed_header, credentials,
+            environ_url(environ), environ['REQUEST_METHOD'],
+            seen_nonce=self.seen_nonce,
+            content=PayloadHasher(credentials['algorithm'], content_type),
+            content_type=content_type,
+            localtime_offset_in_seconds=self.localtime_offset_in_seconds,
+            accept_untrusted_content=self.accept_untrusted_content,
+            timestamp_skew_in_seconds=self.timestamp_skew_in_seconds)
+
+
+def _content_length(environ):
+    if environ.get('wsgi.input_terminated'):
+        # The server tells us when the body ends.
+        return None
+    try:
+        return max(0, int(environ.get('CONTENT_LENGTH') or 0))
+    except ValueError:
+        return 0
+
+
+class HashingInput(object):
+    """
+    A ``wsgi.input`` stream that adds the body to a payload hash
+    as it is read.
+
+    :param stream: The original ``wsgi.input`` stream.
+
+    :param hasher: The hasher to update.
+    :type hasher: :class:`mohawk.util.PayloadHasher`
+
+    :param length:
+        Length of the body in bytes, or None to read until the stream
+        returns an empty string.
+    :type length: int
+
+    :param on_eof=None:
+        Callable to call once the whole body was read. An exception
+        it raises is raised by the read that reached the end of the body.
+    :type on_eof=None: callable
+    """
+
+    def __init__(self, stream, hasher, length, on_eof=None):
+        self.stream = stream
+        self.hasher = hasher
+        self.remaining = length
+        self.on_eof = on_eof
+        #: True once the whole body was read.
+        self.done = False
+        #: Exception raised by ``on_eof``.
+        self.error = None
+
+    def _limit(self, size):
+        if size is None or size < 0:
+            return self.remaining
+        if self.remaining is None:
+            return size
+        return min(size, self.remaining)
+
+    def _feed(self, data, eof=False):
+        if data:
+            self.hasher.update(data)
+            if self.remaining is not None:
+                self.remaining -= len(data)
+        if not data or eof or self.remaining == 0:
+            self._eof()
+        return data
+
+    def _eof(self):
+        self.done = True
+        if self.on_eof is not None:
+            try:
+                self.on_eof()
+            except Exception:
+                self.error = sys.exc_info()[1]
+                raise
+
+    def read(self, size=-1):
+        if self.done:
+            return b''
+        if size == 0:
+            return b''
+        size = self._limit(size)
+        if size is None:
+            return self._feed(self.stream.read(), eof=True)
+        if size == 0:
+            return self._feed(b'')
+        return self._feed(self.stream.read(size))
+
+    def readline(self, size=-1):
+        if self.done:
+            return b''
+        if size == 0:
+            return b''
+        size = self._limit(size)
+        if size is None:
+            return self._feed(self.stream.readline())
+        if size == 0:
+            return self._feed(b'')
+        return self._feed(self.stream.readline(size))
+
+    def readlines(self, hint=None):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def drain(self, block_size=64 * 1024):
+        """Reads and hashes the rest of the body."""
+        while not self.done:
+            self.read(block_size)
+
+
+class _Response(object):
+    # A response held back until it can be signed.
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        self.status = None
+        self.headers = None
+        self.exc_info = None
+        self.hasher = None
+        self.body = []
+
+    def start_response(self, status, headers, exc_info=None):
+        if self.status is not None and exc_info is None:
+            raise AssertionError('start_response() was already called')
+        self.status = status
+        self.headers = list(headers)
+        self.exc_info = exc_info
+        content_type = ''
+        for name, value in self.headers:
+            if name.lower() == 'content-type':
+                content_type = value
+        self.hasher = PayloadHasher(self.algorithm, content_type)
+        return self.write
+
+    def write(self, data):
+        if data:
+            self.hasher.update(data)
+            self.body.append(data)
+
+
+def _unauthorized(start_response, exc):
+    log.info('rejecting request: %s: %s', exc.__class__.__name__, exc)
+    start_response('401 Unauthorized', [
+        ('Content-Type', 'text/plain; charset=utf-8'),
+        ('WWW-Authenticate', getattr(exc, 'www_authenticate', None) or
+         'Hawk'),
+    ])
+    return [b'Unauthorized']